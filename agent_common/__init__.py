@@ -0,0 +1,6 @@
+"""
+Shared building blocks for the MoodFusion agents (meal, movie and trivia).
+
+Each agent is still deployed as its own Cloud Run service; this package is
+copied into every agent image next to its main.py.
+"""
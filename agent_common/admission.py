@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from agent_common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (overridable per upstream, see admission_limiter) ---
+DEFAULT_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 64))
+DEFAULT_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 64))
+DEFAULT_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_SECONDS', 2))
+DEFAULT_RETRY_AFTER_SECONDS = float(os.environ.get('ADMISSION_RETRY_AFTER_SECONDS', 1))
+
+ADMISSION_REJECTED = registry.counter(
+    "moodfusion_admission_rejected_total", "Upstream calls shed because the upstream's concurrency limit and wait queue were saturated.", ["limiter", "reason"])
+ADMISSION_QUEUE_SECONDS = registry.histogram(
+    "moodfusion_admission_queue_seconds", "Time admitted calls waited for a free upstream slot.", ["limiter"])
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed; the request should be answered with 503 and Retry-After."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class _ThreadWaiter:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def wake(self):
+        self.event.set()
+
+    def woken(self):
+        return self.event.is_set()
+
+
+class _AsyncWaiter:
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self._woken = False
+
+    def wake(self):
+        self._woken = True
+        self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+    def woken(self):
+        return self._woken
+
+
+class AdmissionLimiter:
+    """
+    Bounded concurrency for calls to one upstream, with a bounded FIFO wait queue.
+    A call runs at once while fewer than max_concurrent are in flight, otherwise it waits
+    in the queue for at most queue_timeout seconds (or its own, shorter, timeout). A call
+    that finds the queue full or times out is shed with Overloaded instead of adding to a
+    backlog that would slow down every request already admitted.
+    Works for threads and asyncio tasks alike, so sync and async clients can share one.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, retry_after):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+
+    def _reject(self, reason):
+        self.rejected += 1
+        ADMISSION_REJECTED.inc(limiter=self.name, reason=reason)
+        return Overloaded(f"{self.name} is at capacity ({reason.replace('_', ' ')}). Please retry shortly.", self.retry_after)
+
+    def _enter_or_enqueue(self, make_waiter):
+        """Takes a slot (returns None) or joins the queue (returns the waiter). Raises Overloaded if the queue is full."""
+        with self._lock:
+            if self.in_flight < self.max_concurrent and not self._waiters:
+                self.in_flight += 1
+                self.admitted += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject("queue_full")
+            waiter = make_waiter()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _leave_queue(self, waiter, reason):
+        """Called when a waiter gives up. Returns True if a slot was handed to it just in time."""
+        with self._lock:
+            if waiter.woken():
+                return True
+            self._waiters.remove(waiter)
+            if reason:
+                raise self._reject(reason)
+            return False
+
+    def _wait_timeout(self, timeout):
+        return self.queue_timeout if timeout is None else max(0.0, min(self.queue_timeout, timeout))
+
+    def check(self):
+        """
+        Raises Overloaded if a new call would be shed right away (all slots busy and the queue
+        full). For work that has to decide before committing to a response, like a stream.
+        """
+        with self._lock:
+            if self.in_flight >= self.max_concurrent and len(self._waiters) >= self.max_queue:
+                raise self._reject("queue_full")
+
+    def acquire(self, timeout=None):
+        """Blocks until a slot is free. Raises Overloaded if the queue is full or the wait times out."""
+        started = time.perf_counter()
+        waiter = self._enter_or_enqueue(_ThreadWaiter)
+        if waiter is not None and not waiter.event.wait(self._wait_timeout(timeout)):
+            self._leave_queue(waiter, "queue_timeout")
+        ADMISSION_QUEUE_SECONDS.observe(time.perf_counter() - started, limiter=self.name)
+
+    async def acquire_async(self, timeout=None):
+        """Async version of acquire."""
+        started = time.perf_counter()
+        waiter = self._enter_or_enqueue(lambda: _AsyncWaiter(asyncio.get_running_loop()))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self._wait_timeout(timeout))
+            except asyncio.TimeoutError:
+                self._leave_queue(waiter, "queue_timeout")
+            except asyncio.CancelledError:
+                if self._leave_queue(waiter, None):
+                    self.release()
+                raise
+        ADMISSION_QUEUE_SECONDS.observe(time.perf_counter() - started, limiter=self.name)
+
+    def release(self):
+        """Frees a slot, handing it straight to the longest-waiting call if there is one."""
+        with self._lock:
+            if self._waiters:
+                self.admitted += 1
+                self._waiters.popleft().wake()
+            else:
+                self.in_flight -= 1
+
+    @contextmanager
+    def admit(self, timeout=None):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def admit_async(self, timeout=None):
+        await self.acquire_async(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "maxConcurrent": self.max_concurrent,
+                "inFlight": self.in_flight,
+                "queued": len(self._waiters),
+                "maxQueue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def admission_limiter(name, max_concurrent=None):
+    """
+    The process-wide limiter for an upstream, shared by its sync and async clients.
+    Tuned with <NAME>_MAX_CONCURRENT / _MAX_QUEUE / _QUEUE_TIMEOUT_SECONDS / _RETRY_AFTER_SECONDS,
+    falling back to the ADMISSION_* defaults (max_concurrent, if given, replaces ADMISSION_MAX_CONCURRENT).
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            prefix = name.upper()
+            setting = lambda key, default: os.environ.get(f'{prefix}_{key}', default)
+            _limiters[name] = AdmissionLimiter(
+                name,
+                max_concurrent=int(setting('MAX_CONCURRENT', max_concurrent or DEFAULT_MAX_CONCURRENT)),
+                max_queue=int(setting('MAX_QUEUE', DEFAULT_MAX_QUEUE)),
+                queue_timeout=float(setting('QUEUE_TIMEOUT_SECONDS', DEFAULT_QUEUE_TIMEOUT_SECONDS)),
+                retry_after=float(setting('RETRY_AFTER_SECONDS', DEFAULT_RETRY_AFTER_SECONDS)),
+            )
+        return _limiters[name]
+
+
+def admission_report():
+    with _limiters_lock:
+        return [limiter.stats() for limiter in _limiters.values()]
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from agent_common.metrics import record_upstream
+from agent_common.resilience import CircuitOpen, LatencyTracker, circuit_breaker
+from agent_common.upstream import (
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+    HEDGE_MAX_RATIO,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    HEDGES,
+    RETRY_STATUSES,
+    retry_after_seconds,
+)
+
+logger = logging.getLogger(__name__)
+
+# Failures where the request never reached the upstream (or the connection dropped before a
+# response started), the same set requests.exceptions.ConnectionError covers on the sync path.
+# Read timeouts are not retried: the upstream may already have served, and billed, the call.
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class AsyncCircuitOpenError(CircuitOpen, httpx.TransportError):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class AsyncUpstreamClient:
+    """
+    Async counterpart of UpstreamClient for the ASGI serving mode.
+    Wraps an httpx.AsyncClient with a bounded keep-alive pool, the same connect/read
+    timeouts (capped at the request deadline), retry-with-backoff on connection errors and
+    transient statuses, the upstream's shared circuit breaker and admission limiter, and
+    optional hedging.
+    The httpx client is created lazily so it binds to the server's running event loop.
+    """
+
+    def __init__(self, name, max_connections=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff_factor=None, hedge=False, limiter=None):
+        self.name = name
+        self.limiter = limiter
+        self.hedge = hedge
+        self.latency = LatencyTracker()
+        self.requests = 0
+        self.hedges = 0
+        self.timeout = httpx.Timeout(
+            read_timeout if read_timeout is not None else DEFAULT_READ_TIMEOUT,
+            connect=connect_timeout if connect_timeout is not None else DEFAULT_CONNECT_TIMEOUT,
+        )
+        size = max_connections or DEFAULT_POOL_MAXSIZE
+        self.limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+        self.max_retries = max_retries if max_retries is not None else DEFAULT_MAX_RETRIES
+        self.backoff_factor = backoff_factor if backoff_factor is not None else DEFAULT_BACKOFF_FACTOR
+        self._client = None
+
+    def _http(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    async def get(self, url, params=None, timeout=None, endpoint="other", deadline=None):
+        """Issues a pooled GET, retrying connection errors and 429/5xx responses within the deadline."""
+        send = lambda: self._timed(endpoint, url, params, timeout, deadline)
+        if self.hedge:
+            return await self._hedged(endpoint, send, deadline)
+        return await send()
+
+    async def _timed(self, endpoint, url, params, timeout, deadline):
+        """Same admission, breaker and timing rules as UpstreamClient._timed."""
+        if deadline is not None and deadline.expired():
+            raise httpx.TimeoutException(f"Request deadline exceeded before calling {self.name} {endpoint}.")
+        if self.limiter is None:
+            return await self._call(endpoint, url, params, timeout, deadline)
+        async with self.limiter.admit_async(deadline.remaining() if deadline is not None else None):
+            return await self._call(endpoint, url, params, timeout, deadline)
+
+    async def _call(self, endpoint, url, params, timeout, deadline):
+        breaker = circuit_breaker(self.name)
+        if not breaker.allow():
+            raise AsyncCircuitOpenError(f"Circuit for {self.name} is open; not calling {endpoint}.")
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._get_with_retries(url, params, timeout, deadline)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            if not (isinstance(e, httpx.TimeoutException) and deadline is not None and deadline.expired()):
+                breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"  # The losing side of a hedge
+            raise
+        finally:
+            record_upstream(self.name, endpoint, status, time.perf_counter() - started)
+        if response.status_code in RETRY_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            self.latency.record(endpoint, time.perf_counter() - started)
+        return response
+
+    async def _hedged(self, endpoint, send, deadline):
+        """Async version of UpstreamClient._hedged; the losing request is cancelled."""
+        delay = self.latency.percentile(endpoint, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+        self.requests += 1
+        if delay is None or self.hedges >= HEDGE_MAX_RATIO * self.requests:
+            return await send()
+
+        original = asyncio.ensure_future(send())
+        tasks = [original]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or (deadline is not None and deadline.expired()):
+                return await original
+
+            self.hedges += 1
+            hedge = asyncio.ensure_future(send())
+            tasks.append(hedge)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        HEDGES.inc(upstream=self.name, endpoint=endpoint, winner="hedge" if task is hedge else "original")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _attempt_timeout(self, timeout, deadline):
+        timeout = timeout or self.timeout
+        if deadline is None:
+            return timeout
+        remaining = max(deadline.remaining(), 0.001)
+        if isinstance(timeout, httpx.Timeout):
+            return httpx.Timeout(min(timeout.read, remaining), connect=min(timeout.connect, remaining))
+        return min(timeout, remaining)
+
+    async def _get_with_retries(self, url, params, timeout, deadline):
+        for attempt in range(self.max_retries + 1):
+            backoff = self.backoff_factor * (2 ** attempt)
+            try:
+                response = await self._http().get(url, params=params, timeout=self._attempt_timeout(timeout, deadline))
+            except RETRY_ERRORS as e:
+                if self._last_attempt(attempt, backoff, deadline):
+                    raise
+                logger.warning(f"{self.name} GET failed ({e}); retrying.")
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                backoff = max(backoff, retry_after_seconds(response))
+                if self._last_attempt(attempt, backoff, deadline):
+                    return response
+                await response.aclose()
+            await asyncio.sleep(backoff)
+
+    def _last_attempt(self, attempt, backoff, deadline):
+        """No retry once they are used up, or once the deadline wouldn't leave time for one."""
+        return attempt == self.max_retries or (deadline is not None and deadline.remaining() <= backoff)
+
+    def stats(self):
+        return {"name": self.name, "hedgedRequests": self.requests, "hedges": self.hedges}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
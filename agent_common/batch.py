@@ -0,0 +1,69 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# --- Batch Limits (overridable per agent through environment variables) ---
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 100))
+# Distinct moods resolved per Gemini call; larger batches are split into several calls
+BATCH_INFERENCE_CHUNK = int(os.environ.get('BATCH_INFERENCE_CHUNK', 25))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 8))
+# Budget for a whole batch; items still unresolved when it runs out are reported as errors
+BATCH_DEADLINE_SECONDS = float(os.environ.get('BATCH_DEADLINE_SECONDS', 30))
+
+
+class BatchRequestError(ValueError):
+    """A batch request body that cannot be processed at all (answered with 400)."""
+
+
+def _invalid_field(item, fields):
+    for field in fields:
+        if item.get(field) is not None and not isinstance(item[field], str):
+            return field
+    return None
+
+
+def read_batch_items(data, defaults=None):
+    """
+    Validates a batch body of the form {"items": [...]}. Each item is either a mood string
+    or an object with the single-request fields; missing fields are filled from defaults.
+    An item that is neither, or whose mood (or a field with a default) is not a string,
+    gets an 'error' (see item_errors) so it fails on its own instead of failing the batch.
+    """
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchRequestError("Expected a non-empty 'items' list in request body")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchRequestError(f"Too many items in batch ({len(items)}); the limit is {BATCH_MAX_ITEMS}")
+    fields = ("mood",) + tuple(defaults or {})
+    invalid_default = _invalid_field(defaults or {}, fields)
+    if invalid_default:
+        raise BatchRequestError(f"'{invalid_default}' must be a string")
+
+    parsed = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"mood": item}
+        elif not isinstance(item, dict):
+            item = {"error": "Each item must be a mood string or an object"}
+        item = {**(defaults or {}), **item}
+        invalid = _invalid_field(item, fields)
+        if invalid:
+            item["error"] = f"'{invalid}' must be a string"
+        parsed.append(item)
+    return parsed
+
+
+def item_errors(items):
+    """Index -> error for the items read_batch_items marked invalid or that have no mood."""
+    return {
+        i: item.get("error") or "Missing 'mood'"
+        for i, item in enumerate(items)
+        if "error" in item or not item.get("mood")
+    }
+
+
+def chunked(values, size):
+    """Splits a list into consecutive chunks of at most size elements."""
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket for tracking an upstream quota.
+    Tokens refill continuously up to capacity. The bucket can be re-synced from the
+    remaining quota an upstream reports, or frozen until a known reset time.
+    """
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._frozen_until = 0.0  # wall-clock time before which no tokens refill
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.denied = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        if time.time() >= self._frozen_until:
+            elapsed = now - self._updated_at
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_per_second)
+        self._updated_at = now
+
+    def try_acquire(self, tokens=1.0):
+        """Takes tokens if available. Returns False without blocking when the budget is spent."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.granted += 1
+                return True
+            self.denied += 1
+            return False
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def set_available(self, tokens):
+        """Re-syncs the bucket with the remaining quota reported by the upstream."""
+        with self._lock:
+            self._refill()
+            self._tokens = max(0.0, min(self.capacity, float(tokens)))
+
+    def exhaust_until(self, resume_at):
+        """Empties the bucket and stops refilling until the wall-clock time resume_at."""
+        with self._lock:
+            self._tokens = 0.0
+            self._frozen_until = resume_at
+            self._updated_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            self._refill()
+            return {
+                "available": round(self._tokens, 3),
+                "capacity": self.capacity,
+                "granted": self.granted,
+                "denied": self.denied,
+                "exhaustedUntil": self._frozen_until if self._frozen_until > time.time() else None,
+            }
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# --- Key Helpers ---
+def normalize_mood(mood):
+    """Lowercases a mood and collapses whitespace so equivalent moods share a cache key."""
+    return " ".join((mood or "").lower().split())
+
+
+def make_key(*parts):
+    """Builds a cache key from normalized parts."""
+    return "|".join(normalize_mood(str(p)) for p in parts)
+
+
+# --- Inference Cache ---
+class InferenceCache:
+    """
+    Thread-safe LRU cache with per-entry TTL and hit/miss counters.
+    Values must be JSON-serializable. If a Redis URL is given, entries are also
+    written to Redis so every Cloud Run instance can reuse them; the local LRU
+    still serves as the first tier.
+    """
+
+    def __init__(self, name, max_entries=1024, ttl_seconds=3600, redis_url=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self._redis = self._connect_redis(redis_url) if redis_url else None
+
+    def _connect_redis(self, redis_url):
+        """Connects to the optional shared backing store. Falls back to local-only on any error."""
+        try:
+            import redis  # Optional dependency, only needed for the shared store
+            client = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            client.ping()
+            logger.info(f"Cache '{self.name}' using shared Redis store.")
+            return client
+        except Exception as e:
+            logger.warning(f"Cache '{self.name}' could not connect to Redis ({e}). Using local cache only.")
+            return None
+
+    def _redis_key(self, key):
+        return f"moodfusion:{self.name}:{key}"
+
+    @property
+    def shared(self):
+        """True if lookups can go to the shared (network) store."""
+        return self._redis is not None
+
+    def _get_local(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+        return None
+
+    def _get_shared(self, key):
+        try:
+            raw = self._redis.get(self._redis_key(key))
+            if raw is not None:
+                value = json.loads(raw)
+                self._store_local(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+        except Exception as e:
+            logger.warning(f"Cache '{self.name}' Redis read failed: {e}")
+        return self._miss()
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss or expired entry."""
+        value = self._get_local(key)
+        if value is not None:
+            return value
+        if self._redis is not None:
+            return self._get_shared(key)
+        return self._miss()
+
+    async def get_async(self, key):
+        """get() for the event loop: a local hit is served inline, the Redis round trip runs in a worker thread."""
+        value = self._get_local(key)
+        if value is not None:
+            return value
+        if self._redis is not None:
+            return await asyncio.to_thread(self._get_shared, key)
+        return self._miss()
+
+    def set(self, key, value):
+        """Stores value under key in the local LRU and, if configured, the shared store."""
+        self._store_local(key, value)
+        if self._redis is not None:
+            self._set_shared(key, value)
+
+    async def set_async(self, key, value):
+        """set() for the event loop: the Redis write runs in a worker thread."""
+        self._store_local(key, value)
+        if self._redis is not None:
+            await asyncio.to_thread(self._set_shared, key, value)
+
+    def _set_shared(self, key, value):
+        try:
+            self._redis.set(self._redis_key(key), json.dumps(value), ex=int(self.ttl_seconds))
+        except Exception as e:
+            logger.warning(f"Cache '{self.name}' Redis write failed: {e}")
+
+    def _store_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "sharedHits": self.shared_hits,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "sharedStore": self._redis is not None,
+            }
+
+
+async def call_with_caches(caches, fn, *args):
+    """
+    Runs fn, a blocking function that reads or writes the given caches, from the event loop:
+    in a worker thread if any of them uses the shared store, inline if they are all local.
+    """
+    if any(cache.shared for cache in caches):
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+def cache_from_env(name, prefix='INFERENCE_CACHE', max_entries=2048, ttl_seconds=6 * 3600):
+    """Creates an InferenceCache configured from <prefix>_MAX_ENTRIES, _TTL_SECONDS and _REDIS_URL."""
+    return InferenceCache(
+        name,
+        max_entries=int(os.environ.get(f'{prefix}_MAX_ENTRIES', max_entries)),
+        ttl_seconds=float(os.environ.get(f'{prefix}_TTL_SECONDS', ttl_seconds)),
+        redis_url=os.environ.get(f'{prefix}_REDIS_URL') or None,
+    )
@@ -0,0 +1,206 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Covers sub-millisecond cache hits up to multi-second Gemini calls.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# --- Metric Types ---
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(labelnames, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# --- Shared Agent Metrics ---
+registry = Registry()
+REQUEST_SECONDS = registry.histogram(
+    "moodfusion_http_request_duration_seconds", "Time to answer an HTTP request.", ["endpoint", "method", "status"])
+STAGE_SECONDS = registry.histogram(
+    "moodfusion_stage_duration_seconds", "Time spent in one stage of a request (Gemini inference, parsing, serialization, ...).", ["stage"])
+UPSTREAM_SECONDS = registry.histogram(
+    "moodfusion_upstream_request_duration_seconds", "Time per upstream HTTP call, retries included.", ["upstream", "endpoint", "status"])
+FALLBACKS = registry.counter(
+    "moodfusion_fallbacks_total", "Requests that took a fallback path (default keywords or genres, popular results, cached recipes).", ["fallback"])
+INFERENCE_SOURCES = registry.counter(
+    "moodfusion_inference_source_total", "Where mood inferences were answered from (cache, mood index, Gemini, or the precomputed snapshot).", ["source"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Timing Spans ---
+# Stages timed during the current request, collected for the Server-Timing header and timing log line.
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+@contextmanager
+def span(stage):
+    """Times a block as one request stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def record_upstream(upstream, endpoint, status, seconds):
+    UPSTREAM_SECONDS.observe(seconds, upstream=upstream, endpoint=endpoint, status=status)
+
+
+def count_fallback(fallback):
+    FALLBACKS.inc(fallback=fallback)
+
+
+def count_inference_source(source):
+    INFERENCE_SOURCES.inc(source=source)
+
+
+def _finish_request(agent_name, endpoint, method, status, started, spans, response_headers):
+    elapsed = time.perf_counter() - started
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=method, status=status)
+    # Server-Timing lets browser dev tools and the bundle agent see the stage breakdown
+    timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in spans]
+    response_headers["Server-Timing"] = ", ".join(timings + [f"total;dur={elapsed * 1000:.1f}"])
+    if spans:
+        logger.info(json.dumps({
+            "event": "request_timing", "agent": agent_name, "endpoint": endpoint, "status": status,
+            "totalMs": round(elapsed * 1000, 1),
+            "stagesMs": {stage: round(seconds * 1000, 1) for stage, seconds in spans},
+        }))
+
+
+def install_metrics(app, agent_name):
+    """Adds GET /metrics (Prometheus text format) and per-request timing to a Flask app."""
+    from flask import Response, g, request
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint."""
+        return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.before_request
+    def start_request_timing():
+        g.request_started = time.perf_counter()
+        g.request_spans = []
+        _request_spans.set(g.request_spans)
+
+    @app.after_request
+    def finish_request_timing(response):
+        if request.endpoint != "metrics" and "request_started" in g:
+            _finish_request(agent_name, request.endpoint or "unknown", request.method, str(response.status_code),
+                            g.request_started, g.request_spans, response.headers)
+        return response
+
+
+def install_async_metrics(app, agent_name):
+    """Quart counterpart of install_metrics for the async serving mode."""
+    from quart import Response, g, request
+
+    @app.route('/metrics', methods=['GET'])
+    async def metrics():
+        """Prometheus scrape endpoint."""
+        return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.before_request
+    async def start_request_timing():
+        g.request_started = time.perf_counter()
+        g.request_spans = []
+        _request_spans.set(g.request_spans)
+
+    @app.after_request
+    async def finish_request_timing(response):
+        if request.endpoint != "metrics" and "request_started" in g:
+            _finish_request(agent_name, request.endpoint or "unknown", request.method, str(response.status_code),
+                            g.request_started, g.request_spans, response.headers)
+        return response
@@ -0,0 +1,122 @@
+import json
+import logging
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from agent_common.cache import normalize_mood
+
+logger = logging.getLogger(__name__)
+
+# Words that flip a mood's meaning; "not happy" must never be answered with "happy"'s mapping
+NEGATIONS = frozenset(["not", "no", "never", "without", "isnt", "dont", "cant", "wont", "arent"])
+# Words that carry no mood of their own ("feeling so tired today" is "tired", "stressed out" is "stressed")
+FILLER_WORDS = frozenset([
+    "i", "im", "am", "feel", "feeling", "feels", "so", "very", "really", "quite", "pretty", "super", "totally",
+    "extremely", "too", "a", "an", "the", "bit", "little", "lot", "kind", "kinda", "sort", "sorta", "of", "just",
+    "today", "tonight", "right", "now", "out", "af", "vibes", "mood", "for", "me", "my",
+])
+
+
+def mood_words(mood):
+    """The words of a mood that carry meaning: lowercased, apostrophes dropped, filler words removed."""
+    return [w for w in re.findall(r"[a-z0-9]+", normalize_mood(mood).replace("'", "")) if w not in FILLER_WORDS]
+
+
+def word_features(word, ngrams=(2, 3)):
+    """Character bigrams and trigrams of the space-padded word, so a typo only changes a few of them."""
+    padded = f" {word} "
+    return [padded[i:i + n] for n in ngrams for i in range(len(padded) - n + 1)]
+
+
+class MoodIndex:
+    """
+    Nearest-neighbour lookup over known moods, used as a local fast path before Gemini.
+    Each distinct word of the known moods is a hashed bag of character n-grams, L2-normalized
+    into one row of a float32 matrix, so comparing a mood's words with all of them is one
+    matrix product. A known mood scores the similarity of its worst-aligned word: every word
+    of the mood and of the known mood must have a close counterpart on the other side, so
+    "happyy" matches "happy" but "happy and sad" or "not happy" don't. Matches below
+    min_score, or that disagree on negation, are misses and the caller asks Gemini.
+    """
+
+    def __init__(self, name, entries, dims=4096, min_score=0.7):
+        self.name = name
+        self.dims = dims
+        self.min_score = min_score
+        self._moods = [mood for mood in entries if mood_words(mood)]
+        self._values = [entries[mood] for mood in self._moods]
+        self._negated = np.array([self._is_negated(mood) for mood in self._moods], bool)
+        words = sorted({word for mood in self._moods for word in mood_words(mood)})
+        self._words = np.vstack([self._vectorize(word) for word in words]) if words else np.zeros((0, dims), np.float32)
+        # Word rows of each known mood, padded with -1 to the longest one
+        position = {word: i for i, word in enumerate(words)}
+        rows = [[position[word] for word in mood_words(mood)] for mood in self._moods]
+        width = max((len(r) for r in rows), default=0)
+        self._mood_words = np.array([r + [-1] * (width - len(r)) for r in rows], np.int64).reshape(len(rows), width)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_seed_file(cls, name, path, **kwargs):
+        """Builds the index from a JSON file mapping mood -> value."""
+        with open(path) as f:
+            entries = json.load(f)
+        index = cls(name, entries, **kwargs)
+        logger.info(f"Mood index '{name}' built with {len(entries)} moods from {path}.")
+        return index
+
+    def _vectorize(self, word):
+        vector = np.zeros(self.dims, np.float32)
+        for feature in word_features(word):
+            vector[zlib.crc32(feature.encode()) % self.dims] += 1.0
+        return vector / np.linalg.norm(vector)
+
+    @staticmethod
+    def _is_negated(mood):
+        return any(word in NEGATIONS for word in mood_words(mood))
+
+    def scores(self, mood):
+        """Alignment score of the mood against every known mood (0 where they share nothing)."""
+        words = mood_words(mood)
+        if not words or not self._moods:
+            return np.zeros(len(self._moods), np.float32)
+        similarity = np.vstack([self._vectorize(word) for word in words]) @ self._words.T  # query words x known words
+        padding = self._mood_words < 0
+        aligned = similarity[:, self._mood_words]  # query words x known moods x their words
+        # Each known word's best counterpart among the query words, and each query word's among the known mood's
+        known_covered = np.where(padding, np.inf, aligned.max(axis=0)).min(axis=1)
+        query_covered = np.where(padding, -np.inf, aligned).max(axis=2).min(axis=0)
+        return np.minimum(known_covered, query_covered)
+
+    def lookup(self, mood):
+        """Returns (value, score, matched_mood) for the closest known mood, or None below min_score."""
+        if not self._moods:
+            return None
+        scores = self.scores(mood)
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        matched = score >= self.min_score and self._negated[best] == self._is_negated(mood)
+        with self._lock:
+            if matched:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not matched:
+            return None
+        return self._values[best], score, self._moods[best]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "moods": len(self._moods),
+                "minScore": self.min_score,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
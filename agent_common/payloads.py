@@ -0,0 +1,128 @@
+"""
+Response payload handling shared by the agents: compression, cache headers and debug dumps.
+
+JSON and text responses are compressed with brotli or gzip, whichever the client prefers,
+once they are big enough for it to pay off. Brotli needs the optional `brotli` package.
+Streamed responses (trivia's server-sent events) go out untouched. Recommendations are random
+picks and the GET endpoints (/metrics, /cache_stats, /ready) report live counters, so no
+response is ever the same twice: all of them are marked `no-store`.
+
+Response bodies are only logged when DEBUG_PAYLOADS=true, one compact line per response.
+"""
+import gzip
+import logging
+import os
+
+from agent_common.metrics import registry, span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+RESPONSE_COMPRESSION_ENABLED = os.environ.get('RESPONSE_COMPRESSION_ENABLED', 'true').lower() == 'true'
+# Below this a compressed body saves less than the Content-Encoding costs to handle
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', 512))
+DEBUG_PAYLOADS = os.environ.get('DEBUG_PAYLOADS', 'false').lower() == 'true'
+
+# Fast settings: responses are a few KB and compressed once per request
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/plain", "text/html", "text/css", "application/javascript"}
+
+RESPONSE_BYTES = registry.counter(
+    "moodfusion_response_bytes_total", "Response body bytes sent, by content encoding.", ["encoding"])
+UNCOMPRESSED_BYTES = registry.counter(
+    "moodfusion_response_uncompressed_bytes_total", "Response body bytes before compression.")
+
+
+# --- Encoding ---
+def choose_encoding(accept_encodings):
+    """'br' or 'gzip', whichever the client's Accept-Encoding ranks higher (brotli on a tie), or None."""
+    best, best_quality = None, 0
+    for encoding in (("br",) if brotli else ()) + ("gzip",):
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _encode_body(response, accept_encodings, body):
+    """(encoding, body) to send: the compressed body, or (None, body) if it should go out as is."""
+    if not RESPONSE_COMPRESSION_ENABLED or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return None, body
+    response.vary.add("Accept-Encoding")
+    if len(body) < RESPONSE_COMPRESSION_MIN_BYTES or "Content-Encoding" in response.headers:
+        return None, body
+    encoding = choose_encoding(accept_encodings)
+    if not encoding:
+        return None, body
+    with span('compress'):
+        return encoding, compress(body, encoding)
+
+
+def _count_bytes(encoding, body, sent):
+    UNCOMPRESSED_BYTES.inc(len(body))
+    RESPONSE_BYTES.inc(len(sent), encoding=encoding or "identity")
+
+
+# --- Cache Headers ---
+def _set_cache_control(response):
+    """Marks the response uncacheable unless its view already set Cache-Control."""
+    if "Cache-Control" not in response.headers:
+        response.cache_control.no_store = True
+
+
+# --- Debug Payloads ---
+def _log_payload(agent_name, request, response, body):
+    if DEBUG_PAYLOADS and response.mimetype == "application/json":
+        logger.info(f"{agent_name} {request.method} {request.path} -> {response.status_code}: {body.decode('utf-8', 'replace')}")
+
+
+# --- Installers ---
+def install_payload_handling(app, agent_name):
+    """Adds response compression, Cache-Control headers and opt-in payload logging to a Flask app."""
+    from flask import request
+
+    @app.after_request
+    def finish_payload(response):
+        if response.is_streamed or response.direct_passthrough:
+            return response
+        body = response.get_data()
+        _log_payload(agent_name, request, response, body)
+        _set_cache_control(response)
+        encoding, sent = _encode_body(response, request.accept_encodings, body)
+        if encoding:
+            response.set_data(sent)
+            response.headers["Content-Encoding"] = encoding
+        _count_bytes(encoding, body, sent)
+        return response
+
+
+def install_async_payload_handling(app, agent_name):
+    """Quart counterpart of install_payload_handling for the async serving mode."""
+    from quart import request
+
+    @app.after_request
+    async def finish_payload(response):
+        if not isinstance(response.response, response.data_body_class):
+            return response  # Streamed
+        body = await response.get_data(as_text=False)
+        _log_payload(agent_name, request, response, body)
+        _set_cache_control(response)
+        encoding, sent = _encode_body(response, request.accept_encodings, body)
+        if encoding:
+            response.set_data(sent)
+            response.headers["Content-Encoding"] = encoding
+        _count_bytes(encoding, body, sent)
+        return response
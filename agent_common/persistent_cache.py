@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentCache:
+    """
+    Durable key -> JSON value cache backed by SQLite, with TTL-based refresh.
+    The file survives restarts and can be shared by instances that mount the same volume.
+    Each thread gets its own connection; WAL mode lets readers run alongside a writer.
+    """
+
+    def __init__(self, name, path, ttl_seconds=7 * 24 * 3600):
+        self.name = name
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Set up on a connection of its own and closed, so none is inherited by forked server workers
+        conn = sqlite3.connect(self.path, timeout=1.0)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " stored_at REAL NOT NULL)"
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        logger.info(f"Persistent cache '{name}' opened at {path}.")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """Returns the stored value, or None if missing, expired or unreadable."""
+        try:
+            row = self._conn().execute(
+                "SELECT value, stored_at FROM cache WHERE key = ?", (str(key),)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent cache '{self.name}' read failed: {e}")
+            self._count("errors")
+            return None
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Stores value under key. Write failures are logged and otherwise ignored."""
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)",
+                (str(key), json.dumps(value), time.time()),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent cache '{self.name}' write failed: {e}")
+            self._count("errors")
+
+    async def get_async(self, key):
+        """get() for the event loop: the SQLite read runs in a worker thread."""
+        return await asyncio.to_thread(self.get, key)
+
+    async def set_async(self, key, value):
+        """set() for the event loop: the SQLite write runs in a worker thread."""
+        await asyncio.to_thread(self.set, key, value)
+
+    def stats(self):
+        try:
+            size = self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        return {
+            "name": self.name,
+            "path": self.path,
+            "size": size,
+            "ttlSeconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
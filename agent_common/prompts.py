@@ -0,0 +1,286 @@
+"""
+Prompt layer for the agents' Gemini calls.
+
+A PromptTemplate splits a prompt into its static instructions, which are identical on every
+call, and a short per-request part. The instructions are compacted and compiled once (per
+meal context, per genre list, ...) into the template's own Gemini model as its system
+instruction, instead of being rebuilt into the prompt text for every request. The system
+instruction is still sent, and billed as input tokens, with every call; the savings are the
+compacted wording and the work of assembling it. Free text from upstreams (Spoonacular HTML
+summaries, TMDB overviews) is stripped and capped before it goes into a prompt, and the
+tokens every call uses, system instruction included, are counted per template.
+
+Templates that feed code rather than people (keyword and genre inference) ask for JSON
+matching a response schema, with a tight output-token cap and deterministic sampling; the
+parse helpers below validate such responses and count how often that fails.
+"""
+import html
+import json
+import logging
+import os
+import re
+import threading
+
+from agent_common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DESCRIPTION_MAX_CHARS = int(os.environ.get('PROMPT_DESCRIPTION_MAX_CHARS', 400))
+# Sampling temperature for schema-constrained templates; 0 returns the same answer for the same mood
+STRUCTURED_TEMPERATURE = float(os.environ.get('GEMINI_STRUCTURED_TEMPERATURE', 0))
+# Output-token cap for one inferred list (3-5 short strings as JSON); a batch answer gets one per request
+LIST_MAX_OUTPUT_TOKENS = int(os.environ.get('GEMINI_LIST_MAX_OUTPUT_TOKENS', 64))
+
+GEMINI_TOKENS = registry.counter(
+    "moodfusion_gemini_tokens_total", "Gemini input (system instruction included) and output tokens per prompt template.", ["prompt", "kind"])
+GEMINI_CALL_TOKENS = registry.histogram(
+    "moodfusion_gemini_call_tokens", "Input and output tokens of each Gemini call.", ["prompt", "kind"],
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+GEMINI_PARSE = registry.counter(
+    "moodfusion_gemini_parse_total",
+    "Structured Gemini responses by parse outcome: ok, partial (some values rejected), no_values, invalid (not the requested JSON), truncated (cut off by max_output_tokens) or empty.",
+    ["prompt", "outcome"])
+
+_TAG = re.compile(r"<[^>]+>")
+_SPACE = re.compile(r"\s+")
+
+
+# --- Prompt Inputs ---
+def strip_html(text):
+    """Plain text from an HTML fragment: tags removed, entities decoded, whitespace collapsed."""
+    return _SPACE.sub(" ", html.unescape(_TAG.sub(" ", text or ""))).strip()
+
+def clip(text, max_chars):
+    """Caps text at max_chars, cutting at a word boundary."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - 1].rsplit(" ", 1)[0]
+    return cut.rstrip(" ,;:.") + "…"
+
+def prompt_text(text, max_chars=DESCRIPTION_MAX_CHARS):
+    """Upstream free text (an HTML summary, an overview) reduced to what a prompt needs."""
+    return clip(strip_html(text), max_chars)
+
+def compact(text):
+    """Instruction text with indentation, trailing spaces and blank-line runs removed."""
+    lines = [line.strip() for line in text.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+def estimate_tokens(text):
+    return len(text) // 4
+
+
+# --- Token Accounting ---
+def record_usage(prompt_name, response):
+    """Counts the tokens a Gemini response reports (the last chunk of a stream carries the totals)."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    counts = {
+        "input": getattr(usage, "prompt_token_count", 0) or 0,
+        "output": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+    for kind, tokens in counts.items():
+        GEMINI_TOKENS.inc(tokens, prompt=prompt_name, kind=kind)
+        GEMINI_CALL_TOKENS.observe(tokens, prompt=prompt_name, kind=kind)
+
+
+# --- Templates ---
+class PromptTemplate:
+    """
+    Static instructions plus a str.format template for the per-request part. prepare()
+    creates the template's Gemini model, with the compacted instructions as its system
+    instruction, once Vertex AI is initialized; render() fills in a request and returns a
+    Prompt ready to send.
+    A template with a response_schema asks for JSON matching it, sampled deterministically;
+    max_output_tokens caps every response.
+    """
+
+    def __init__(self, name, instructions, request, response_schema=None, max_output_tokens=None):
+        self.name = name
+        self.instructions = compact(instructions)
+        self.request = request
+        self.response_schema = response_schema
+        self.max_output_tokens = max_output_tokens
+        self._generation_config = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _create_model(self):
+        from agent_common.runtime import create_gemini_model
+        return create_gemini_model(system_instruction=self.instructions)
+
+    def _build_generation_config(self, response_schema):
+        from vertexai.preview.generative_models import GenerationConfig
+
+        settings = {"candidate_count": 1}
+        if self.max_output_tokens:
+            settings["max_output_tokens"] = self.max_output_tokens
+        if response_schema:
+            settings.update(temperature=STRUCTURED_TEMPERATURE, response_mime_type="application/json", response_schema=response_schema)
+        return GenerationConfig(**settings)
+
+    def generation_config(self, response_schema=None):
+        """The generation settings for a call; response_schema replaces the template's own."""
+        if response_schema is not None:
+            return self._build_generation_config(response_schema)
+        if self._generation_config is None:
+            self._generation_config = self._build_generation_config(self.response_schema)
+        return self._generation_config
+
+    def prepare(self):
+        with self._lock:
+            self._model = self._create_model()
+        self.generation_config()
+        return self
+
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._create_model()
+        return self._model
+
+    def render(self, response_schema=None, **fields):
+        """
+        Fills in the per-request part. response_schema, if given, replaces the template's
+        schema for this request (e.g. one that names the request numbers of a batch).
+        """
+        return Prompt(self, self.request.format(**fields), response_schema)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "instructionTokensEstimate": estimate_tokens(self.instructions),
+            "maxOutputTokens": self.max_output_tokens,
+        }
+
+
+class Prompt:
+    """A rendered request for one template: its text, sent with the template model's system instruction."""
+
+    def __init__(self, template, text, response_schema=None):
+        self.template = template
+        self.text = text
+        self.response_schema = response_schema
+
+    @property
+    def name(self):
+        return self.template.name
+
+    def _config(self):
+        return self.template.generation_config(self.response_schema)
+
+    def generate(self):
+        response = self.template.model().generate_content(self.text, generation_config=self._config())
+        record_usage(self.name, response)
+        return response
+
+    async def generate_async(self):
+        response = await self.template.model().generate_content_async(self.text, generation_config=self._config())
+        record_usage(self.name, response)
+        return response
+
+    def stream(self):
+        """Yields response chunks as Gemini produces them."""
+        chunk = None
+        for chunk in self.template.model().generate_content(self.text, generation_config=self._config(), stream=True):
+            yield chunk
+        record_usage(self.name, chunk)
+
+    async def stream_async(self):
+        chunk = None
+        async for chunk in await self.template.model().generate_content_async(self.text, generation_config=self._config(), stream=True):
+            yield chunk
+        record_usage(self.name, chunk)
+
+
+# --- Structured Output ---
+def string_list_schema(max_items, allowed=None):
+    """Response schema for a list of 1..max_items strings, limited to allowed if given."""
+    items = {"type": "string"}
+    if allowed is not None:
+        items["enum"] = sorted(allowed)
+    return {"type": "array", "items": items, "min_items": 1, "max_items": max_items}
+
+def numbered_lists_schema(numbers, item_schema):
+    """Response schema for a batch answer: an object with one item_schema value per request number."""
+    return {"type": "object", "properties": {number: item_schema for number in numbers}, "required": list(numbers)}
+
+def count_parse(prompt_name, outcome):
+    GEMINI_PARSE.inc(prompt=prompt_name, outcome=outcome)
+
+def response_json(prompt_name, response):
+    """
+    The JSON value of a structured Gemini response, or None if there is none; a missing,
+    truncated or malformed response is counted under its parse outcome.
+    """
+    candidate = response.candidates[0] if response.candidates else None
+    if candidate is None or not candidate.content.parts:
+        logger.warning(f"Gemini returned no content for prompt '{prompt_name}'. Response: {response}")
+        count_parse(prompt_name, "empty")
+        return None
+    text = candidate.content.parts[0].text.strip()
+    # Without a response schema Gemini often wraps JSON in a ```json fence
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[min((i for i in (text.find("["), text.find("{")) if i >= 0), default=0):]
+    try:
+        return json.loads(text)
+    except ValueError:
+        finish_reason = getattr(getattr(candidate, "finish_reason", None), "name", None)
+        outcome = "truncated" if finish_reason == "MAX_TOKENS" else "invalid"
+        logger.warning(f"Could not parse Gemini response for prompt '{prompt_name}' as JSON ({outcome}): {text[:200]}")
+        count_parse(prompt_name, outcome)
+        return None
+
+def string_values(value, max_items, allowed=None):
+    """
+    The usable strings in a parsed list: stripped, lower-cased if checked against allowed,
+    deduplicated and capped at max_items. Returns (values, rejected count).
+    """
+    if not isinstance(value, list):
+        return [], 1
+    values = []
+    for item in value:
+        text = item.strip() if isinstance(item, str) else ""
+        if allowed is not None:
+            text = text.lower()
+        if text and (allowed is None or text in allowed) and text not in values:
+            values.append(text)
+    return values[:max_items], len(value) - len(values[:max_items])
+
+def parse_string_list(prompt_name, response, max_items, allowed=None):
+    """Validated values of a string_list_schema response; an empty list if there are none."""
+    parsed = response_json(prompt_name, response)
+    if parsed is None:
+        return []
+    values, rejected = string_values(parsed, max_items, allowed)
+    if not values:
+        logger.warning(f"Gemini response for prompt '{prompt_name}' had no usable values: {parsed}")
+    count_parse(prompt_name, "no_values" if not values else "partial" if rejected else "ok")
+    return values
+
+def parse_numbered_lists(prompt_name, response, numbers, max_items, allowed=None):
+    """
+    Validated values per request number of a numbered_lists_schema response.
+    Returns {number: values}; numbers without usable values are left out.
+    """
+    parsed = response_json(prompt_name, response)
+    if parsed is None:
+        return {}
+    if not isinstance(parsed, dict):
+        count_parse(prompt_name, "invalid")
+        return {}
+    parsed = {str(number).strip(): value for number, value in parsed.items()}
+    values_by_number = {}
+    rejected = 0
+    for number in numbers:
+        values, number_rejected = string_values(parsed.get(number), max_items, allowed)
+        rejected += number_rejected
+        if values:
+            values_by_number[number] = values
+    complete = not rejected and len(values_by_number) == len(numbers)
+    count_parse(prompt_name, "no_values" if not values_by_number else "ok" if complete else "partial")
+    return values_by_number
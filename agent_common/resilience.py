@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from agent_common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (overridable per agent through environment variables) ---
+# Total time a recommendation may take, and the share of it Gemini may use before the fallback is served
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', 8))
+GEMINI_TIMEOUT_SECONDS = float(os.environ.get('GEMINI_TIMEOUT_SECONDS', 4))
+# Sent by callers (the bundle agent) so an agent never works past the caller's own deadline
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+DEADLINES_EXCEEDED = registry.counter(
+    "moodfusion_deadline_exceeded_total", "Request stages cut short because the request deadline ran out.", ["stage"])
+CIRCUIT_TRANSITIONS = registry.counter(
+    "moodfusion_circuit_transitions_total", "Circuit breaker state changes per upstream.", ["upstream", "state"])
+CIRCUIT_REJECTIONS = registry.counter(
+    "moodfusion_circuit_rejections_total", "Upstream calls refused without being sent because the circuit was open.", ["upstream"])
+
+
+# --- Request Deadlines ---
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage cannot start or finish before the request deadline."""
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+class Deadline:
+    """
+    Absolute per-request time budget, passed down through every stage of a recommendation.
+    Each stage asks for what is left (optionally capped) instead of using its own fixed timeout.
+    """
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, header_value, default_seconds):
+        """The agent's own budget, shortened to the caller's remaining time if it sent one."""
+        seconds = default_seconds
+        try:
+            if header_value:
+                seconds = min(seconds, max(0.0, float(header_value) / 1000.0))
+        except ValueError:
+            pass
+        return cls(seconds)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def within(self, seconds):
+        """A child deadline: at most seconds from now, and never past this one."""
+        child = Deadline(seconds)
+        child.expires_at = min(child.expires_at, self.expires_at)
+        return child
+
+    def timeout(self, default):
+        """Caps a requests-style timeout (a number or a (connect, read) tuple) at the remaining time."""
+        remaining = max(self.remaining(), 0.001)  # Clients reject a zero timeout; an expired deadline fails fast instead
+        if isinstance(default, tuple):
+            return tuple(min(part, remaining) for part in default)
+        return min(default, remaining)
+
+    def check(self, stage):
+        """Raises DeadlineExceeded if nothing is left for the stage about to start."""
+        if self.expired():
+            DEADLINES_EXCEEDED.inc(stage=stage)
+            raise DeadlineExceeded(f"Request deadline exceeded before {stage}.")
+
+    def header_value(self):
+        return str(int(self.remaining() * 1000))
+
+
+def _admit(breaker, stage):
+    if breaker is not None and not breaker.allow():
+        raise CircuitOpen(f"Circuit for {breaker.name} is open; skipping {stage}.")
+
+
+def call_with_deadline(executor, deadline, stage, fn, *args, breaker=None, limiter=None, **kwargs):
+    """
+    Runs a blocking call that has no timeout of its own (the Gemini SDK) on executor and waits
+    at most until the deadline. On timeout the call is abandoned and finishes in the background;
+    its eventual outcome still counts towards the breaker, and it keeps its admission slot
+    (limiter) until then.
+    """
+    deadline.check(stage)
+    if limiter is not None:
+        limiter.acquire(deadline.remaining())
+    try:
+        _admit(breaker, stage)
+        future = executor.submit(fn, *args, **kwargs)
+    except BaseException:
+        if limiter is not None:
+            limiter.release()
+        raise
+    if limiter is not None:
+        future.add_done_callback(lambda f: limiter.release())
+    if breaker is not None:
+        future.add_done_callback(lambda f: breaker.record_failure() if f.exception() else breaker.record_success())
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FutureTimeout:
+        if future.done():
+            raise
+        DEADLINES_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(f"Request deadline exceeded during {stage}.")
+
+
+async def await_with_deadline(deadline, stage, make_coroutine, breaker=None, limiter=None):
+    """Async version of call_with_deadline; the awaited call is cancelled at the deadline."""
+    deadline.check(stage)
+    if limiter is None:
+        return await _await_within(deadline, stage, make_coroutine, breaker)
+    async with limiter.admit_async(deadline.remaining()):
+        return await _await_within(deadline, stage, make_coroutine, breaker)
+
+
+async def _await_within(deadline, stage, make_coroutine, breaker):
+    _admit(breaker, stage)
+    try:
+        result = await asyncio.wait_for(make_coroutine(), timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        DEADLINES_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(f"Request deadline exceeded during {stage}.")
+    except Exception:
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+    if breaker is not None:
+        breaker.record_success()
+    return result
+
+
+# --- Upstream Latency Tracking ---
+class LatencyTracker:
+    """Recent successful latencies per endpoint, for picking the hedging delay."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, endpoint, pct, min_samples=20):
+        """The pct-th percentile latency, or None until min_samples calls have been seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+# --- Circuit Breakers ---
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker. After failure_threshold consecutive failures (errors, timeouts,
+    429/5xx) the circuit opens and calls are refused immediately for reset_seconds; then a single
+    trial call is let through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _transition(self, state):
+        if state != self.state:
+            logger.warning(f"Circuit '{self.name}' {self.state} -> {state}.")
+            self.state = state
+            CIRCUIT_TRANSITIONS.inc(upstream=self.name, state=state)
+
+    def allow(self):
+        """Whether a call may be sent now. Refused calls should fail fast (or use a fallback)."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+                self._transition(self.HALF_OPEN)
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            # A trial that never reported back (abandoned at a deadline) doesn't block the next one forever
+            if self.state == self.HALF_OPEN and (not self._trial_in_flight or now - self._opened_at >= self.reset_seconds):
+                self._trial_in_flight = True
+                self._opened_at = now
+                return True
+            self.rejected += 1
+        CIRCUIT_REJECTIONS.inc(upstream=self.name)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "state": self.state, "consecutiveFailures": self._failures, "rejected": self.rejected}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(name):
+    """
+    The process-wide breaker for an upstream, shared by its sync and async clients.
+    Tuned with <NAME>_CIRCUIT_FAILURES / <NAME>_CIRCUIT_RESET_SECONDS, falling back to
+    UPSTREAM_CIRCUIT_FAILURES / UPSTREAM_CIRCUIT_RESET_SECONDS.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            prefix = name.upper()
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=int(os.environ.get(f'{prefix}_CIRCUIT_FAILURES', os.environ.get('UPSTREAM_CIRCUIT_FAILURES', 5))),
+                reset_seconds=float(os.environ.get(f'{prefix}_CIRCUIT_RESET_SECONDS', os.environ.get('UPSTREAM_CIRCUIT_RESET_SECONDS', 30))),
+            )
+        return _breakers[name]
+
+
+def circuit_report():
+    with _breakers_lock:
+        return [breaker.stats() for breaker in _breakers.values()]
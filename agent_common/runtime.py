@@ -0,0 +1,170 @@
+"""
+Production serving runtime shared by the meal, movie, trivia and bundle agents.
+
+Serves an agent's Flask app under gunicorn, with a pool of request threads per worker process,
+instead of Werkzeug's development server. The agents spend their time waiting on Gemini and
+the upstream APIs, so one worker process with many threads is the default. More processes
+(SERVER_WORKERS) add CPU headroom but multiply per-process state: metrics, caches, the
+movie candidate pool, trivia precompute and the Spoonacular budget share.
+
+With preloading on, the master imports the app (and the heavy Google SDK modules) and runs
+its preload startup steps once, then forks the workers, so code and read-mostly data like the
+mood index are shared copy-on-write. Clients, sockets and background threads do not survive a
+fork, so every other startup step runs in each worker. On SIGTERM the workers stop accepting
+connections and finish their in-flight requests before exiting.
+
+Also holds the Google Cloud setup the agents share: the Secret Manager client, get_secret,
+Vertex AI initialization and the Gemini model factory (used by agent_common.prompts).
+
+Run with: python -m agent_common.runtime main:app
+"""
+import gc
+import importlib
+import logging
+import os
+import sys
+
+from agent_common import startup as startup_module
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+PROJECT_ID = os.environ.get('GCP_PROJECT_ID', 'moodfusion-hackathon')
+REGION = os.environ.get('GCP_REGION', 'us-central1')
+GEMINI_MODEL_NAME = os.environ.get('GEMINI_MODEL_NAME', 'gemini-2.0-flash')
+
+# Imported by the master before forking so every worker shares them instead of importing its own copy
+PRELOAD_MODULES = ('google.cloud.secretmanager', 'google.cloud.aiplatform', 'vertexai.preview.generative_models')
+
+# --- Secret Manager Client ---
+# Created by the agents' startup steps; the google.cloud import alone takes noticeable time.
+secret_manager_client = None
+
+def init_secret_manager():
+    global secret_manager_client
+    from google.cloud import secretmanager
+    secret_manager_client = secretmanager.SecretManagerServiceClient()
+
+def get_secret(secret_name):
+    """Fetches a secret from Secret Manager."""
+    try:
+        resource_name = f"projects/{PROJECT_ID}/secrets/{secret_name}/versions/latest"
+        response = secret_manager_client.access_secret_version(request={"name": resource_name})
+        return response.payload.data.decode("UTF-8")
+    except Exception as e:
+        logger.error(f"Error accessing secret '{secret_name}': {e}")
+        raise
+
+# --- Vertex AI (Gemini) Client ---
+def init_vertex_ai():
+    from google.cloud import aiplatform
+    aiplatform.init(project=PROJECT_ID, location=REGION)
+
+def create_gemini_model(system_instruction=None):
+    """A Gemini model handle; needs init_vertex_ai() to have run."""
+    from vertexai.preview.generative_models import GenerativeModel
+    return GenerativeModel(GEMINI_MODEL_NAME, system_instruction=system_instruction)
+
+# --- Server Settings ---
+# One process by default: every worker keeps its own metrics, caches, candidate pool and
+# background refreshes, so N workers mean N times the warm-up calls and N partial /metrics views
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 1))
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 32))
+SERVER_PRELOAD = os.environ.get('SERVER_PRELOAD', 'true').lower() == 'true'
+# Cloud Run sends SIGKILL 10s after SIGTERM, so in-flight requests get a little less than that
+SERVER_GRACEFUL_TIMEOUT_SECONDS = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT_SECONDS', 8))
+SERVER_KEEPALIVE_SECONDS = int(os.environ.get('SERVER_KEEPALIVE_SECONDS', 5))
+
+# Worker processes serving this app; 1 unless this runtime forked several.
+_worker_processes = 1
+
+def worker_processes():
+    """
+    How many processes share this instance's traffic. Per-instance allowances (like a daily
+    upstream quota) should be divided by this, since every worker keeps its own state.
+    """
+    return _worker_processes
+
+# --- Serving ---
+def _preload_modules():
+    for module_name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            logger.info(f"Not preloading {module_name}: {e}")  # The bundle agent doesn't use the Google SDKs
+
+def _load_app(target):
+    module_name, _, attribute = target.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+def _serve_development(target, port):
+    logger.warning("Serving with the Flask development server; use gunicorn in production.")
+    _load_app(target).run(host='0.0.0.0', port=port, threaded=True)
+
+def _serve_gunicorn(target, port):
+    from gunicorn.app.base import BaseApplication
+
+    global _worker_processes
+    _worker_processes = SERVER_WORKERS
+    deferred_startups = []
+
+    def post_fork(server, worker):
+        for startup in deferred_startups:
+            startup.launch()
+
+    class AgentServer(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"0.0.0.0:{port}",
+                "workers": SERVER_WORKERS,
+                "worker_class": "gthread",
+                "threads": SERVER_THREADS,
+                "preload_app": SERVER_PRELOAD,
+                "graceful_timeout": SERVER_GRACEFUL_TIMEOUT_SECONDS,
+                "keepalive": SERVER_KEEPALIVE_SECONDS,
+                "timeout": 0,  # Requests are bounded by their own deadlines, not by worker heartbeats
+                "post_fork": post_fork,
+                "accesslog": None,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if not SERVER_PRELOAD:
+                return _load_app(target)  # Imported (and started) in each worker
+            recorded = startup_module.defer_startups()
+            _preload_modules()
+            app = _load_app(target)
+            deferred_startups.extend(recorded)
+            for startup in deferred_startups:
+                startup.preload()
+            # Keep the preloaded objects out of the collector's reach so workers don't copy their pages
+            gc.collect()
+            gc.freeze()
+            return app
+
+    logger.info(f"Serving {target} on port {port}: {SERVER_WORKERS} workers x {SERVER_THREADS} threads, preload={SERVER_PRELOAD}.")
+    if SERVER_WORKERS > 1:
+        logger.warning(
+            f"{SERVER_WORKERS} worker processes: /metrics, /cache_stats, in-memory caches, the candidate pool "
+            "and trivia precompute are per worker. Prefer SERVER_THREADS (or more instances) unless CPU-bound."
+        )
+    AgentServer().run()
+
+def serve(target, port=None):
+    """Serves the Flask app at target ('module:attribute') until the server is stopped."""
+    port = port or int(os.environ.get('PORT', 8080))
+    if os.environ.get('DEV_SERVER', 'false').lower() == 'true':
+        return _serve_development(target, port)
+    try:
+        import gunicorn  # Optional locally (it doesn't run on Windows); always installed in the images
+    except ImportError:
+        return _serve_development(target, port)
+    _serve_gunicorn(target, port)
+
+
+if __name__ == '__main__':
+    # Serve through the importable module, so the agents see the same worker count and clients
+    from agent_common import runtime
+    logging.basicConfig(level=logging.INFO)
+    runtime.serve(sys.argv[1] if len(sys.argv) > 1 else 'main:app')
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function and
+    every caller that arrives while it is in flight waits for and shares its result (or
+    exception). Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """Runs fn() once for all concurrent callers of key and returns its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.followers += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "inFlight": len(self._calls), "leaders": self.leaders, "followers": self.followers}
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for the ASGI serving mode."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key, fn):
+        """Awaits fn() once for all concurrent callers of key and returns its result."""
+        call = self._calls.get(key)
+        if call is not None:
+            self.followers += 1
+            # shield() so one caller disconnecting doesn't cancel the shared call for the others
+            return await asyncio.shield(call)
+
+        self.leaders += 1
+        call = self._calls[key] = asyncio.ensure_future(fn())
+        call.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(call)
+
+    def stats(self):
+        return {"name": self.name, "inFlight": len(self._calls), "leaders": self.leaders, "followers": self.followers}
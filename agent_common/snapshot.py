@@ -0,0 +1,372 @@
+"""
+Precomputed recommendation snapshots.
+
+An offline job (each agent's precompute.py) runs the Gemini inference and upstream search
+stages for a vocabulary of moods and writes the results to a snapshot file. The agents
+memory-map that file at startup and answer covered moods from it without any network call.
+
+File layout (little-endian), versioned by FORMAT_VERSION:
+    magic (8 bytes) | format version (u32) | header length (u32) | header (JSON)
+    index: one (key hash u64, value offset u64, value length u32) record per entry, sorted by hash
+    values: zlib-compressed JSON {"k": key, "v": value}, one per entry
+A lookup is a binary search over the index and one decompression, straight from the mapped
+file; forked server workers share its pages through the OS page cache.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from agent_common.batch import BATCH_INFERENCE_CHUNK
+from agent_common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MFSNAP\x00\x00"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sII")
+_INDEX_RECORD = struct.Struct("<QQI")
+
+SNAPSHOT_LOOKUPS = registry.counter(
+    "moodfusion_snapshot_lookups_total", "Recommendation snapshot lookups: hit, miss, or stale (found but older than the max age).", ["snapshot", "result"])
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+# --- File Format ---
+def write_snapshot(path, name, entries, version=None, metadata=None):
+    """
+    Writes entries (key -> JSON-serializable value) as a snapshot file. The file is written
+    next to path and renamed into place, so a serving agent never maps a half-written file.
+    Returns the file size in bytes.
+    """
+    created_at = time.time()
+    records = sorted(
+        (key_hash(key), zlib.compress(json.dumps({"k": key, "v": value}, separators=(",", ":")).encode(), 9))
+        for key, value in entries.items()
+    )
+    header = json.dumps({
+        "name": name,
+        "version": version or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(created_at)),
+        "createdAt": created_at,
+        "entries": len(records),
+        "metadata": metadata or {},
+    }).encode()
+
+    offset = _PREAMBLE.size + len(header) + _INDEX_RECORD.size * len(records)
+    index = bytearray()
+    for hashed, blob in records:
+        index += _INDEX_RECORD.pack(hashed, offset, len(blob))
+        offset += len(blob)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(index)
+        for _, blob in records:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return offset
+
+
+class Snapshot:
+    """A read-only, memory-mapped snapshot file. Raises ValueError if the file isn't one this version can read."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _PREAMBLE.size:
+            raise ValueError(f"{path} is not a recommendation snapshot")
+        magic, format_version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a recommendation snapshot")
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} has snapshot format {format_version}; this build reads format {FORMAT_VERSION}")
+        self.header = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        self._index_start = _PREAMBLE.size + header_length
+        self.entries = self.header["entries"]
+        self.size_bytes = len(self._map)
+
+    @property
+    def version(self):
+        return self.header["version"]
+
+    @property
+    def created_at(self):
+        return self.header["createdAt"]
+
+    def _record(self, position):
+        return _INDEX_RECORD.unpack_from(self._map, self._index_start + position * _INDEX_RECORD.size)
+
+    def get(self, key):
+        """The value stored under key, or None."""
+        hashed = key_hash(key)
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[0] < hashed:
+                low = middle + 1
+            else:
+                high = middle
+        # Equal hashes are adjacent; the stored key tells a collision apart
+        while low < self.entries:
+            record_hash, offset, length = self._record(low)
+            if record_hash != hashed:
+                break
+            entry = json.loads(zlib.decompress(self._map[offset:offset + length]))
+            if entry["k"] == key:
+                return entry["v"]
+            low += 1
+        return None
+
+    def items(self):
+        """Every (key, value) in the file, in index order. For tools, not request paths."""
+        for position in range(self.entries):
+            _, offset, length = self._record(position)
+            entry = json.loads(zlib.decompress(self._map[offset:offset + length]))
+            yield entry["k"], entry["v"]
+
+
+# --- Serving ---
+class SnapshotStore:
+    """
+    The snapshot an agent serves from. open() maps the file (in the runtime's master, before
+    workers are forked); watch() starts a thread in each worker that maps the file again
+    whenever the precompute job replaces it. Entries from a snapshot older than
+    max_age_seconds are not served, so an abandoned job can't pin stale recommendations.
+    """
+
+    def __init__(self, name, path, max_age_seconds=7 * 24 * 3600, reload_seconds=300):
+        self.name = name
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.reload_seconds = reload_seconds
+        self._snapshot = None
+        self._file_id = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.loads = 0
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def open(self):
+        """Maps the snapshot file if it changed since the last call. Returns True if a new one was loaded."""
+        try:
+            file_id = self._stat()
+        except FileNotFoundError:
+            logger.warning(f"Snapshot '{self.name}' not found at {self.path}; serving without it.")
+            return False
+        if file_id == self._file_id:
+            return False
+        snapshot = Snapshot(self.path)
+        # Readers holding the previous mapping finish with it; it is unmapped once unreferenced
+        self._snapshot, self._file_id = snapshot, file_id
+        self.loads += 1
+        logger.info(f"Snapshot '{self.name}' version {snapshot.version} loaded from {self.path}: {snapshot.entries} entries, {snapshot.size_bytes} bytes.")
+        return True
+
+    def watch(self):
+        """Starts the background reload loop."""
+        def run():
+            while True:
+                time.sleep(self.reload_seconds)
+                try:
+                    self.open()
+                except Exception as e:
+                    logger.error(f"Reloading snapshot '{self.name}' failed: {e}. Keeping the loaded one.")
+
+        self._thread = threading.Thread(target=run, name=f"snapshot-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _count(self, counter, result):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        SNAPSHOT_LOOKUPS.inc(snapshot=self.name, result=result)
+
+    def get(self, key):
+        """The value for key, or None if there is no snapshot, no entry, or the snapshot is too old."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        value = snapshot.get(key)
+        if value is None:
+            self._count("misses", "miss")
+            return None
+        if time.time() - snapshot.created_at > self.max_age_seconds:
+            self._count("stale", "stale")
+            return None
+        self._count("hits", "hit")
+        return value
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "name": self.name,
+            "path": self.path,
+            "version": snapshot.version if snapshot else None,
+            "createdAt": snapshot.created_at if snapshot else None,
+            "entries": snapshot.entries if snapshot else 0,
+            "sizeBytes": snapshot.size_bytes if snapshot else 0,
+            "maxAgeSeconds": self.max_age_seconds,
+            "loads": self.loads,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+        }
+
+
+def snapshot_store_from_env(name):
+    """The agent's SnapshotStore, or None if RECOMMENDATION_SNAPSHOT_PATH is unset."""
+    path = os.environ.get('RECOMMENDATION_SNAPSHOT_PATH')
+    if not path:
+        return None
+    return SnapshotStore(
+        name,
+        path,
+        max_age_seconds=float(os.environ.get('RECOMMENDATION_SNAPSHOT_MAX_AGE_SECONDS', 7 * 24 * 3600)),
+        reload_seconds=float(os.environ.get('RECOMMENDATION_SNAPSHOT_RELOAD_SECONDS', 300)),
+    )
+
+
+# --- Precompute Job ---
+def load_vocabulary(path):
+    """
+    Moods to precompute: a JSON list, a JSON object (its keys, so a mood index seed file
+    works), or a text file with one mood per line ('#' starts a comment).
+    """
+    with open(path) as f:
+        if path.endswith(".json"):
+            moods = list(json.load(f))
+        else:
+            moods = [line.split("#", 1)[0] for line in f]
+    return list(dict.fromkeys(mood.strip() for mood in moods if mood.strip()))
+
+
+class Checkpoint:
+    """
+    Finished entries of a precompute run, appended to a JSON-lines file as they complete, so
+    an interrupted run (quota exhausted, deadline, Ctrl-C) resumes where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by the previous run stopping mid-write
+                    self.entries[record["key"]] = record["value"]
+            logger.info(f"Resuming from checkpoint {path}: {len(self.entries)} entries done.")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a")
+
+    def add(self, key, value):
+        with self._lock:
+            self.entries[key] = value
+            self._file.write(json.dumps({"key": key, "value": value}) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_precompute(keys, compute_chunk, checkpoint, workers=4, chunk_size=25, should_stop=None):
+    """
+    Computes every key not yet in the checkpoint. compute_chunk(keys) returns {key: value}
+    for the keys it could compute; missing keys are retried by the next run. At most workers
+    chunks run at once. Once should_stop() returns True no new chunk is started.
+    Returns the number of keys still missing.
+    """
+    pending = [key for key in keys if key not in checkpoint.entries]
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    logger.info(f"Precompute: {len(keys) - len(pending)} of {len(keys)} keys already done, {len(pending)} to go in {len(chunks)} chunk(s).")
+    started = time.monotonic()
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precompute") as executor:
+        try:
+            while chunks or in_flight:
+                while chunks and len(in_flight) < workers and not (should_stop and should_stop()):
+                    in_flight.add(executor.submit(compute_chunk, chunks.pop(0)))
+                if not in_flight:
+                    logger.warning("Precompute stopping early; run it again to resume.")
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        for key, value in future.result().items():
+                            checkpoint.add(key, value)
+                    except Exception as e:
+                        logger.error(f"Precompute chunk failed: {e}")
+                completed = sum(1 for key in keys if key in checkpoint.entries)
+                logger.info(f"Precompute: {completed}/{len(keys)} keys done after {time.monotonic() - started:.1f}s.")
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; waiting for running chunks. Run again to resume.")
+            for future in in_flight:
+                try:
+                    for key, value in future.result().items():
+                        checkpoint.add(key, value)
+                except Exception:
+                    pass  # Retried by the next run
+    return sum(1 for key in keys if key not in checkpoint.entries)
+
+
+def precompute_arguments(description, default_moods):
+    """The command-line options every agent's precompute job takes."""
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--moods", default=default_moods, help="Mood vocabulary: a text file (one mood per line) or a JSON list/object. Defaults to the mood index seed file.")
+    parser.add_argument("--out", required=True, help="Snapshot file to write (what RECOMMENDATION_SNAPSHOT_PATH points the agent at).")
+    parser.add_argument("--checkpoint", help="Progress file for resuming an interrupted run. Defaults to <out>.checkpoint.jsonl.")
+    parser.add_argument("--workers", type=int, default=4, help="Chunks of moods processed at once.")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_INFERENCE_CHUNK, help="Moods per chunk (and per batched Gemini call).")
+    parser.add_argument("--deadline-seconds", type=float, default=120, help="Time budget for one chunk's upstream calls.")
+    parser.add_argument("--version", help="Snapshot version label. Defaults to the UTC creation time.")
+    parser.add_argument("--verbose", action="store_true", help="Log every upstream call and pick, not only progress.")
+    return parser
+
+
+def run_snapshot_job(args, name, keys, compute_chunk, should_stop=None, metadata=None):
+    """
+    Runs compute_chunk over every key (resuming from the checkpoint) and writes the snapshot
+    with every entry done so far. Returns the process exit status: 0 once every key is in the
+    snapshot (the checkpoint is then removed, so the next run starts fresh), 2 if some are
+    still missing and the job should be run again.
+    """
+    checkpoint_path = args.checkpoint or f"{args.out}.checkpoint.jsonl"
+    checkpoint = Checkpoint(checkpoint_path)
+    try:
+        missing = run_precompute(keys, compute_chunk, checkpoint, workers=args.workers, chunk_size=args.chunk_size, should_stop=should_stop)
+    finally:
+        checkpoint.close()
+    entries = {key: checkpoint.entries[key] for key in keys if key in checkpoint.entries}
+    size = write_snapshot(args.out, name, entries, version=args.version, metadata={**(metadata or {}), "complete": not missing})
+    logger.info(f"Wrote snapshot '{name}' to {args.out}: {len(entries)} of {len(keys)} keys, {size} bytes.")
+    if missing:
+        logger.warning(f"{missing} keys still missing; run the job again to resume from {checkpoint_path}.")
+        return 2
+    os.remove(checkpoint_path)
+    return 0
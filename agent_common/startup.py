@@ -0,0 +1,174 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Set by the serving runtime (agent_common.runtime) before it imports an app it will fork
+# workers from. Startup.start() then only records the startup here, and the runtime runs its
+# preload steps in the master process and launches the rest in every worker.
+_deferred = None
+
+
+def defer_startups():
+    """Makes Startup.start() record instead of launching. Returns the list it records into."""
+    global _deferred
+    _deferred = []
+    return _deferred
+
+
+class Startup:
+    """
+    Runs an agent's init steps (secret fetches, client construction, warm-up calls) in
+    background threads so the web server can bind its port immediately.
+    Steps without dependencies run concurrently; a step waits only for the steps it names
+    in depends_on. Per-step timings are logged once everything has finished, and
+    ready/wait() give request handlers a readiness signal.
+    Under the multi-process runtime, preload steps run once in the master before workers
+    are forked, and the other steps run in each worker.
+    """
+
+    def __init__(self, agent_name, max_workers=8):
+        self.agent_name = agent_name
+        self._steps = []
+        self._futures = {}
+        self._timings = {}
+        self._errors = {}
+        self._done = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="startup")
+        self._created_at = time.perf_counter()
+        self.total_seconds = None
+
+    def add_step(self, name, fn, depends_on=(), critical=True, preload=False):
+        """
+        Registers an init step; depends_on may only name steps registered before it.
+        A failing critical step stops the process (as a failed startup always has);
+        a failing non-critical step is logged and startup continues.
+        preload marks a step that only builds plain in-memory data (no threads, sockets or
+        clients), so its result can be shared by forked workers; it may only depend on
+        other preload steps.
+        """
+        self._steps.append((name, fn, tuple(depends_on), critical, preload))
+
+    def _run_step(self, name, fn, depends_on, critical):
+        for dependency in depends_on:
+            self._futures[dependency].result()
+        started = time.perf_counter()
+        try:
+            failed = [dependency for dependency in depends_on if dependency in self._errors]
+            if failed:
+                raise RuntimeError(f"depends on failed step(s) {failed}")
+            return fn()
+        except Exception as e:
+            self._errors[name] = str(e)
+            if critical:
+                logger.critical(f"{self.agent_name} startup step '{name}' failed: {e}. Exiting.")
+                logging.shutdown()
+                os._exit(1)
+            logger.error(f"{self.agent_name} startup step '{name}' failed: {e}. Continuing without it.")
+        finally:
+            self._timings[name] = time.perf_counter() - started
+
+    def start(self):
+        """Schedules every registered step and returns immediately (or defers to the serving runtime)."""
+        if _deferred is not None:
+            _deferred.append(self)
+            return self
+        return self.launch()
+
+    def preload(self):
+        """Runs the preload steps now, in the calling thread (the runtime's master process)."""
+        for name, fn, depends_on, critical, preload in self._steps:
+            if preload:
+                future = Future()
+                future.set_result(self._run_step(name, fn, depends_on, critical))
+                self._futures[name] = future
+        return self
+
+    def launch(self):
+        """Schedules every step not already preloaded and returns immediately."""
+        for name, fn, depends_on, critical, _ in self._steps:
+            if name not in self._futures:
+                self._futures[name] = self._executor.submit(self._run_step, name, fn, depends_on, critical)
+        threading.Thread(target=self._finish, name="startup-report", daemon=True).start()
+        return self
+
+    def _finish(self):
+        for future in self._futures.values():
+            try:
+                future.result()
+            except Exception:
+                pass  # Already logged by _run_step
+        self.total_seconds = time.perf_counter() - self._created_at
+        breakdown = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in self._timings.items())
+        logger.info(f"{self.agent_name} startup finished in {self.total_seconds:.3f}s ({breakdown})")
+        self._executor.shutdown(wait=False)
+        self._done.set()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until startup has finished. Returns False if timeout elapsed first."""
+        return self._done.wait(timeout)
+
+    def report(self):
+        return {
+            "ready": self.ready,
+            "totalSeconds": round(self.total_seconds, 3) if self.total_seconds is not None else None,
+            "steps": {name: round(seconds, 3) for name, seconds in self._timings.items()},
+            "errors": dict(self._errors),
+        }
+
+
+def install_readiness_gate(app, startup, wait_seconds=None, exempt_endpoints=()):
+    """
+    Adds a GET /ready endpoint reporting startup timings, and holds other requests until
+    startup has finished (up to wait_seconds, default STARTUP_WAIT_SECONDS) before
+    shedding them with 503.
+    """
+    from flask import jsonify, request
+
+    if wait_seconds is None:
+        wait_seconds = float(os.environ.get('STARTUP_WAIT_SECONDS', 30))
+    exempt = {"ready", "static", *exempt_endpoints}
+
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        """Readiness signal: 200 once startup has finished, 503 before."""
+        return jsonify(startup.report()), 200 if startup.ready else 503
+
+    @app.before_request
+    def wait_for_startup():
+        if request.method == 'OPTIONS' or request.endpoint in exempt:
+            return None
+        if not startup.wait(wait_seconds):
+            return jsonify({"error": f"{startup.agent_name} is still starting up. Please retry."}), 503
+        return None
+
+
+def install_async_readiness_gate(app, startup, wait_seconds=None, exempt_endpoints=()):
+    """Quart counterpart of install_readiness_gate for the async serving mode."""
+    import asyncio
+    from quart import jsonify, request
+
+    if wait_seconds is None:
+        wait_seconds = float(os.environ.get('STARTUP_WAIT_SECONDS', 30))
+    exempt = {"ready", "static", *exempt_endpoints}
+
+    @app.route('/ready', methods=['GET'])
+    async def ready():
+        """Readiness signal: 200 once startup has finished, 503 before."""
+        return jsonify(startup.report()), 200 if startup.ready else 503
+
+    @app.before_request
+    async def wait_for_startup():
+        if request.method == 'OPTIONS' or request.endpoint in exempt or startup.ready:
+            return None
+        # Only hit while the background startup threads are still running
+        if not await asyncio.get_running_loop().run_in_executor(None, startup.wait, wait_seconds):
+            return jsonify({"error": f"{startup.agent_name} is still starting up. Please retry."}), 503
+        return None
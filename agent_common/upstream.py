@@ -0,0 +1,231 @@
+import logging
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from agent_common.metrics import record_upstream, registry
+from agent_common.resilience import CircuitOpen, LatencyTracker, circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+# --- Defaults (overridable per agent through environment variables) ---
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+DEFAULT_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 10))
+DEFAULT_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 2))
+DEFAULT_BACKOFF_FACTOR = float(os.environ.get('UPSTREAM_BACKOFF_FACTOR', 0.3))
+DEFAULT_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 16))
+# Hedging: a GET still unanswered after this percentile of recent latencies gets a second, identical
+# request and the first response wins. Capped at a share of all requests so a slow upstream isn't doubled.
+HEDGE_PERCENTILE = float(os.environ.get('UPSTREAM_HEDGE_PERCENTILE', 95))
+HEDGE_MAX_RATIO = float(os.environ.get('UPSTREAM_HEDGE_MAX_RATIO', 0.1))
+HEDGE_MIN_SAMPLES = int(os.environ.get('UPSTREAM_HEDGE_MIN_SAMPLES', 20))
+
+# Transient statuses worth retrying. 402 (Spoonacular quota) is deliberately not here.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+HEDGES = registry.counter(
+    "moodfusion_upstream_hedges_total", "Hedged (duplicate) upstream GETs sent, and which request answered first.", ["upstream", "endpoint", "winner"])
+
+
+class CircuitOpenError(CircuitOpen, requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+def deadline_exceeded(name, endpoint):
+    return requests.exceptions.Timeout(f"Request deadline exceeded before calling {name} {endpoint}.")
+
+
+def retry_after_seconds(response):
+    """Seconds the upstream asked to wait in its Retry-After header (delta or HTTP date), 0 if none."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class UpstreamClient:
+    """
+    Shared keep-alive HTTP client for an external API.
+    Wraps a requests.Session with a pooled adapter per host, connect/read timeouts on
+    every call (capped at the request deadline when one is passed), retry-with-backoff
+    limited to idempotent GETs and to the time the deadline leaves, a circuit breaker, optional hedging of slow GETs, and an
+    optional admission limiter bounding the calls in flight.
+    """
+
+    def __init__(self, name, hosts, pool_maxsize=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff_factor=None, hedge=False, breaker_per_endpoint=False, limiter=None):
+        self.name = name
+        self.limiter = limiter
+        self.breaker_per_endpoint = breaker_per_endpoint
+        self.latency = LatencyTracker()
+        self.hedge = hedge
+        self._hedge_slots = threading.BoundedSemaphore(pool_maxsize or DEFAULT_POOL_MAXSIZE)
+        # Two threads per hedged call (the original and the hedge), created on first use
+        self._hedge_executor = ThreadPoolExecutor(max_workers=2 * (pool_maxsize or DEFAULT_POOL_MAXSIZE), thread_name_prefix=f"{name}-hedge") if hedge else None
+        self._counts_lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else DEFAULT_CONNECT_TIMEOUT,
+            read_timeout if read_timeout is not None else DEFAULT_READ_TIMEOUT,
+        )
+        self.max_retries = max_retries if max_retries is not None else DEFAULT_MAX_RETRIES
+        self.backoff_factor = backoff_factor if backoff_factor is not None else DEFAULT_BACKOFF_FACTOR
+        self.session = requests.Session()
+        # hosts maps hostname (or a full URL prefix) -> pool size, so busy upstreams can be given more connections
+        for host, size in hosts.items():
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=size or pool_maxsize or DEFAULT_POOL_MAXSIZE,
+                max_retries=0,  # Retried by _send_with_retries, where the deadline is known
+            )
+            self.session.mount(host if "://" in host else f"https://{host}/", adapter)
+        logger.info(f"Upstream client '{name}' ready for {list(hosts)} (timeout={self.timeout}, retries={self.max_retries}).")
+
+    def breaker(self, endpoint):
+        return circuit_breaker(f"{self.name}_{endpoint}" if self.breaker_per_endpoint else self.name)
+
+    def _timeout(self, timeout, deadline):
+        timeout = timeout or self.timeout
+        return deadline.timeout(timeout) if deadline is not None else timeout
+
+    def _timed(self, endpoint, send, deadline=None):
+        """
+        Runs one request through the admission limiter (if any) and the circuit breaker, and
+        records its duration (retries included) under endpoint. 429/5xx responses and transport
+        errors count as breaker failures, except timeouts caused by the request's own deadline
+        running out. Raises Overloaded if no slot frees up in time.
+        """
+        if deadline is not None and deadline.expired():
+            raise deadline_exceeded(self.name, endpoint)
+        if self.limiter is None:
+            return self._call(endpoint, send, deadline)
+        with self.limiter.admit(deadline.remaining() if deadline is not None else None):
+            return self._call(endpoint, send, deadline)
+
+    def _call(self, endpoint, send, deadline):
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit for {self.name} is open; not calling {endpoint}.")
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = send()
+            status = str(response.status_code)
+        except requests.exceptions.RequestException as e:
+            if not (isinstance(e, requests.exceptions.Timeout) and deadline is not None and deadline.expired()):
+                breaker.record_failure()
+            raise
+        finally:
+            record_upstream(self.name, endpoint, status, time.perf_counter() - started)
+        if response.status_code in RETRY_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            self.latency.record(endpoint, time.perf_counter() - started)
+        return response
+
+    def _send_with_retries(self, send, deadline):
+        """
+        Sends a GET, retrying connection errors and 429/5xx responses after an exponential
+        backoff, or the upstream's Retry-After if that is longer. Every attempt gets a fresh
+        timeout capped at what is left of the deadline, and no retry is made once the wait
+        would use up the rest of it: the last response (or error) is handed back instead.
+        """
+        for attempt in range(self.max_retries + 1):
+            backoff = self.backoff_factor * (2 ** attempt)
+            try:
+                response = send()
+            except requests.exceptions.ConnectionError as e:
+                if self._last_attempt(attempt, backoff, deadline):
+                    raise
+                logger.warning(f"{self.name} GET failed ({e}); retrying.")
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                backoff = max(backoff, retry_after_seconds(response))
+                if self._last_attempt(attempt, backoff, deadline):
+                    return response
+                response.close()
+            time.sleep(backoff)
+
+    def _last_attempt(self, attempt, backoff, deadline):
+        """No retry once they are used up, or once the deadline wouldn't leave time for one."""
+        return attempt == self.max_retries or (deadline is not None and deadline.remaining() <= backoff)
+
+    def _hedged(self, endpoint, send, deadline):
+        """
+        Sends the request and, if it is still unanswered after the endpoint's HEDGE_PERCENTILE
+        latency, sends it again; the first request to complete wins. Falls back to a plain call
+        until enough latencies are known, when over the hedging budget, or when all slots are busy.
+        """
+        delay = self.latency.percentile(endpoint, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+        with self._counts_lock:
+            self.requests += 1
+            within_budget = self.hedges < HEDGE_MAX_RATIO * self.requests
+        if delay is None or not within_budget or not self._hedge_slots.acquire(blocking=False):
+            return self._timed(endpoint, send, deadline)
+
+        try:
+            original = self._hedge_executor.submit(self._timed, endpoint, send, deadline)
+            try:
+                return original.result(timeout=delay)
+            except FutureTimeout:
+                pass
+            if deadline is not None and deadline.expired():
+                return original.result()
+
+            with self._counts_lock:
+                self.hedges += 1
+            hedge = self._hedge_executor.submit(self._timed, endpoint, send, deadline)
+            pending = {original, hedge}
+            error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        HEDGES.inc(upstream=self.name, endpoint=endpoint, winner="hedge" if future is hedge else "original")
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            self._hedge_slots.release()
+
+    def get(self, url, params=None, timeout=None, endpoint="other", deadline=None, **kwargs):
+        """Issues a pooled GET with the client's default timeouts, capped at the deadline if given."""
+        attempt = lambda: self.session.get(url, params=params, timeout=self._timeout(timeout, deadline), **kwargs)
+        send = lambda: self._send_with_retries(attempt, deadline)
+        if self.hedge:
+            return self._hedged(endpoint, send, deadline)
+        return self._timed(endpoint, send, deadline)
+
+    def post(self, url, json=None, timeout=None, endpoint="other", deadline=None, **kwargs):
+        """Issues a pooled POST with the client's default timeouts. Responses are not retried or hedged."""
+        return self._timed(endpoint, lambda: self.session.post(url, json=json, timeout=self._timeout(timeout, deadline), **kwargs), deadline)
+
+    def stats(self):
+        with self._counts_lock:
+            return {"name": self.name, "hedgedRequests": self.requests, "hedges": self.hedges}
+
+    def close(self):
+        self.session.close()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+
+
+def pool_size_from_env(name, default=None):
+    """Reads <NAME>_POOL_MAXSIZE, e.g. TMDB_POOL_MAXSIZE, falling back to UPSTREAM_POOL_MAXSIZE."""
+    return int(os.environ.get(f'{name.upper()}_POOL_MAXSIZE', default or DEFAULT_POOL_MAXSIZE))
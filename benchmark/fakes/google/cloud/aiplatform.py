@@ -0,0 +1,5 @@
+"""Benchmark stand-in for google.cloud.aiplatform."""
+
+
+def init(**kwargs):
+    pass
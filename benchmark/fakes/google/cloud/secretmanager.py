@@ -0,0 +1,7 @@
+"""Benchmark stand-in for google.cloud.secretmanager: every secret is 'benchmark-key'."""
+from types import SimpleNamespace
+
+
+class SecretManagerServiceClient:
+    def access_secret_version(self, request):
+        return SimpleNamespace(payload=SimpleNamespace(data=b"benchmark-key"))
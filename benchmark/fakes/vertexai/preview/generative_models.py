@@ -0,0 +1,83 @@
+"""
+Benchmark stand-in for vertexai.preview.generative_models.
+GenerativeModel forwards every prompt (after its system instruction) to the stub server's
+/gemini/generate endpoint, so Gemini latency and errors follow the benchmark profile.
+Responses report token usage estimated at 4 characters per token. A GenerationConfig's
+response schema is passed on to the stub, and max_output_tokens truncates the answer.
+"""
+import asyncio
+import json
+import os
+import urllib.request
+from types import SimpleNamespace
+
+STUB_URL = os.environ.get("BENCHMARK_STUB_URL", "http://127.0.0.1:8099")
+STREAM_CHUNK_CHARS = 16
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+class GenerationConfig:
+    def __init__(self, max_output_tokens=None, response_schema=None, **kwargs):
+        self.max_output_tokens = max_output_tokens
+        self.response_schema = response_schema
+
+
+def _response(text, prompt=None, finish_reason="STOP"):
+    part = SimpleNamespace(text=text)
+    usage = SimpleNamespace(prompt_token_count=_tokens(prompt), candidates_token_count=_tokens(text)) if prompt is not None else None
+    candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=SimpleNamespace(name=finish_reason))
+    return SimpleNamespace(text=text, candidates=[candidate], usage_metadata=usage)
+
+
+def _generate(prompt, generation_config=None):
+    """Returns (text, finish_reason)."""
+    request = urllib.request.Request(
+        f"{STUB_URL}/gemini/generate",
+        data=json.dumps({"prompt": prompt, "responseSchema": getattr(generation_config, "response_schema", None)}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=60) as response:  # raises HTTPError on the profile's errors
+        text = json.loads(response.read())["text"]
+    max_tokens = getattr(generation_config, "max_output_tokens", None)
+    if max_tokens and _tokens(text) > max_tokens:
+        return text[:max_tokens * 4], "MAX_TOKENS"
+    return text, "STOP"
+
+
+def _chunks(text):
+    return [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+
+
+class GenerativeModel:
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def _full_prompt(self, prompt):
+        return f"{self.system_instruction}\n\n{prompt}" if self.system_instruction else prompt
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        full_prompt = self._full_prompt(prompt)
+        text, finish_reason = _generate(full_prompt, generation_config)
+        if stream:
+            chunks = _chunks(text)
+            # Like the real SDK, only the last chunk carries the usage totals and finish reason
+            return (
+                _response(chunk, full_prompt, finish_reason) if i == len(chunks) - 1 else _response(chunk, finish_reason=None)
+                for i, chunk in enumerate(chunks)
+            )
+        return _response(text, full_prompt, finish_reason)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, **kwargs):
+        full_prompt = self._full_prompt(prompt)
+        text, finish_reason = await asyncio.to_thread(_generate, full_prompt, generation_config)
+        if stream:
+            async def chunks():
+                pieces = _chunks(text)
+                for i, chunk in enumerate(pieces):
+                    yield _response(chunk, full_prompt, finish_reason) if i == len(pieces) - 1 else _response(chunk, finish_reason=None)
+            return chunks()
+        return _response(text, full_prompt, finish_reason)
@@ -0,0 +1,290 @@
+"""
+Offline load test for the meal, movie and trivia agents.
+
+Starts the stub upstreams (stub_server.py), launches each agent as a subprocess with
+the Google SDK stand-ins in benchmark/fakes first on its PYTHONPATH (Secret Manager
+returns a fixed key, Gemini calls go to the stub), waits for /ready, then drives the
+agent's endpoint at each concurrency level and reports RPS, p50/p95/p99 latency,
+agent memory (RSS, PSS and peak RSS, summed over the server's worker processes) and the
+upstream calls made.
+
+Examples:
+    python benchmark/run.py
+    python benchmark/run.py --agents movie --profile realistic --concurrency 1,16,64 --requests 500
+    python benchmark/run.py --serving-mode async --json baseline.json --env CANDIDATE_POOL_ENABLED=false
+    python benchmark/run.py --serving-mode sync --env SERVER_WORKERS=4
+
+Needs the agents' own requirements installed locally (Flask, requests, ...; Quart and
+uvicorn for --serving-mode async), but no network or Google credentials.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stub_server import PROFILES, start_stub_server
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+FAKES_DIR = os.path.join(BENCHMARK_DIR, "fakes")
+
+# --- Workload ---
+KNOWN_MOODS = ["happy", "cozy", "sad", "tired", "romantic", "adventurous", "stressed", "bored", "nostalgic", "energetic"]
+MEAL_CONTEXTS = ["breakfast", "lunch", "dinner", "general"]
+TRIVIA_MEALS = ["Beef Stew", "Margherita Pizza", "Pad Thai", "Shakshuka", "Chicken Pot Pie"]
+TRIVIA_MOVIES = ["The Grand Budapest Hotel", "Spirited Away", "Heat", "Amelie", "Alien"]
+
+AGENTS = {
+    "meal": {"dir": "meal-agent", "path": "/recommend_meal"},
+    "movie": {"dir": "movie-agent", "path": "/recommend_movie"},
+    "trivia": {"dir": "trivia-agent", "path": "/get_trivia"},
+}
+
+
+def pick_mood(novel_ratio):
+    """A known mood, or with probability novel_ratio a never-seen one that misses every cache."""
+    if random.random() < novel_ratio:
+        return f"{random.choice(KNOWN_MOODS)} variant {random.randint(0, 10**9)}"
+    return random.choice(KNOWN_MOODS)
+
+
+def make_payload(agent, novel_ratio):
+    if agent == "meal":
+        return {"mood": pick_mood(novel_ratio), "mealContext": random.choice(MEAL_CONTEXTS)}
+    if agent == "movie":
+        return {"mood": pick_mood(novel_ratio)}
+    return {
+        "meal": {"mealTitle": random.choice(TRIVIA_MEALS), "mealDescription": "A classic dish."},
+        "movie": {"movieTitle": random.choice(TRIVIA_MOVIES), "movieDescription": "A well-loved film."},
+    }
+
+
+# --- Agent Processes ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_agent(agent, stub_url, serving_mode, workdir, extra_env):
+    """Launches one agent against the stubs. Returns (process, base_url, log_path)."""
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([FAKES_DIR, REPO_ROOT]),
+        "PORT": str(port),
+        "BENCHMARK_STUB_URL": stub_url,
+        "TMDB_API_BASE_URL": f"{stub_url}/3",
+        "SPOONACULAR_API_BASE_URL": stub_url,
+        # Start every run cold and keep the quota budget out of the way
+        "MOVIE_DETAILS_CACHE_PATH": os.path.join(workdir, f"{agent}_movie_details.sqlite3"),
+        "SPOONACULAR_DAILY_POINTS": "1000000",
+        **extra_env,
+    }
+    if serving_mode == "async":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    elif serving_mode == "dev":
+        command = [sys.executable, "main.py"]
+    else:
+        command = [sys.executable, "-m", "agent_common.runtime", "main:app"]
+    log_path = os.path.join(workdir, f"{agent}.log")
+    log = open(log_path, "w")
+    process = subprocess.Popen(command, cwd=os.path.join(REPO_ROOT, AGENTS[agent]["dir"]), env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{port}", log_path
+
+
+def wait_until_ready(process, base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if requests.get(f"{base_url}/ready", timeout=1).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def process_tree(pid):
+    """The process and its descendants (the runtime's server workers), from /proc (Linux only)."""
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f"/proc/{parent}/task"):
+                with open(f"/proc/{parent}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def memory_mb(pid):
+    """
+    Current and peak resident memory of a process and its workers, from /proc (Linux only).
+    RSS counts pages shared between forked workers once per worker; PSS splits them, so it
+    shows what preloading saves.
+    """
+    totals = {"rssMb": 0, "peakRssMb": 0, "pssMb": 0}
+    fields = {"VmRSS:": "rssMb", "VmHWM:": "peakRssMb", "Pss:": "pssMb"}
+    found = set()
+    for process in process_tree(pid):
+        for path in (f"/proc/{process}/status", f"/proc/{process}/smaps_rollup"):
+            try:
+                with open(path) as f:
+                    for line in f:
+                        key = fields.get(line.split(":")[0] + ":")
+                        if key:
+                            totals[key] += int(line.split()[1])
+                            found.add(key)
+            except OSError:
+                pass
+    return {key: round(totals[key] / 1024, 1) if key in found else None for key in totals}
+
+
+# --- Load Generation ---
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def drive(agent, url, concurrency, total_requests, novel_ratio, timeout):
+    """Sends total_requests POSTs with concurrency in flight. Returns latency/status stats."""
+    local = threading.local()
+    payloads = [make_payload(agent, novel_ratio) for _ in range(total_requests)]
+
+    def send(payload):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = session.post(url, json=payload, timeout=timeout).status_code
+        except requests.exceptions.RequestException:
+            status = None
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(send, payloads))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, status in outcomes if status == 200)
+    statuses = {}
+    for _, status in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "rps": round(total_requests / elapsed, 1) if elapsed else None,
+        "p50Ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p95Ms": round(percentile(latencies, 95), 1) if latencies else None,
+        "p99Ms": round(percentile(latencies, 99), 1) if latencies else None,
+    }
+
+
+def stub_requests(stub_url):
+    return requests.get(f"{stub_url}/stats", timeout=5).json()["requests"]
+
+
+def upstream_delta(before, after):
+    return {endpoint: count - before.get(endpoint, 0) for endpoint, count in after.items() if count - before.get(endpoint, 0)}
+
+
+def print_table(results):
+    header = f"{'agent':<7} {'mode':<6} {'conc':>5} {'reqs':>6} {'ok':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8} {'pss MB':>8} {'peak MB':>8}  upstream calls"
+    print(header)
+    print("-" * len(header))
+    fmt = lambda v: "-" if v is None else v
+    for r in results:
+        upstream = ", ".join(f"{k}={v}" for k, v in sorted(r["upstreamCalls"].items()))
+        print(f"{r['agent']:<7} {r['servingMode']:<6} {r['concurrency']:>5} {r['requests']:>6} {r['ok']:>6} {fmt(r['rps']):>8} "
+              f"{fmt(r['p50Ms']):>9} {fmt(r['p95Ms']):>9} {fmt(r['p99Ms']):>9} {fmt(r['rssMb']):>8} {fmt(r['pssMb']):>8} {fmt(r['peakRssMb']):>8}  {upstream}")
+
+
+# --- Entry Point ---
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", default="meal,movie,trivia", help="Comma-separated agents to benchmark.")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level.")
+    parser.add_argument("--warmup", type=int, default=20, help="Requests sent before measuring, to warm caches and pools.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast", help="Upstream latency/error/payload profile.")
+    parser.add_argument("--gemini-ms", type=float, help="Override the profile's Gemini latency.")
+    parser.add_argument("--tmdb-ms", type=float, help="Override the profile's TMDB latency.")
+    parser.add_argument("--spoonacular-ms", type=float, help="Override the profile's Spoonacular latency.")
+    parser.add_argument("--error-rate", type=float, help="Override the profile's upstream error rate (0-1).")
+    parser.add_argument("--novel-ratio", type=float, default=0.2, help="Share of requests with never-seen moods.")
+    parser.add_argument("--serving-mode", choices=["sync", "async", "dev"], default="sync",
+                        help="sync: the Flask app under the multi-process runtime; async: the ASGI app under uvicorn; dev: python main.py.")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request client timeout in seconds.")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment for the agents (repeatable).")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON, e.g. to keep as a baseline.")
+    parser.add_argument("--seed", type=int, default=1234, help="Random seed for the workload.")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    _, stub_url = start_stub_server(
+        args.profile, gemini_ms=args.gemini_ms, tmdb_ms=args.tmdb_ms,
+        spoonacular_ms=args.spoonacular_ms, error_rate=args.error_rate,
+    )
+    print(f"Stub upstreams ({args.profile}) on {stub_url}")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="moodfusion-bench-") as workdir:
+        for agent in args.agents.split(","):
+            process, base_url, log_path = start_agent(agent, stub_url, args.serving_mode, workdir, extra_env)
+            try:
+                started = time.monotonic()
+                if not wait_until_ready(process, base_url, timeout=60):
+                    print(f"{agent} agent did not become ready. Last log lines:")
+                    with open(log_path) as f:
+                        print("".join(f.readlines()[-20:]))
+                    continue
+                print(f"{agent} agent ready in {time.monotonic() - started:.2f}s on {base_url}")
+
+                url = f"{base_url}{AGENTS[agent]['path']}"
+                if args.warmup:
+                    drive(agent, url, min(8, args.warmup), args.warmup, args.novel_ratio, args.timeout)
+                for concurrency in concurrency_levels:
+                    before = stub_requests(stub_url)
+                    result = drive(agent, url, concurrency, args.requests, args.novel_ratio, args.timeout)
+                    result.update(agent=agent, servingMode=args.serving_mode, profile=args.profile,
+                                  upstreamCalls=upstream_delta(before, stub_requests(stub_url)), **memory_mb(process.pid))
+                    results.append(result)
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"profile": args.profile, "servingMode": args.serving_mode, "novelRatio": args.novel_ratio,
+                       "seed": args.seed, "results": results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Local stand-ins for every upstream the agents call, for offline benchmarking.
+
+Serves TMDB (/3/genre/movie/list, /3/discover/movie, /3/movie/{id}), Spoonacular
+(/recipes/complexSearch) and a Gemini endpoint (/gemini/generate) that the fake
+Vertex AI SDK in benchmark/fakes forwards generate_content calls to. Every endpoint
+sleeps for its profile latency (with jitter), fails with the profile error rate, and
+pads payloads to the profile size. GET /stats returns per-endpoint request counts.
+
+Run standalone with: python benchmark/stub_server.py --profile realistic --port 8099
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# --- Profiles ---
+# Latencies are medians in milliseconds; each call is jittered by +/-50%.
+PROFILES = {
+    "fast": {"gemini_ms": 50, "tmdb_ms": 20, "spoonacular_ms": 30, "error_rate": 0.0, "results_per_page": 20, "text_chars": 200},
+    "realistic": {"gemini_ms": 1200, "tmdb_ms": 150, "spoonacular_ms": 350, "error_rate": 0.01, "results_per_page": 20, "text_chars": 600},
+    "slow": {"gemini_ms": 3000, "tmdb_ms": 600, "spoonacular_ms": 1200, "error_rate": 0.02, "results_per_page": 20, "text_chars": 600},
+    "flaky": {"gemini_ms": 1200, "tmdb_ms": 150, "spoonacular_ms": 350, "error_rate": 0.2, "results_per_page": 20, "text_chars": 600},
+    "large-payload": {"gemini_ms": 1200, "tmdb_ms": 150, "spoonacular_ms": 350, "error_rate": 0.01, "results_per_page": 100, "text_chars": 5000},
+}
+
+STUB_GENRES = [
+    (28, "Action"), (12, "Adventure"), (16, "Animation"), (35, "Comedy"), (80, "Crime"),
+    (99, "Documentary"), (18, "Drama"), (10751, "Family"), (14, "Fantasy"), (36, "History"),
+    (27, "Horror"), (10402, "Music"), (9648, "Mystery"), (10749, "Romance"), (878, "Science Fiction"),
+    (10770, "TV Movie"), (53, "Thriller"), (10752, "War"), (37, "Western"),
+]
+STUB_KEYWORDS = [
+    "pasta", "soup", "stew", "curry", "tacos", "omelette", "pancakes", "stir-fry", "salad",
+    "roast chicken", "risotto", "burrito", "casserole", "grilled fish", "ramen", "chili",
+]
+LOREM = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt. "
+
+
+def filler(chars):
+    return (LOREM * (chars // len(LOREM) + 1))[:chars]
+
+
+# --- Gemini Answers ---
+def gemini_answer(prompt, schema=None):
+    """Plausible Gemini output for each kind of prompt the agents send, shaped by its response schema if it has one."""
+    numbered = re.findall(r"^(\d+)\. ", prompt, flags=re.MULTILINE)
+    if "Trivia Fact" in prompt:
+        return "Basil was once considered a royal herb, reserved for the king's own kitchen."
+    if "genre" in prompt.lower():
+        pick = lambda: [name for _, name in random.sample(STUB_GENRES, 3)]
+    elif "keywords" in prompt.lower():
+        pick = lambda: random.sample(STUB_KEYWORDS, 3)
+    else:
+        return ""
+    if schema:
+        if schema.get("type") == "object":
+            return json.dumps({number: pick() for number in schema.get("properties", {})})
+        return json.dumps(pick())
+    if "JSON object" in prompt:
+        return json.dumps({number: pick() for number in numbered})
+    return ", ".join(pick())
+
+
+class StubState:
+    def __init__(self, profile):
+        self.profile = dict(profile)
+        self.counts = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, endpoint, failed):
+        with self._lock:
+            self.counts[endpoint] += 1
+            if failed:
+                self.errors[endpoint] += 1
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.counts), "errors": dict(self.errors)}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real upstreams
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _simulate(self, endpoint, latency_key):
+        """Sleeps for the profile latency and decides whether this call fails."""
+        profile = self.state.profile
+        time.sleep(profile[latency_key] / 1000.0 * random.uniform(0.5, 1.5))
+        failed = random.random() < profile["error_rate"]
+        self.state.count(endpoint, failed)
+        if failed:
+            self._send(503, {"status_message": "Stub upstream error"})
+        return failed
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        profile = self.state.profile
+        per_page = profile["results_per_page"]
+        text = filler(profile["text_chars"])
+
+        if url.path == "/stats":
+            return self._send(200, self.state.stats())
+
+        if url.path == "/3/genre/movie/list":
+            if not self._simulate("tmdb_genres", "tmdb_ms"):
+                self._send(200, {"genres": [{"id": genre_id, "name": name} for genre_id, name in STUB_GENRES]})
+        elif url.path == "/3/discover/movie":
+            if not self._simulate("tmdb_discover", "tmdb_ms"):
+                page = int(query.get("page", ["1"])[0])
+                genres = [int(g) for g in query.get("with_genres", [""])[0].split(",") if g] or [18]
+                results = [
+                    {"id": page * 1000 + i, "title": f"Stub Movie {page}-{i}", "poster_path": f"/stub{i}.jpg",
+                     "overview": text, "genre_ids": genres + [random.choice(STUB_GENRES)[0]]}
+                    for i in range(per_page)
+                ]
+                self._send(200, {"page": page, "results": results, "total_pages": 500})
+        elif url.path.startswith("/3/movie/"):
+            if not self._simulate("tmdb_details", "tmdb_ms"):
+                self._send(200, {
+                    "release_date": "2001-02-03", "runtime": random.randint(80, 180), "vote_average": random.uniform(5, 9),
+                    "overview": text,
+                    "release_dates": {"results": [{"iso_3166_1": "US", "release_dates": [{"certification": "PG-13"}]}]},
+                })
+        elif url.path == "/recipes/complexSearch":
+            if not self._simulate("spoonacular_search", "spoonacular_ms"):
+                number = int(query.get("number", ["5"])[0])
+                base = random.randint(0, 10000)
+                results = [
+                    {"id": base + i, "title": f"{query.get('query', ['food'])[0].title()} {base + i}", "image": "https://img.example/r.jpg",
+                     "sourceUrl": "https://recipes.example/r", "summary": text, "instructions": text}
+                    for i in range(number)
+                ]
+                self._send(200, {"results": results, "totalResults": 1000}, headers={"X-API-Quota-Left": "100000"})
+        else:
+            self._send(404, {"status_message": "Unknown stub endpoint"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if urlsplit(self.path).path != "/gemini/generate":
+            return self._send(404, {"error": "Unknown stub endpoint"})
+        if not self._simulate("gemini", "gemini_ms"):
+            self._send(200, {"text": gemini_answer(body.get("prompt", ""), body.get("responseSchema"))})
+
+
+def start_stub_server(profile="fast", port=0, **overrides):
+    """Starts the stub server on a background thread. Returns (server, base_url)."""
+    state = StubState({**PROFILES[profile], **{k: v for k, v in overrides.items() if v is not None}})
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="fast")
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+    server, url = start_stub_server(args.profile, args.port)
+    print(f"Stub upstreams ({args.profile}) listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
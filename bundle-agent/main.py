@@ -0,0 +1,182 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+import requests
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+
+from agent_common.metrics import install_metrics, span
+from agent_common.payloads import install_payload_handling
+from agent_common.resilience import DEADLINE_HEADER, CircuitOpen
+from agent_common.startup import Startup, install_readiness_gate
+from agent_common.upstream import UpstreamClient, pool_size_from_env
+
+# Configure logging to ensure messages appear in Cloud Run logs
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Flask App Setup ---
+app = Flask(__name__)
+CORS(app) # Enable CORS for all routes
+install_metrics(app, 'bundle-agent')
+install_payload_handling(app, 'bundle-agent')
+
+# --- Configuration ---
+# The meal, movie and trivia agents are separate Cloud Run services; this agent calls them over HTTP.
+MEAL_AGENT_URL = os.environ.get('MEAL_AGENT_URL', 'https://meal-agent-702694291445.us-central1.run.app/recommend_meal')
+MOVIE_AGENT_URL = os.environ.get('MOVIE_AGENT_URL', 'https://movie-agent-702694291445.us-central1.run.app/recommend_movie')
+TRIVIA_AGENT_URL = os.environ.get('TRIVIA_AGENT_URL', 'https://trivia-agent-702694291445.us-central1.run.app/get_trivia')
+BUNDLE_DEADLINE_SECONDS = float(os.environ.get('BUNDLE_DEADLINE_SECONDS', 20))
+# Trivia is skipped if less than this much of the deadline is left once meal and movie are settled
+TRIVIA_MIN_SECONDS = float(os.environ.get('BUNDLE_TRIVIA_MIN_SECONDS', 1.5))
+
+# --- Agent HTTP Client ---
+def agent_base_url(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+# Built by a startup step, so under the multi-process runtime every worker has its own connections
+agents_client = None
+bundle_executor = None
+
+def init_agent_clients():
+    global agents_client, bundle_executor
+    # One circuit breaker per component, so a failing trivia agent doesn't stop meal and movie calls
+    agents_client = UpstreamClient(
+        'agents',
+        {agent_base_url(url): pool_size_from_env('agents') for url in (MEAL_AGENT_URL, MOVIE_AGENT_URL, TRIVIA_AGENT_URL)},
+        breaker_per_endpoint=True,
+    )
+    bundle_executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get('BUNDLE_WORKERS', 32)),
+        thread_name_prefix="bundle"
+    )
+
+# --- Startup ---
+# Requests wait on the readiness gate until the clients exist; under the multi-process
+# runtime the step runs in each worker after the fork.
+startup = Startup('bundle-agent')
+startup.add_step('agent_clients', init_agent_clients)
+startup.start()
+install_readiness_gate(app, startup, exempt_endpoints=['metrics'])
+
+# --- Agent Calls ---
+def call_agent(component, url, payload, deadline):
+    """
+    POSTs to an agent with whatever is left of the deadline as the read timeout. The agent is
+    told the same budget (DEADLINE_HEADER) so it stops working once the bundle has given up.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Deadline exceeded before the call started.")
+    response = agents_client.post(
+        url, json=payload, timeout=(min(3.05, remaining), remaining), endpoint=component,
+        headers={DEADLINE_HEADER: str(int(remaining * 1000))},
+    )
+    if not response.ok:
+        try:
+            error = response.json().get("error")
+        except ValueError:
+            error = None
+        raise RuntimeError(f"{response.status_code}: {error or response.reason}")
+    return response.json()
+
+def trivia_payload(meal, movie):
+    """Only the fields generate_trivia reads."""
+    payload = {}
+    if meal:
+        payload["meal"] = {"mealTitle": meal.get("mealTitle"), "mealDescription": meal.get("mealDescription")}
+    if movie:
+        payload["movie"] = {"movieTitle": movie.get("movieTitle"), "movieDescription": movie.get("movieDescription")}
+    return payload
+
+def describe_error(e):
+    if isinstance(e, (TimeoutError, requests.exceptions.Timeout)):
+        return "Timed out before the bundle deadline."
+    if isinstance(e, CircuitOpen):
+        return "Skipped: the agent is failing and its circuit is open."
+    return str(e)
+
+# --- Bundle Orchestration Logic ---
+def get_bundle_recommendation(mood: str, meal_context: str):
+    """
+    Fans out to the meal and movie agents concurrently, then asks the trivia agent for a fact
+    about whatever came back. Every component is optional: failures and deadline overruns are
+    reported per component in "errors" instead of failing the bundle.
+    """
+    started = time.monotonic()
+    deadline = started + BUNDLE_DEADLINE_SECONDS
+    result = {"meal": None, "movie": None, "triviaFact": None, "errors": {}}
+
+    pending = {
+        bundle_executor.submit(call_agent, "meal", MEAL_AGENT_URL, {"mood": mood, "mealContext": meal_context}, deadline): "meal",
+        bundle_executor.submit(call_agent, "movie", MOVIE_AGENT_URL, {"mood": mood}, deadline): "movie",
+    }
+    while pending:
+        done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            component = pending.pop(future)
+            try:
+                result[component] = future.result()
+            except Exception as e:
+                logger.warning(f"Bundle component '{component}' failed: {e}")
+                result["errors"][component] = describe_error(e)
+
+    # Anything still running has missed the deadline; its thread finishes on its own
+    for component in pending.values():
+        logger.warning(f"Bundle component '{component}' missed the {BUNDLE_DEADLINE_SECONDS}s deadline.")
+        result["errors"][component] = describe_error(TimeoutError())
+
+    # Trivia starts as soon as meal and movie are settled, with what is left of the deadline
+    if result["meal"] or result["movie"]:
+        if deadline - time.monotonic() >= TRIVIA_MIN_SECONDS:
+            try:
+                trivia = call_agent("trivia", TRIVIA_AGENT_URL, trivia_payload(result["meal"], result["movie"]), deadline)
+                result["triviaFact"] = trivia.get("triviaFact")
+            except Exception as e:
+                logger.warning(f"Bundle component 'trivia' failed: {e}")
+                result["errors"]["trivia"] = describe_error(e)
+        else:
+            result["errors"]["trivia"] = "Skipped: not enough time left before the bundle deadline."
+
+    result["elapsedMs"] = round((time.monotonic() - started) * 1000)
+    logger.info(f"Bundle for mood '{mood}' finished in {result['elapsedMs']}ms with errors: {result['errors']}")
+    return result
+
+# --- Flask Route ---
+@app.route('/recommend_bundle', methods=['POST'])
+def recommend_bundle():
+    """
+    HTTP endpoint for the Bundle Agent.
+    Expects a JSON payload with 'mood' and optionally 'mealContext'.
+    Returns 200 if at least the meal or the movie was found, otherwise 502 with per-component errors.
+    """
+    try:
+        data = request.get_json()
+        mood = data.get('mood')
+        meal_context = data.get('mealContext', 'general')
+
+        if not mood:
+            logger.warning("Missing 'mood' in request body in bundle agent")
+            return jsonify({"error": "Missing 'mood' in request body"}), 400
+
+        logger.info(f"Received bundle request for mood: {mood}, mealContext: {meal_context}")
+        bundle = get_bundle_recommendation(mood, meal_context)
+        with span('serialize'):
+            if not bundle["meal"] and not bundle["movie"]:
+                return jsonify(bundle), 502
+            return jsonify(bundle), 200
+
+    except Exception as e:
+        logger.error(f"Unhandled error in recommend_bundle endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# --- Entry Point for Cloud Run ---
+# Local development only; the image serves the app through agent_common.runtime (gunicorn)
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -0,0 +1,263 @@
+"""
+Async (ASGI) serving mode for the Meal Agent.
+
+Serves the same /recommend_meal contract as main.py, but the Gemini call and the
+Spoonacular searches are awaited instead of holding a worker thread, so one instance
+can keep hundreds of slow requests in flight. Prompts, caches, the quota budget,
+circuit breakers and response formatting are shared with main.py, and every request
+works within the same deadline.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import logging
+import random
+
+import httpx
+from quart import Quart, request, jsonify
+from quart_cors import cors
+
+import main as agent
+from agent_common.admission import Overloaded, admission_limiter
+from agent_common.async_upstream import AsyncUpstreamClient
+from agent_common.batch import BatchRequestError, read_batch_items
+from agent_common.cache import call_with_caches, make_key
+from agent_common.metrics import count_fallback, count_inference_source, install_async_metrics, span
+from agent_common.payloads import install_async_payload_handling
+from agent_common.resilience import (
+    DEADLINE_HEADER, GEMINI_TIMEOUT_SECONDS, REQUEST_DEADLINE_SECONDS, CircuitOpen, Deadline, DeadlineExceeded, await_with_deadline,
+)
+from agent_common.singleflight import AsyncSingleFlight
+from agent_common.startup import install_async_readiness_gate
+from agent_common.upstream import pool_size_from_env
+
+logger = logging.getLogger(__name__)
+
+# --- Quart App Setup ---
+app = Quart(__name__)
+app = cors(app, allow_origin="*") # Enable CORS for all routes
+
+spoonacular_client = AsyncUpstreamClient(
+    'spoonacular', max_connections=pool_size_from_env('spoonacular'), hedge=agent.spoonacular_client.hedge,
+    limiter=admission_limiter('spoonacular'),
+)
+recipe_flight = AsyncSingleFlight('meal_recipes')
+# Read and written by the shared recipe search helpers; off the event loop when they use Redis
+RECIPE_CACHES = (agent.recipe_cache, agent.degraded_recipe_cache, agent.empty_search_cache)
+install_async_metrics(app, 'meal-agent')
+install_async_payload_handling(app, 'meal-agent')
+install_async_readiness_gate(app, agent.startup, exempt_endpoints=['cache_stats', 'metrics'])
+
+# --- Async Meal Recommendation Logic ---
+async def infer_meal_keywords_async(mood: str, meal_context: str, gemini_prompt: str, deadline):
+    """Async version of main.infer_meal_keywords using Gemini's async generation API."""
+    try:
+        with span('gemini_inference'):
+            gemini_response = await await_with_deadline(
+                deadline.within(GEMINI_TIMEOUT_SECONDS), 'gemini_inference',
+                gemini_prompt.generate_async, breaker=agent.gemini_breaker, limiter=agent.gemini_limiter,
+            )
+        with span('parse'):
+            return agent.parse_meal_keywords(gemini_response, mood, meal_context, gemini_prompt.name)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error using Gemini for meal inference: {e}. Falling back to default 'comfort food'.")
+        return []
+
+async def search_recipes_async(params, deadline, endpoint="complexSearch", reserve_points=0.0):
+    """Async version of main.search_recipes (same cache, quota and degraded-mode handling)."""
+    search_state, recipes = await call_with_caches(RECIPE_CACHES, agent.begin_recipe_search, params, reserve_points)
+    if recipes is not None:
+        return recipes
+
+    try:
+        response = await spoonacular_client.get(agent.SPOONACULAR_URL, params=params, endpoint=endpoint, deadline=deadline)
+        agent.sync_quota_from_headers(response.headers)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        if agent.upstream_status(e) == 402:
+            degraded = await call_with_caches(RECIPE_CACHES, agent.recipes_after_quota_error, search_state, params.get("query"))
+            if degraded:
+                return degraded
+        elif isinstance(e, (httpx.TimeoutException, CircuitOpen)):
+            degraded = await call_with_caches(RECIPE_CACHES, agent.recipes_after_unavailable, search_state, params.get("query"), e)
+            if degraded:
+                return degraded
+        raise
+
+    return await call_with_caches(RECIPE_CACHES, agent.finish_recipe_search, search_state, response.json().get("results", []))
+
+async def resolve_meal_keywords_async(mood: str, meal_context: str, gemini_prompt: str, deadline):
+    """Async version of main.resolve_meal_keywords."""
+    cache_key = make_key(mood, meal_context)
+    meal_keywords = await agent.keyword_cache.get_async(cache_key)
+    if meal_keywords:
+        logger.info(f"Inference cache hit for mood '{mood}' ({meal_context}): {meal_keywords}")
+        count_inference_source('cache')
+        return meal_keywords
+
+    meal_keywords = agent.keywords_from_mood_index(mood, meal_context)
+    if meal_keywords:
+        count_inference_source('mood_index')
+        return meal_keywords
+
+    meal_keywords = await infer_meal_keywords_async(mood, meal_context, gemini_prompt, deadline)
+    count_inference_source('gemini')
+    if meal_keywords:
+        await agent.keyword_cache.set_async(cache_key, meal_keywords)
+        return meal_keywords
+    count_fallback('comfort_food')
+    return ["comfort food"]
+
+def _discard_result(task):
+    """Retrieves a cancelled or late search's outcome so its failure isn't reported as unhandled."""
+    if not task.cancelled():
+        task.exception()
+
+async def search_keywords_async(meal_keywords, spoonacular_meal_type_filter, deadline):
+    """
+    Async version of main.search_keywords. Searches still running when the answer is known
+    are cancelled.
+    """
+    plan = agent.search_keywords_plan(meal_keywords)
+
+    async def search(position, keyword, reserve):
+        params = agent.build_search_params([keyword], spoonacular_meal_type_filter)
+        return position, await search_recipes_async(params, deadline, "complexSearch", reserve)
+
+    tasks = [asyncio.ensure_future(search(position, keyword, reserve)) for position, (keyword, reserve) in enumerate(plan)]
+    for task in tasks:
+        task.add_done_callback(_discard_result)
+    merged, errors = [], []
+    try:
+        for next_search in asyncio.as_completed(tasks, timeout=deadline.remaining()):
+            try:
+                position, recipes = await next_search
+            except (httpx.HTTPError, Overloaded, agent.QuotaExhausted) as e:
+                errors.append(e)
+                continue
+            if recipes and agent.SPECULATIVE_SEARCH_MODE != 'merge':
+                agent.SEARCH_OUTCOMES.inc(served=position)
+                logger.info(f"Serving recipes for keyword '{plan[position][0]}' (searched {[k for k, _ in plan]}).")
+                return recipes
+            merged = agent.merge_recipes(merged, recipes, agent.RECIPES_PER_KEY)
+    except asyncio.TimeoutError:
+        logger.error(f"Request deadline reached while searching recipes for keywords: {[k for k, _ in plan]}")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    agent.SEARCH_OUTCOMES.inc(served='merged' if merged else 'none')
+    if not merged and errors and len(errors) == len(tasks):
+        raise errors[0]
+    return merged
+
+async def find_recipes_async(meal_keywords, spoonacular_meal_type_filter, deadline):
+    """Async version of main.find_recipes."""
+    try:
+        recipes = await search_keywords_async(meal_keywords, spoonacular_meal_type_filter, deadline)
+        logger.info(f"Spoonacular returned {len(recipes)} recipes for keywords: {meal_keywords}, type: {spoonacular_meal_type_filter}")
+
+        if not recipes:
+            logger.warning(f"No recipes found for keywords: {meal_keywords}, type: {spoonacular_meal_type_filter}. Trying popular food fallback.")
+            deadline.check('popular_fallback')
+            count_fallback('popular_food')
+            recipes = await search_recipes_async(agent.build_fallback_params(), deadline, endpoint="complexSearch_popular")
+
+            if not recipes:
+                raise ValueError("Could not find any recipes with fallback.")
+
+        return recipes
+
+    except httpx.HTTPError as e:
+        logger.error(f"Error calling Spoonacular API: {e}")
+        if agent.upstream_status(e) == 402:
+            raise agent.QuotaExhausted(agent.QUOTA_EXHAUSTED_MESSAGE) from e
+        if deadline.expired():
+            raise DeadlineExceeded("Request deadline exceeded during the recipe search.") from e
+        raise
+
+async def get_meal_recommendation_async(mood: str, meal_context: str, deadline=None):
+    """Async version of main.get_meal_recommendation."""
+    deadline = deadline or Deadline(REQUEST_DEADLINE_SECONDS)
+    logger.info(f"Entering get_meal_recommendation_async for mood: '{mood}', context: '{meal_context}'")
+
+    snapshot_meals = agent.meals_from_snapshot(mood, meal_context)
+    if snapshot_meals:
+        return random.choice(snapshot_meals)
+
+    gemini_prompt, spoonacular_meal_type_filter = agent.build_meal_prompt(mood, meal_context)
+
+    async def keywords_then_recipes():
+        meal_keywords = await resolve_meal_keywords_async(mood, meal_context, gemini_prompt, deadline)
+        return await find_recipes_async(meal_keywords, spoonacular_meal_type_filter, deadline)
+
+    # Concurrent requests for the same mood and context share the inference and the search
+    recipes = await recipe_flight.do(make_key(mood, meal_context), keywords_then_recipes)
+    return agent.format_meal(random.choice(recipes))
+
+# --- Quart Routes ---
+@app.route('/recommend_meal', methods=['POST'])
+async def recommend_meal():
+    """
+    Async HTTP endpoint for the Meal Agent.
+    Expects a JSON payload with 'mood' and optionally 'mealContext'.
+    """
+    try:
+        data = await request.get_json()
+        mood = data.get('mood')
+        meal_context = data.get('mealContext', 'general')
+
+        if not mood:
+            logger.warning("Missing 'mood' in request body")
+            return jsonify({"error": "Missing 'mood' in request body"}), 400
+
+        logger.info(f"Received request for mood: {mood}, mealContext: {meal_context} in meal agent (async)")
+        deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER), REQUEST_DEADLINE_SECONDS)
+        meal_recommendation = await get_meal_recommendation_async(mood, meal_context, deadline)
+        with span('serialize'):
+            return jsonify(meal_recommendation), 200
+
+    except DeadlineExceeded as e:
+        logger.warning(f"Deadline exceeded in recommend_meal endpoint: {e}")
+        return jsonify({"error": str(e)}), 504
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_meal request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        logger.error(f"Unhandled error in recommend_meal endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/recommend_meal_batch', methods=['POST'])
+async def recommend_meal_batch():
+    """
+    Batch HTTP endpoint, same contract as main.recommend_meal_batch. The batch already
+    bounds its own concurrency, so it runs on the synchronous path in a worker thread.
+    """
+    try:
+        data = await request.get_json() or {}
+        items = read_batch_items(data, defaults={"mealContext": data.get('mealContext', 'general')})
+        logger.info(f"Received batch request with {len(items)} items in meal agent (async)")
+        batch_results = await asyncio.to_thread(agent.get_meal_recommendations_batch, items)
+        with span('serialize'):
+            return jsonify(batch_results), 200
+
+    except BatchRequestError as e:
+        logger.warning(f"Rejected batch request in meal agent: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_meal_batch request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        logger.error(f"Unhandled error in recommend_meal_batch endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cache_stats', methods=['GET'])
+async def cache_stats():
+    """Reports inference cache, recipe cache and Spoonacular budget counters."""
+    return jsonify({**agent.cache_report(), "asyncCoalescing": recipe_flight.stats(), "asyncHedging": spoonacular_client.stats()}), 200
+
+@app.after_serving
+async def close_clients():
+    await spoonacular_client.aclose()
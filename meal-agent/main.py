@@ -3,12 +3,29 @@ import requests
 import json
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from google.cloud import secretmanager
-
-from google.cloud import aiplatform
-from vertexai.preview.generative_models import GenerativeModel
 import random
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime, timedelta, timezone
+
+from agent_common.admission import Overloaded, admission_limiter, admission_report
+from agent_common.batch import BATCH_DEADLINE_SECONDS, BATCH_INFERENCE_CHUNK, BATCH_WORKERS, BatchRequestError, chunked, item_errors, read_batch_items
+from agent_common.budget import TokenBucket
+from agent_common.cache import cache_from_env, make_key, normalize_mood
+from agent_common.metrics import count_fallback, count_inference_source, install_metrics, registry, span
+from agent_common.mood_index import MoodIndex
+from agent_common.payloads import install_payload_handling
+from agent_common.prompts import LIST_MAX_OUTPUT_TOKENS, PromptTemplate, numbered_lists_schema, parse_numbered_lists, parse_string_list, string_list_schema
+from agent_common.resilience import (
+    DEADLINE_HEADER, GEMINI_TIMEOUT_SECONDS, REQUEST_DEADLINE_SECONDS,
+    CircuitOpen, Deadline, DeadlineExceeded, call_with_deadline, circuit_breaker, circuit_report,
+)
+from agent_common.runtime import get_secret, init_secret_manager, init_vertex_ai, worker_processes
+from agent_common.singleflight import SingleFlight
+from agent_common.snapshot import snapshot_store_from_env
+from agent_common.startup import Startup, install_readiness_gate
+from agent_common.upstream import UpstreamClient, pool_size_from_env
 
 # Configure logging to ensure messages appear in Cloud Run logs
 logging.basicConfig(level=logging.INFO)
@@ -18,133 +35,371 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
 
-# --- Configuration ---
-PROJECT_ID = os.environ.get('GCP_PROJECT_ID', 'moodfusion-hackathon')
-REGION = os.environ.get('GCP_REGION', 'us-central1')
-
-# --- Secret Manager Client ---
-secret_manager_client = secretmanager.SecretManagerServiceClient()
+# --- Global variables for API keys (fetched once on startup) ---
+SPOONACULAR_API_KEY = None
 
-# --- Helper Function to Get Secrets ---
-def get_secret(secret_name):
-    """Fetches a secret from Secret Manager."""
+def load_spoonacular_api_key():
+    global SPOONACULAR_API_KEY
     try:
-        resource_name = f"projects/{PROJECT_ID}/secrets/{secret_name}/versions/latest"
-        response = secret_manager_client.access_secret_version(request={"name": resource_name})
-        return response.payload.data.decode("UTF-8")
-    except Exception as e:
-        logger.error(f"Error accessing secret '{secret_name}': {e}")
+        SPOONACULAR_API_KEY = get_secret('spoonacular_api_key')
+        logger.info("Spoonacular API Key loaded.")
+    except Exception:
+        logger.critical("Failed to load Spoonacular API key. Exiting.")
         raise
 
-# --- Global variables for API keys (fetched once on startup) ---
-try:
-    SPOONACULAR_API_KEY = get_secret('spoonacular_api_key')
-    logger.info("Spoonacular API Key loaded.")
-except Exception as e:
-    logger.critical("Failed to load Spoonacular API key. Exiting.")
-    exit(1)
-
-# --- Vertex AI (Gemini) Client ---
-aiplatform.init(project=PROJECT_ID, location=REGION)
-model = GenerativeModel('gemini-2.0-flash')
+# --- Gemini Prompts ---
+# Per meal context: (prompt wording, Spoonacular type filter, what Gemini must keep to).
+# Spoonacular has no 'lunch' type, so 'main course' stands in for lunch-like meals.
+MEAL_CONTEXTS = {
+    "breakfast": ("a breakfast or brunch meal", "breakfast",
+                  "Only breakfast/brunch dishes such as eggs, pancakes, waffles, oatmeal, breakfast burritos or breakfast meats. "
+                  "No lunch or dinner items (pasta, pizza, steak, stir-fry, curry, stew, casserole, sandwiches)."),
+    "lunch": ("a lunch meal", "main course",
+              "Only lighter, savory lunch dishes. No breakfast items (pancakes, eggs benedict) or heavy dinners (roasts, heavy stews)."),
+    "dinner": ("a hearty dinner meal", "main course",
+               "Only savory, substantial dinner dishes. No breakfast items (pancakes, eggs, muffins) or light lunches (salads as a main, light sandwiches)."),
+    "general": ("a meal (breakfast, lunch or dinner)", "",
+                "Any savory meal."),
+}
+MEAL_KEYWORD_EXAMPLES = {
+    "breakfast": [("cozy", ["warm oatmeal", "breakfast casserole", "fluffy pancakes"]), ("happy", ["pancakes with berries", "breakfast burrito", "omelette"])],
+    "lunch": [("energetic", ["grilled chicken salad", "lean protein bowl", "fresh wrap"])],
+    "dinner": [("romantic", ["elegant steak", "seafood pasta", "wine pairing meal"]), ("happy", ["celebratory feast", "pizza night", "BBQ ribs"])],
+    "general": [("tired", ["easy one-pan meal", "quick pasta", "simple chicken", "soup and sandwich"])],
+}
+MEAL_KEYWORDS_MAX = 5
+# Gemini answers with a JSON list of keywords (an object of lists for a batch) matching these schemas
+MEAL_KEYWORDS_SCHEMA = string_list_schema(MEAL_KEYWORDS_MAX)
+MEAL_KEYWORD_RULES = """
+Never suggest desserts (cake, cookies, pie, ice cream, tarts, sweet pastries), sweet-only snacks (fruit, nuts, plain yogurt, sweet smoothies) or drinks (coffee, tea, juice).
+Keywords can be cuisines (Italian, Mexican, Thai), dishes (omelette, soup, stir-fry, curry, burrito, pasta), main proteins or vegetables (chicken, fish, lentil, tofu) or preparation styles (grilled, baked, braised, quick).
+"""
 
+def meal_keyword_template(meal_context):
+    description, _, context_rule = MEAL_CONTEXTS[meal_context]
+    examples = "\n".join(f'- "{mood}": {json.dumps(keywords)}' for mood, keywords in MEAL_KEYWORD_EXAMPLES[meal_context])
+    return PromptTemplate(f"meal_keywords_{meal_context}", f"""
+Suggest 3-5 distinct food-related keywords that match the user's mood for {description}.
+{context_rule}
+{MEAL_KEYWORD_RULES}
+Examples:
+{examples}
+Reply with a JSON list of the keywords.
+""", 'The user is feeling: "{mood}".', response_schema=MEAL_KEYWORDS_SCHEMA, max_output_tokens=LIST_MAX_OUTPUT_TOKENS)
+
+# Compiled once per context, not rebuilt per request; the mood is the only per-request text
+MEAL_PROMPTS = {meal_context: meal_keyword_template(meal_context) for meal_context in MEAL_CONTEXTS}
+MEAL_BATCH_PROMPT = PromptTemplate("meal_keywords_batch", f"""
+For each numbered request, suggest 3-5 distinct food-related keywords that match the user's mood for the requested kind of meal.
+{MEAL_KEYWORD_RULES}
+Rules for each kind of meal:
+{chr(10).join(f"- {meal_context} ({description}): {rule}" for meal_context, (description, _, rule) in MEAL_CONTEXTS.items())}
+
+Return a JSON object mapping each request number to its list of keywords, for example:
+{{"1": ["warm oatmeal", "breakfast casserole", "fluffy pancakes"], "2": ["grilled chicken salad", "fresh wrap", "lean protein bowl"]}}
+""", "Requests:\n{requests}", max_output_tokens=LIST_MAX_OUTPUT_TOKENS * BATCH_INFERENCE_CHUNK)
+
+def init_gemini_prompts():
+    for template in (*MEAL_PROMPTS.values(), MEAL_BATCH_PROMPT):
+        template.prepare()
+
+# The SDK call has no timeout of its own, so it runs here and the request waits only until its deadline.
+# Calls beyond the workers wait in the admission queue and are shed with 503 once it is full.
+GEMINI_WORKERS = int(os.environ.get('GEMINI_WORKERS', 32))
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_WORKERS, thread_name_prefix="gemini")
+gemini_breaker = circuit_breaker('gemini')
+gemini_limiter = admission_limiter('gemini', max_concurrent=GEMINI_WORKERS)
+
+# --- Local Mood Index ---
+# Nearest-neighbour fast path over a curated set of moods (mood_index_seed.json, mood -> meal context
+# -> keywords). Built on CPU at startup; moods it can't match confidently still go to Gemini.
+mood_index = None
+
+def load_mood_index():
+    global mood_index
+    if os.environ.get('MOOD_INDEX_ENABLED', 'true').lower() != 'true':
+        return
+    mood_index = MoodIndex.from_seed_file(
+        'meal_moods',
+        os.environ.get('MOOD_INDEX_SEED_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mood_index_seed.json')),
+        min_score=float(os.environ.get('MOOD_INDEX_MIN_SCORE', 0.7)),
+    )
 
-# --- Meal Recommendation Logic (Core of the Agent) ---
-def get_meal_recommendation(mood: str, meal_context: str): # MODIFIED: Accepts meal_context
+def keywords_from_mood_index(mood: str, meal_context: str):
+    """Meal keywords for a confidently matched known mood, or None to ask Gemini."""
+    match = mood_index.lookup(mood) if mood_index else None
+    if not match:
+        return None
+    keywords_by_context, score, matched_mood = match
+    meal_keywords = keywords_by_context.get(meal_context) or keywords_by_context.get("general")
+    if meal_keywords:
+        logger.info(f"Mood index matched '{mood}' to '{matched_mood}' (score {score:.2f}): {meal_keywords}")
+    return meal_keywords
+
+# --- Recommendation Snapshot ---
+# Meals precomputed offline by precompute.py for a vocabulary of moods, keyed like the inference
+# cache. Covered moods are answered from the memory-mapped file without any network call; the
+# file is mapped again whenever the job replaces it.
+recommendation_snapshot = snapshot_store_from_env('meal_recommendations')
+
+def load_recommendation_snapshot():
+    if recommendation_snapshot:
+        recommendation_snapshot.open()
+
+def watch_recommendation_snapshot():
+    if recommendation_snapshot:
+        recommendation_snapshot.watch()
+
+def meals_from_snapshot(mood: str, meal_context: str):
+    """The precomputed meals for the mood and context, or None if the snapshot doesn't cover them."""
+    entry = recommendation_snapshot.get(make_key(mood, meal_context)) if recommendation_snapshot else None
+    if not entry or not entry.get("meals"):
+        return None
+    count_inference_source('snapshot')
+    return entry["meals"]
+
+# --- Startup ---
+# Independent steps run concurrently in the background while the server binds the port;
+# requests wait on the readiness gate installed below. Under the multi-process runtime the
+# mood index and the snapshot are loaded once before workers are forked, and every worker
+# runs the other steps.
+startup = Startup('meal-agent')
+startup.add_step('secret_manager', init_secret_manager)
+startup.add_step('spoonacular_api_key', load_spoonacular_api_key, depends_on=['secret_manager'])
+startup.add_step('vertex_ai', init_vertex_ai)
+startup.add_step('gemini_prompts', init_gemini_prompts, depends_on=['vertex_ai'])
+startup.add_step('mood_index', load_mood_index, critical=False, preload=True)
+startup.add_step('recommendation_snapshot', load_recommendation_snapshot, critical=False, preload=True)
+startup.add_step('snapshot_reload', watch_recommendation_snapshot, depends_on=['recommendation_snapshot'], critical=False)
+startup.start()
+install_metrics(app, 'meal-agent')
+install_payload_handling(app, 'meal-agent')
+install_readiness_gate(app, startup, exempt_endpoints=['cache_stats', 'metrics'])
+
+# --- Spoonacular HTTP Client ---
+# One pooled keep-alive session for all Spoonacular calls (timeouts + retries on GET).
+# The base URL is overridable so the offline benchmark can point the agent at a local stub.
+# Hedging is off by default: every duplicate search spends daily quota points.
+SPOONACULAR_API_BASE_URL = os.environ.get('SPOONACULAR_API_BASE_URL', 'https://api.spoonacular.com')
+spoonacular_client = UpstreamClient(
+    'spoonacular',
+    {SPOONACULAR_API_BASE_URL: pool_size_from_env('spoonacular')},
+    hedge=os.environ.get('SPOONACULAR_HEDGE_ENABLED', 'false').lower() == 'true',
+    limiter=admission_limiter('spoonacular'),
+)
+
+# --- Spoonacular Quota Budget and Recipe Cache ---
+SPOONACULAR_URL = f"{SPOONACULAR_API_BASE_URL}/recipes/complexSearch"
+SPOONACULAR_DAILY_POINTS = float(os.environ.get('SPOONACULAR_DAILY_POINTS', 150))
+# complexSearch costs 1 point + 0.01 per result + 0.025 per result with recipe information
+SPOONACULAR_POINTS_PER_SEARCH = float(os.environ.get('SPOONACULAR_POINTS_PER_SEARCH', 1.175))
+# Each server worker process tracks its own share of the daily quota
+SPOONACULAR_WORKER_POINTS = SPOONACULAR_DAILY_POINTS / worker_processes()
+spoonacular_budget = TokenBucket(SPOONACULAR_WORKER_POINTS, SPOONACULAR_WORKER_POINTS / 86400)
+QUOTA_EXHAUSTED_MESSAGE = "Spoonacular API Daily Limit Reached or Plan Expired."
+
+class QuotaExhausted(Exception):
+    """The Spoonacular quota is spent (by the budget or a 402) and nothing cached can be served instead."""
+
+# Search params (minus the API key) -> recipes seen for that search, accumulated across calls
+recipe_cache = cache_from_env('meal_recipes', prefix='RECIPE_CACHE', ttl_seconds=24 * 3600)
+# Meal type -> recipes of that type from any search, served when the quota is gone and the exact search is not cached
+degraded_recipe_cache = cache_from_env('meal_recipes_by_type', prefix='RECIPE_CACHE', ttl_seconds=24 * 3600)
+RECIPES_PER_KEY = int(os.environ.get('RECIPE_CACHE_RESULTS_PER_KEY', 25))
+RECIPES_PER_TYPE = int(os.environ.get('RECIPE_CACHE_RESULTS_PER_TYPE', 100))
+# Once a search has this many distinct cached recipes it is served without spending quota
+RECIPE_CACHE_MIN_VARIETY = int(os.environ.get('RECIPE_CACHE_MIN_VARIETY', 15))
+# Searches that came back empty, so the same uncommon keyword doesn't spend quota again until they expire
+empty_search_cache = cache_from_env('meal_empty_searches', prefix='RECIPE_CACHE', ttl_seconds=24 * 3600)
+
+RECIPE_FIELDS = ("id", "title", "image", "sourceUrl", "summary", "instructions")
+
+def compact_recipe(recipe):
+    """Keeps only the recipe fields the agent returns."""
+    return {field: recipe.get(field) for field in RECIPE_FIELDS}
+
+def merge_recipes(existing, new, limit):
+    """Adds new recipes to existing ones (newest first), dropping duplicates by ID."""
+    merged = {}
+    for recipe in list(new) + list(existing):
+        merged.setdefault(recipe.get("id") or recipe.get("title"), recipe)
+    return list(merged.values())[:limit]
+
+def next_quota_reset():
+    """Spoonacular quotas reset at midnight UTC."""
+    now = datetime.now(timezone.utc)
+    return (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+def begin_recipe_search(params, reserve_points=0.0, degraded=True):
     """
-    Recommends a meal based on the user's mood and time of day using Spoonacular and Gemini.
+    Cache and budget half of a recipe search, shared by the sync and async paths.
+    Returns (search_state, recipes): recipes is a list to serve without calling Spoonacular
+    (enough cached variety, a known empty search, budget spent, or the call would dip into
+    reserve_points), or None if the API should be called. With degraded=False a spent budget
+    serves only this search's own cached recipes, never other searches' recipes of the same type.
+    Raises QuotaExhausted if the budget is spent and nothing is cached.
     """
-    logger.info(f"Entering get_meal_recommendation for mood: '{mood}', context: '{meal_context}'")
-
-    # --- NEW: Dynamic Gemini Prompt and Spoonacular Type based on meal_context ---
-    prompt_meal_type_description = ""
-    spoonacular_meal_type_filter = ""
-    # Standardize the variable name and tailor constraints per context
-    gemini_negative_constraints = (
-        """
-        **CRITICAL: ABSOLUTELY DO NOT SUGGEST ANY DESSERTS OR SWEET-ONLY SNACKS.**
-        Avoid cake, cookies, pies, muffins, ice cream, sweet pastries, or drinks.
-        """
-    )
-    
-    # Adjust prompt wording and Spoonacular filter based on context
-    if meal_context == "breakfast":
-        prompt_meal_type_description = "a delicious **breakfast or brunch** meal"
-        spoonacular_meal_type_filter = "breakfast"
-        gemini_negative_constraints = """
-        **CRITICAL: ABSOLUTELY DO NOT SUGGEST ANY LUNCH OR DINNER ITEMS.** This includes pasta, pizza, steak, chicken stir-fry, curries, stews, casseroles, sandwiches, or anything typically eaten for lunch or dinner. Focus strictly on breakfast/brunch categories like eggs, pancakes, waffles, oatmeal, breakfast burritos, breakfast meats.
-        """
-    elif meal_context == "lunch":
-        prompt_meal_type_description = "a satisfying **lunch** meal"
-        # Spoonacular does not support a 'lunch' type; use 'main course' to represent lunch-like meals
-        spoonacular_meal_type_filter = "main course"
-        gemini_negative_constraints = """
-        **CRITICAL: ABSOLUTELY DO NOT SUGGEST ANY DESSERT, SWEET SNACK, BREAKFAST, OR HEAVY DINNER ITEMS.** This includes cake, cookies, pies, muffins, pancakes, eggs benedict, roasts, or heavy stews. Focus on lighter, savory lunch options.
-        """
-    elif meal_context == "dinner":
-        prompt_meal_type_description = "a hearty **dinner** meal"
-        spoonacular_meal_type_filter = "main course" # 'main course' is good for dinner
-        gemini_negative_constraints = """
-        **CRITICAL: ABSOLUTELY DO NOT SUGGEST ANY DESSERT, SWEET SNACK, BREAKFAST, OR LIGHT LUNCH ITEMS.** This includes muffins, cakes, pies, pancakes, eggs, salads as a main meal, or light sandwiches. Focus strictly on savory, substantial dinner dishes.
-        """
-    else: # Default or 'general' context
-        prompt_meal_type_description = "a satisfying **meal (breakfast, lunch, or dinner)**"
-        # Do not constrain by type in general mode; allow broader search
-        spoonacular_meal_type_filter = ""
-        gemini_negative_constraints = """
-        **CRITICAL: ABSOLUTELY DO NOT SUGGEST ANY DESSERTS OR SWEET SNACKS.** This includes muffins, cakes, cookies, pies, tarts, ice cream, or anything sweet-focused.
-        """
-    gemini_prompt = f"""
-The user is feeling: "{mood}".
-{gemini_negative_constraints}
-Your task is to suggest 3-5 distinct food-related keywords that would perfectly match this mood for {prompt_meal_type_description}.
-
-**STRICTLY AVOID** suggesting any:
-- Desserts (e.g., cake, cookie, pie, ice cream, tart, sweet pastries)
-- Sweet-only snacks (e.g., fruit by itself, nuts, plain yogurt, smoothies if primarily sweet)
-- Drinks (e.g., coffee, tea, juice)
-
-Keywords can include:
-- Cuisine types (e.g., "Italian", "Mexican", "Thai", "Mediterranean")
-- Meal categories specific to the context (e.g., "omelette", "pancakes", "sandwich", "soup", "stir-fry", "roast", "casserole", "curry", "burrito", "toast", "pasta", "pizza", "waffles")
-- Main protein/vegetable (e.g., "chicken", "beef", "fish", "pork", "lentil", "tofu", "vegetable medley")
-- Preparation styles (e.g., "grilled", "baked", "braised", "quick", "easy")
-
-Examples of keywords for different moods and meal types:
-- If mood is "cozy" and meal type is "breakfast", keywords: "warm oatmeal", "breakfast casserole", "fluffy pancakes".
-- If mood is "energetic" and meal type is "lunch", keywords: "grilled chicken salad", "lean protein bowl", "fresh wrap".
-- If mood is "romantic" and meal type is "dinner", keywords: "elegant steak", "seafood pasta", "wine pairing meal".
-- If mood is "happy" and meal type is "breakfast", keywords: "pancakes with berries", "breakfast burrito", "omelette".
-- If mood is "happy" and meal type is "dinner", keywords: "celebratory feast", "pizza night", "BBQ ribs".
-- If mood is "tired" and meal type is "any", keywords: "easy one-pan meal", "quick pasta", "simple chicken", "soup and sandwich".
-
-Return the keywords as a comma-separated list.
-"""
-    logger.info(f"Gemini prompt constructed for mood '{mood}', context '{meal_context}'.")
+    cache_key = make_key(*(f"{k}={v}" for k, v in sorted(params.items()) if k != "apiKey"))
+    type_key = make_key("type", params.get("type") or "any")
+    cached = recipe_cache.get(cache_key) or []
+    search_state = (cache_key, type_key, cached)
+
+    if len(cached) >= RECIPE_CACHE_MIN_VARIETY:
+        logger.info(f"Recipe cache hit ({len(cached)} recipes) for query '{params.get('query')}'")
+        return search_state, cached
+
+    if not cached and empty_search_cache.get(cache_key):
+        logger.info(f"Skipping search for query '{params.get('query')}': it recently returned no recipes.")
+        return search_state, []
+
+    if reserve_points and spoonacular_budget.available() < SPOONACULAR_POINTS_PER_SEARCH + reserve_points:
+        logger.info(f"Skipping speculative search for query '{params.get('query')}' to keep {reserve_points} quota points in reserve.")
+        return search_state, cached
+
+    if not spoonacular_budget.try_acquire(SPOONACULAR_POINTS_PER_SEARCH):
+        if not degraded:
+            logger.warning(f"Spoonacular budget exhausted. Not searching query '{params.get('query')}'.")
+            return search_state, cached
+        cached_recipes = degraded_recipes(search_state)
+        if cached_recipes:
+            count_fallback('cached_recipes')
+            logger.warning(f"Spoonacular budget exhausted. Serving {len(cached_recipes)} cached recipes for query '{params.get('query')}'.")
+            return search_state, cached_recipes
+        logger.warning(f"Spoonacular budget exhausted and nothing cached for query '{params.get('query')}'.")
+        raise QuotaExhausted(QUOTA_EXHAUSTED_MESSAGE)
+
+    return search_state, None
+
+def sync_quota_from_headers(headers):
+    """Re-syncs the budget with the remaining quota Spoonacular reports on every response."""
+    quota_left = headers.get("X-API-Quota-Left")
+    if quota_left is not None:
+        try:
+            spoonacular_budget.set_available(float(quota_left) / worker_processes())
+        except ValueError:
+            pass
+
+def degraded_recipes(search_state, degraded=True):
+    """Cached recipes for the exact search, else (if degraded) for its meal type."""
+    _, type_key, cached = search_state
+    return cached or (degraded and degraded_recipe_cache.get(type_key)) or []
+
+def recipes_after_quota_error(search_state, query, degraded=True):
+    """Handles a 402: freezes the budget until the daily reset and returns any cached recipes."""
+    spoonacular_budget.exhaust_until(next_quota_reset())
+    cached_recipes = degraded_recipes(search_state, degraded)
+    if cached_recipes:
+        count_fallback('cached_recipes')
+        logger.warning(f"Spoonacular quota reached (402). Serving {len(cached_recipes)} cached recipes for query '{query}'.")
+    return cached_recipes
+
+def recipes_after_unavailable(search_state, query, e, degraded=True):
+    """Handles a timeout or an open circuit: returns any cached recipes rather than failing the request."""
+    cached_recipes = degraded_recipes(search_state, degraded)
+    if cached_recipes:
+        count_fallback('cached_recipes')
+        logger.warning(f"Spoonacular unavailable ({e}). Serving {len(cached_recipes)} cached recipes for query '{query}'.")
+    return cached_recipes
+
+def finish_recipe_search(search_state, results):
+    """Merges fresh search results into the recipe caches and returns the recipes to pick from."""
+    cache_key, type_key, cached = search_state
+    results = [compact_recipe(r) for r in results]
+    if not results:
+        if not cached:
+            empty_search_cache.set(cache_key, True)
+        return cached
+    merged = merge_recipes(cached, results, RECIPES_PER_KEY)
+    recipe_cache.set(cache_key, merged)
+    degraded_recipe_cache.set(type_key, merge_recipes(degraded_recipe_cache.get(type_key) or [], results, RECIPES_PER_TYPE))
+    return merged
+
+def upstream_status(error):
+    """HTTP status carried by a requests or httpx error, if any."""
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+def search_recipes(params, deadline, endpoint="complexSearch", reserve_points=0.0, degraded=True):
+    """
+    Runs a Spoonacular complexSearch through the recipe cache and quota budget.
+    Serves cached recipes when there is already enough variety, when the budget is spent, when
+    Spoonacular answers 402, times out or has its circuit open; otherwise calls the API (within
+    the request deadline) and merges the results into the cache. degraded=False keeps recipes
+    cached for other searches of the same meal type out of the answer.
+    """
+    search_state, recipes = begin_recipe_search(params, reserve_points, degraded)
+    if recipes is not None:
+        return recipes
 
-    inferred_keywords = ""
     try:
-        gemini_response = model.generate_content(gemini_prompt)
-        if gemini_response.candidates and gemini_response.candidates[0].content.parts:
-            inferred_keywords = gemini_response.candidates[0].content.parts[0].text.strip()
-            logger.info(f"Gemini inferred meal keywords for '{mood}' ({meal_context}): {inferred_keywords}")
-        else:
-            logger.warning(f"Gemini returned no content for mood '{mood}' ({meal_context}). Response: {gemini_response}")
+        response = spoonacular_client.get(SPOONACULAR_URL, params=params, endpoint=endpoint, deadline=deadline)
+        sync_quota_from_headers(response.headers)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        if upstream_status(e) == 402:
+            cached_recipes = recipes_after_quota_error(search_state, params.get("query"), degraded)
+            if cached_recipes:
+                return cached_recipes
+        elif isinstance(e, (requests.exceptions.Timeout, CircuitOpen)):
+            cached_recipes = recipes_after_unavailable(search_state, params.get("query"), e, degraded)
+            if cached_recipes:
+                return cached_recipes
+        raise
 
-        meal_keywords = [k.strip() for k in inferred_keywords.split(',') if k.strip()]
-        logger.info(f"Processed meal_keywords: {meal_keywords}")
-        
-        if not meal_keywords:
-            logger.warning("Gemini inferred no keywords. Falling back to default 'comfort food'.")
-            meal_keywords = ["comfort food"]
+    return finish_recipe_search(search_state, response.json().get("results", []))
 
+# --- Inference Cache ---
+# Mood + meal context -> Gemini keyword list. Most traffic repeats a small set of moods.
+keyword_cache = cache_from_env('meal_keywords')
+
+# --- Keyword Parsing ---
+def meal_context_settings(meal_context: str):
+    """(prompt wording, Spoonacular type filter, rule) for a meal context; unknown contexts are 'general'."""
+    return MEAL_CONTEXTS.get(meal_context, MEAL_CONTEXTS["general"])
+
+def build_meal_prompt(mood: str, meal_context: str):
+    """
+    The Gemini keyword prompt for the mood and the Spoonacular type filter for the meal
+    context. Returns (gemini_prompt, spoonacular_meal_type_filter).
+    """
+    template = MEAL_PROMPTS.get(meal_context, MEAL_PROMPTS["general"])
+    return template.render(mood=mood), meal_context_settings(meal_context)[1]
+
+def parse_meal_keywords(gemini_response, mood: str, meal_context: str, prompt_name: str):
+    """Extracts the keyword list from a Gemini response; an empty list if it has none usable."""
+    meal_keywords = parse_string_list(prompt_name, gemini_response, MEAL_KEYWORDS_MAX)
+    if meal_keywords:
+        logger.info(f"Gemini inferred meal keywords for '{mood}' ({meal_context}): {meal_keywords}")
+    else:
+        logger.warning("Gemini inferred no keywords. Falling back to default 'comfort food'.")
+    return meal_keywords
+
+def infer_meal_keywords(mood: str, meal_context: str, gemini_prompt: str, deadline):
+    """
+    Asks Gemini for meal keywords, waiting at most GEMINI_TIMEOUT_SECONDS of the deadline.
+    Returns an empty list if Gemini fails, is too slow or returns nothing, so callers can fall
+    back without caching the fallback. Raises Overloaded if Gemini is saturated.
+    """
+    try:
+        with span('gemini_inference'):
+            gemini_response = call_with_deadline(
+                gemini_executor, deadline.within(GEMINI_TIMEOUT_SECONDS), 'gemini_inference',
+                gemini_prompt.generate, breaker=gemini_breaker, limiter=gemini_limiter,
+            )
+        with span('parse'):
+            return parse_meal_keywords(gemini_response, mood, meal_context, gemini_prompt.name)
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error using Gemini for meal inference: {e}. Falling back to default 'comfort food'.")
-        meal_keywords = ["comfort food"]
-
-    # Step 2: Search Spoonacular using inferred keywords
-    spoonacular_url = "https://api.spoonacular.com/recipes/complexSearch"
-    
+        return []
+
+# --- Spoonacular Search Parameters and Result Formatting ---
+# complexSearch can't select fields, and without addRecipeInformation it returns only id, title
+# and image. It is kept (+0.025 points per result, see SPOONACULAR_POINTS_PER_SEARCH) because
+# it is the only way to get sourceUrl, summary and instructions without a second call per recipe;
+# results are cut down to RECIPE_FIELDS as soon as they arrive.
+def build_search_params(meal_keywords, spoonacular_meal_type_filter):
+    """complexSearch parameters for the first inferred keyword."""
     params = {
         "apiKey": SPOONACULAR_API_KEY,
         "query": meal_keywords[0] if meal_keywords else "food",
@@ -159,64 +414,300 @@ Return the keywords as a comma-separated list.
     # Only include 'type' if we have a valid Spoonacular type
     if spoonacular_meal_type_filter:
         params["type"] = spoonacular_meal_type_filter
-    logger.info(f"Spoonacular API call parameters: {params}")
+    return params
+
+def build_fallback_params():
+    """complexSearch parameters for the 'popular food' fallback."""
+    return {
+        "apiKey": SPOONACULAR_API_KEY,
+        "query": "popular food",
+        "number": 5,
+        "addRecipeInformation": True,
+        "instructionsRequired": True,
+        "sort": "random"
+    }
+
+def format_meal(selected_meal):
+    """Maps a recipe onto the /recommend_meal response fields."""
+    meal_title = selected_meal.get("title")
+    meal_image_url = selected_meal.get("image")
+    meal_source_url = selected_meal.get("sourceUrl")
 
+    meal_description = selected_meal.get("summary") or selected_meal.get("instructions", "No detailed instructions available, please visit the source URL.")
+
+    logger.info(f"Selected Meal: {meal_title}, Image: {meal_image_url}")
+    return {
+        "mealTitle": meal_title,
+        "mealImageUrl": meal_image_url,
+        "mealDescription": meal_description,
+        "mealSourceUrl": meal_source_url
+    }
+
+
+# --- Speculative Keyword Search ---
+# Gemini suggests several keywords. Instead of searching only the first one and falling back to
+# "popular food" when it is empty, the first SPECULATIVE_SEARCH_MAX_KEYWORDS are searched at once:
+# "first" serves the first search with results, "merge" waits for all of them and mixes the
+# results, "off" searches the first keyword only. Searches beyond the first keyword are
+# speculative and skipped when fewer than SPECULATIVE_SEARCH_RESERVE_POINTS quota points are left.
+SPECULATIVE_SEARCH_MODE = os.environ.get('SPECULATIVE_SEARCH_MODE', 'first').lower()
+SPECULATIVE_SEARCH_MAX_KEYWORDS = int(os.environ.get('SPECULATIVE_SEARCH_MAX_KEYWORDS', 3))
+SPECULATIVE_SEARCH_RESERVE_POINTS = float(os.environ.get('SPECULATIVE_SEARCH_RESERVE_POINTS', SPOONACULAR_DAILY_POINTS / 3)) / worker_processes()
+search_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('SPOONACULAR_SEARCH_WORKERS', 16)),
+    thread_name_prefix="search"
+)
+SEARCH_OUTCOMES = registry.counter(
+    "moodfusion_meal_keyword_search_total",
+    "Which search a meal was served from: the keyword position that answered first, 'merged', or 'none'.", ["served"])
+
+def search_keywords_plan(meal_keywords):
+    """The keywords to search concurrently, with the quota reserve for each (0 for the first keyword)."""
+    count = 1 if SPECULATIVE_SEARCH_MODE == 'off' else max(1, SPECULATIVE_SEARCH_MAX_KEYWORDS)
+    keywords = list(dict.fromkeys(meal_keywords))[:count] or ["food"]
+    return [(keyword, 0.0 if position == 0 else SPECULATIVE_SEARCH_RESERVE_POINTS) for position, keyword in enumerate(keywords)]
+
+def search_keywords(meal_keywords, spoonacular_meal_type_filter, deadline, degraded=True):
+    """
+    Searches Spoonacular for the inferred keywords concurrently (see SPECULATIVE_SEARCH_MODE).
+    Returns the recipes to pick from, or an empty list if every search came back empty.
+    Raises the first error if every search failed. Searches still running when the answer
+    is known finish in the background and only fill the recipe cache. degraded is passed
+    on to search_recipes.
+    """
+    plan = search_keywords_plan(meal_keywords)
+    futures = {
+        search_executor.submit(search_recipes, build_search_params([keyword], spoonacular_meal_type_filter), deadline, "complexSearch", reserve, degraded): position
+        for position, (keyword, reserve) in enumerate(plan)
+    }
+    merged, errors = [], []
     try:
-        response = requests.get(spoonacular_url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        recipes = data.get("results", [])
+        for future in as_completed(futures, timeout=deadline.remaining()):
+            try:
+                recipes = future.result()
+            except (requests.exceptions.RequestException, Overloaded, QuotaExhausted) as e:
+                errors.append(e)
+                continue
+            if recipes and SPECULATIVE_SEARCH_MODE != 'merge':
+                SEARCH_OUTCOMES.inc(served=futures[future])
+                logger.info(f"Serving recipes for keyword '{plan[futures[future]][0]}' (searched {[k for k, _ in plan]}).")
+                return recipes
+            merged = merge_recipes(merged, recipes, RECIPES_PER_KEY)
+    except FutureTimeout:
+        logger.error(f"Request deadline reached while searching recipes for keywords: {[k for k, _ in plan]}")
+    finally:
+        for future in futures:
+            future.cancel()  # Searches not started yet; running ones can't be interrupted
+
+    SEARCH_OUTCOMES.inc(served='merged' if merged else 'none')
+    if not merged and errors and len(errors) == len(futures):
+        raise errors[0]
+    return merged
+
+# --- Meal Recommendation Logic (Core of the Agent) ---
+def resolve_meal_keywords(mood: str, meal_context: str, gemini_prompt: str, deadline):
+    """Meal keywords for the mood from the inference cache, or from Gemini on a miss."""
+    cache_key = make_key(mood, meal_context)
+    meal_keywords = keyword_cache.get(cache_key)
+    if meal_keywords:
+        logger.info(f"Inference cache hit for mood '{mood}' ({meal_context}): {meal_keywords}")
+        count_inference_source('cache')
+        return meal_keywords
+
+    meal_keywords = keywords_from_mood_index(mood, meal_context)
+    if meal_keywords:
+        count_inference_source('mood_index')
+        return meal_keywords
+
+    meal_keywords = infer_meal_keywords(mood, meal_context, gemini_prompt, deadline)
+    count_inference_source('gemini')
+    if meal_keywords:
+        keyword_cache.set(cache_key, meal_keywords)
+        return meal_keywords
+    count_fallback('comfort_food')
+    return ["comfort food"]
+
+def find_recipes(meal_keywords, spoonacular_meal_type_filter, deadline, fallback=True, degraded=True):
+    """
+    Searches Spoonacular for the keywords (falling back to popular food) and returns the
+    recipes to pick from. Raises if nothing could be found, DeadlineExceeded if the deadline
+    ran out first. fallback=False raises instead of searching popular food, and degraded=False
+    never serves recipes cached for other searches; the precompute job uses both so that only
+    the mood's own recipes end up in the snapshot.
+    """
+    try:
+        recipes = search_keywords(meal_keywords, spoonacular_meal_type_filter, deadline, degraded)
         logger.info(f"Spoonacular returned {len(recipes)} recipes for keywords: {meal_keywords}, type: {spoonacular_meal_type_filter}")
 
+        if not recipes and not fallback:
+            raise ValueError(f"No recipes found for keywords: {meal_keywords}, type: {spoonacular_meal_type_filter}.")
         if not recipes:
             logger.warning(f"No recipes found for keywords: {meal_keywords}, type: {spoonacular_meal_type_filter}. Trying popular food fallback.")
-            params_fallback = {
-                "apiKey": SPOONACULAR_API_KEY,
-                "query": "popular food",
-                "number": 5,
-                "addRecipeInformation": True,
-                "instructionsRequired": True,
-                "sort": "random"
-            }
-            response_fallback = requests.get(spoonacular_url, params=params_fallback)
-            response_fallback.raise_for_status()
-            data_fallback = response_fallback.json()
-            recipes = data_fallback.get("results", [])
-            
+            deadline.check('popular_fallback')
+            count_fallback('popular_food')
+            recipes = search_recipes(build_fallback_params(), deadline, endpoint="complexSearch_popular")
+
             if not recipes:
                 raise ValueError("Could not find any recipes with fallback.")
 
+        return recipes
+
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error calling Spoonacular API: {e}")
+        if upstream_status(e) == 402:
+            raise QuotaExhausted(QUOTA_EXHAUSTED_MESSAGE) from e
+        if deadline.expired():
+            raise DeadlineExceeded("Request deadline exceeded during the recipe search.") from e
+        raise
+
+# Coalesces identical in-flight requests so a burst of the same mood costs one Gemini call and one search
+recipe_flight = SingleFlight('meal_recipes')
+
+def get_meal_recommendation(mood: str, meal_context: str, deadline=None): # MODIFIED: Accepts meal_context
+    """
+    Recommends a meal based on the user's mood and time of day using Spoonacular and Gemini.
+    Every stage works within deadline (REQUEST_DEADLINE_SECONDS by default).
+    """
+    deadline = deadline or Deadline(REQUEST_DEADLINE_SECONDS)
+    logger.info(f"Entering get_meal_recommendation for mood: '{mood}', context: '{meal_context}'")
+
+    snapshot_meals = meals_from_snapshot(mood, meal_context)
+    if snapshot_meals:
+        return random.choice(snapshot_meals)
+
+    gemini_prompt, spoonacular_meal_type_filter = build_meal_prompt(mood, meal_context)
+    logger.info(f"Gemini prompt constructed for mood '{mood}', context '{meal_context}'.")
+
+    try:
+        # Step 1: Infer keywords, Step 2: Search Spoonacular using inferred keywords.
+        # Concurrent requests for the same mood and context share both steps.
+        recipes = recipe_flight.do(
+            make_key(mood, meal_context),
+            lambda: find_recipes(resolve_meal_keywords(mood, meal_context, gemini_prompt, deadline), spoonacular_meal_type_filter, deadline)
+        )
+
         # Step 3: Pick a meal and get details
         selected_meal = random.choice(recipes) if recipes else None
 
         if not selected_meal:
             raise ValueError("No meal could be selected after Spoonacular search.")
 
-        meal_title = selected_meal.get("title")
-        meal_image_url = selected_meal.get("image")
-        meal_source_url = selected_meal.get("sourceUrl")
+        return format_meal(selected_meal)
 
-        meal_description = selected_meal.get("summary") or selected_meal.get("instructions", "No detailed instructions available, please visit the source URL.")
+    except Exception as e:
+        logger.error(f"An unexpected error occurred in get_meal_recommendation: {e}")
+        raise
 
-        logger.info(f"Selected Meal: {meal_title}, Image: {meal_image_url}")
-        return {
-            "mealTitle": meal_title,
-            "mealImageUrl": meal_image_url,
-            "mealDescription": meal_description,
-            "mealSourceUrl": meal_source_url
-        }
+# --- Batch Recommendations ---
+# Bulk callers send many moods at once. Distinct (mood, mealContext) pairs are resolved with
+# one Gemini prompt per BATCH_INFERENCE_CHUNK pairs, and one recipe search runs per pair.
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error calling Spoonacular API: {e}")
-        status_code = getattr(getattr(e, "response", None), "status_code", None)
-        if status_code == 402:
-            raise Exception("Spoonacular API Daily Limit Reached or Plan Expired.")
+def build_batch_meal_prompt(numbered_requests):
+    """
+    Builds one Gemini prompt covering several (mood, meal_context) pairs.
+    numbered_requests maps a request number to its (mood, meal_context).
+    """
+    request_lines = [
+        f'{number}. The user is feeling: "{mood}". Meal: {meal_context if meal_context in MEAL_CONTEXTS else "general"}.'
+        for number, (mood, meal_context) in numbered_requests.items()
+    ]
+    return MEAL_BATCH_PROMPT.render(
+        requests="\n".join(request_lines), response_schema=numbered_lists_schema(list(numbered_requests), MEAL_KEYWORDS_SCHEMA),
+    )
+
+def infer_meal_keywords_batch(pairs, deadline):
+    """
+    Asks Gemini for keywords for several (mood, meal_context) pairs in one call.
+    Returns {pair: keywords}; pairs Gemini did not answer (in time) are left out.
+    """
+    numbered_requests = {str(number): pair for number, pair in enumerate(pairs, start=1)}
+    try:
+        with span('gemini_inference_batch'):
+            gemini_response = call_with_deadline(
+                gemini_executor, deadline, 'gemini_inference_batch',
+                build_batch_meal_prompt(numbered_requests).generate, breaker=gemini_breaker, limiter=gemini_limiter,
+            )
+    except Overloaded:
         raise
     except Exception as e:
-        logger.error(f"An unexpected error occurred in get_meal_recommendation: {e}")
-        raise
+        logger.error(f"Error using Gemini for batch meal inference: {e}")
+        return {}
+    with span('parse'):
+        keywords_by_number = parse_numbered_lists(MEAL_BATCH_PROMPT.name, gemini_response, numbered_requests, MEAL_KEYWORDS_MAX)
+    return {pair: keywords_by_number[number] for number, pair in numbered_requests.items() if keywords_by_number.get(number)}
 
-# --- Flask Route ---
+def resolve_meal_keywords_batch(pairs, deadline, fallback=True):
+    """
+    Meal keywords for each distinct pair: inference cache first, then batched Gemini calls.
+    Pairs nothing was found for get 'comfort food', or are left out if fallback is False.
+    """
+    keywords_by_pair = {}
+    uncached = []
+    for pair in pairs:
+        meal_keywords = keyword_cache.get(make_key(*pair))
+        if meal_keywords:
+            count_inference_source('cache')
+        else:
+            meal_keywords = keywords_from_mood_index(*pair)
+            if meal_keywords:
+                count_inference_source('mood_index')
+        if meal_keywords:
+            keywords_by_pair[pair] = meal_keywords
+        else:
+            uncached.append(pair)
+
+    chunks = chunked(uncached, BATCH_INFERENCE_CHUNK)
+    for inferred in batch_executor.map(lambda chunk: infer_meal_keywords_batch(chunk, deadline), chunks):
+        for pair, meal_keywords in inferred.items():
+            keyword_cache.set(make_key(*pair), meal_keywords)
+            keywords_by_pair[pair] = meal_keywords
+
+    logger.info(f"Batch keywords: {len(pairs) - len(uncached)} cached or matched locally, {len(uncached)} inferred in {len(chunks)} Gemini call(s).")
+    for pair in uncached:
+        count_inference_source('gemini')
+        if pair not in keywords_by_pair and fallback:
+            count_fallback('comfort_food')
+    if not fallback:
+        return keywords_by_pair, len(chunks)
+    return {pair: keywords_by_pair.get(pair) or ["comfort food"] for pair in pairs}, len(chunks)
+
+def get_meal_recommendations_batch(items):
+    """
+    Recommends a meal for every {"mood", "mealContext"} item. Identical items share one
+    inference and one recipe search but each gets its own random pick. Failures are
+    reported per item. The whole batch works within BATCH_DEADLINE_SECONDS.
+    """
+    deadline = Deadline(BATCH_DEADLINE_SECONDS)
+    results = [{"mood": item.get("mood"), "mealContext": item.get("mealContext") or "general"} for item in items]
+    errors = item_errors(items)
+    pairs = list(dict.fromkeys(
+        (normalize_mood(result["mood"]), result["mealContext"]) for i, result in enumerate(results) if i not in errors
+    ))
+    snapshot_meals = {pair: meals_from_snapshot(*pair) for pair in pairs}
+    snapshot_meals = {pair: meals for pair, meals in snapshot_meals.items() if meals}
+    keywords_by_pair, gemini_calls = resolve_meal_keywords_batch([pair for pair in pairs if pair not in snapshot_meals], deadline)
+
+    def search(pair):
+        return recipe_flight.do(make_key(*pair), lambda: find_recipes(keywords_by_pair[pair], meal_context_settings(pair[1])[1], deadline))
+
+    searches = {pair: batch_executor.submit(search, pair) for pair in keywords_by_pair}
+    for i, result in enumerate(results):
+        if i in errors:
+            result["error"] = errors[i]
+            continue
+        pair = (normalize_mood(result["mood"]), result["mealContext"])
+        if pair in snapshot_meals:
+            result["meal"] = random.choice(snapshot_meals[pair])
+            continue
+        try:
+            result["meal"] = format_meal(random.choice(searches[pair].result()))
+        except Exception as e:
+            result["error"] = str(e)
+
+    return {"results": results, "distinctRequests": len(pairs), "geminiCalls": gemini_calls}
+
+# --- Flask Routes ---
 @app.route('/recommend_meal', methods=['POST'])
 def recommend_meal():
     """
@@ -233,13 +724,70 @@ def recommend_meal():
             return jsonify({"error": "Missing 'mood' in request body"}), 400
 
         logger.info(f"Received request for mood: {mood}, mealContext: {meal_context} in meal agent")
-        meal_recommendation = get_meal_recommendation(mood, meal_context)
-        return jsonify(meal_recommendation), 200
-
+        deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER), REQUEST_DEADLINE_SECONDS)
+        meal_recommendation = get_meal_recommendation(mood, meal_context, deadline)
+        with span('serialize'):
+            return jsonify(meal_recommendation), 200
+
+    except DeadlineExceeded as e:
+        logger.warning(f"Deadline exceeded in recommend_meal endpoint: {e}")
+        return jsonify({"error": str(e)}), 504
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_meal request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
     except Exception as e:
         logger.error(f"Unhandled error in recommend_meal endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/recommend_meal_batch', methods=['POST'])
+def recommend_meal_batch():
+    """
+    Batch HTTP endpoint for the Meal Agent.
+    Expects {"items": [...]} where each item is a mood string or an object with 'mood' and
+    optionally 'mealContext'; a top-level 'mealContext' is the default for every item.
+    Returns one result per item, in order, each with either 'meal' or 'error'.
+    """
+    try:
+        data = request.get_json() or {}
+        items = read_batch_items(data, defaults={"mealContext": data.get('mealContext', 'general')})
+        logger.info(f"Received batch request with {len(items)} items in meal agent")
+        batch_results = get_meal_recommendations_batch(items)
+        with span('serialize'):
+            return jsonify(batch_results), 200
+
+    except BatchRequestError as e:
+        logger.warning(f"Rejected batch request in meal agent: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_meal_batch request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        logger.error(f"Unhandled error in recommend_meal_batch endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def cache_report():
+    """Inference cache, recipe cache, Spoonacular budget and mood index counters."""
+    return {
+        "inferenceCache": keyword_cache.stats(),
+        "prompts": [template.stats() for template in (*MEAL_PROMPTS.values(), MEAL_BATCH_PROMPT)],
+        "recipeCache": recipe_cache.stats(),
+        "degradedRecipeCache": degraded_recipe_cache.stats(),
+        "emptySearchCache": empty_search_cache.stats(),
+        "spoonacularBudget": spoonacular_budget.stats(),
+        "coalescing": recipe_flight.stats(),
+        "moodIndex": mood_index.stats() if mood_index else None,
+        "snapshot": recommendation_snapshot.stats() if recommendation_snapshot else None,
+        "circuits": circuit_report(),
+        "admission": admission_report(),
+        "hedging": spoonacular_client.stats()
+    }
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Reports inference cache, recipe cache and Spoonacular budget counters."""
+    return jsonify(cache_report()), 200
+
 # --- Entry Point for Cloud Run ---
+# Local development only; the images serve the app through agent_common.runtime (gunicorn)
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -0,0 +1,93 @@
+"""
+Offline precompute job for the meal agent's recommendation snapshot.
+
+For every mood in the vocabulary and every meal context, runs the agent's own keyword
+inference (inference cache, mood index, then batched Gemini calls) and recipe searches,
+and writes the formatted meals to a snapshot file. Point the agent's
+RECOMMENDATION_SNAPSHOT_PATH at it and covered moods are served without network calls.
+
+Progress is checkpointed after every mood, so a run stopped by the Spoonacular quota or
+interrupted resumes where it left off when started again. Recipe searches use the 'merge'
+speculative mode (every inferred keyword is searched) unless SPECULATIVE_SEARCH_MODE is set,
+for more meals per mood.
+
+Examples:
+    python precompute.py --out /data/meal_snapshot.bin
+    python precompute.py --moods moods.txt --contexts breakfast,dinner --out /data/meal_snapshot.bin --workers 2
+
+Uses the same configuration (secrets, SPOONACULAR_*, GEMINI_*, ...) as the agent itself.
+Exits with status 2 if some moods are still missing; run it again to resume.
+"""
+import logging
+import os
+import sys
+from concurrent.futures import as_completed
+
+from agent_common.cache import make_key, normalize_mood
+from agent_common.resilience import Deadline
+from agent_common.snapshot import load_vocabulary, precompute_arguments, run_snapshot_job
+
+logger = logging.getLogger("precompute")
+
+DEFAULT_MOODS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mood_index_seed.json')
+
+
+def main():
+    parser = precompute_arguments(__doc__, DEFAULT_MOODS)
+    parser.add_argument("--contexts", default="breakfast,lunch,dinner,general", help="Comma-separated meal contexts to precompute for every mood.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not args.verbose:
+        for noisy in ("main", "agent_common.upstream"):
+            logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    os.environ.setdefault('SPECULATIVE_SEARCH_MODE', 'merge')
+    import main as agent  # Starts the agent's startup steps (secrets, Vertex AI, mood index)
+    agent.startup.wait()
+
+    contexts = [context.strip() for context in args.contexts.split(",") if context.strip()]
+    pairs = {
+        make_key(mood, context): (normalize_mood(mood), context)
+        for mood in load_vocabulary(args.moods)
+        for context in contexts
+    }
+
+    def quota_spent():
+        return agent.spoonacular_budget.available() < agent.SPOONACULAR_POINTS_PER_SEARCH
+
+    def compute_chunk(keys):
+        deadline = Deadline(args.deadline_seconds)
+        keywords_by_pair, _ = agent.resolve_meal_keywords_batch([pairs[key] for key in keys], deadline, fallback=False)
+
+        def search(pair):
+            if quota_spent():
+                return None  # Left for the next run rather than searched over budget
+            spoonacular_meal_type_filter = agent.meal_context_settings(pair[1])[1]
+            # No popular-food or cached-by-type recipes: a pair without its own results is retried next run
+            return agent.find_recipes(keywords_by_pair[pair], spoonacular_meal_type_filter, deadline, fallback=False, degraded=False)
+
+        searches = {agent.batch_executor.submit(search, pair): pair for pair in keywords_by_pair}
+        entries = {}
+        for future in as_completed(searches):
+            pair = searches[future]
+            try:
+                recipes = future.result()
+            except Exception as e:
+                logger.warning(f"Recipe search failed for {pair}: {e}")
+                continue
+            if recipes:
+                entries[make_key(*pair)] = {
+                    "keywords": keywords_by_pair[pair],
+                    "meals": [agent.format_meal(recipe) for recipe in recipes],
+                }
+        return entries
+
+    return run_snapshot_job(
+        args, 'meal_recommendations', list(pairs), compute_chunk, should_stop=quota_spent,
+        metadata={"agent": "meal-agent", "contexts": contexts},
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
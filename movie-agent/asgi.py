@@ -0,0 +1,280 @@
+"""
+Async (ASGI) serving mode for the Movie Agent.
+
+Serves the same /recommend_movie contract as main.py, but the Gemini call and the TMDB
+discover/detail fetches are awaited instead of holding a worker thread, so one instance
+can keep hundreds of slow requests in flight. Prompts, caches, the candidate pool,
+circuit breakers and response formatting are shared with main.py, and every request
+works within the same deadline.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import logging
+import random
+
+import httpx
+from quart import Quart, request, jsonify
+from quart_cors import cors
+
+import main as agent
+from agent_common.admission import Overloaded, admission_limiter
+from agent_common.async_upstream import AsyncUpstreamClient
+from agent_common.batch import BatchRequestError, read_batch_items
+from agent_common.cache import make_key
+from agent_common.metrics import count_fallback, count_inference_source, install_async_metrics, span
+from agent_common.payloads import install_async_payload_handling
+from agent_common.resilience import (
+    DEADLINE_HEADER, GEMINI_TIMEOUT_SECONDS, REQUEST_DEADLINE_SECONDS, Deadline, DeadlineExceeded, await_with_deadline,
+)
+from agent_common.singleflight import AsyncSingleFlight
+from agent_common.startup import install_async_readiness_gate
+from agent_common.upstream import pool_size_from_env
+
+logger = logging.getLogger(__name__)
+
+# --- Quart App Setup ---
+app = Quart(__name__)
+app = cors(app, allow_origin="*") # Enable CORS for all routes
+
+tmdb_client = AsyncUpstreamClient(
+    'tmdb', max_connections=pool_size_from_env('tmdb'), hedge=agent.tmdb_client.hedge, limiter=admission_limiter('tmdb'),
+)
+movie_flight = AsyncSingleFlight('movie_candidates')
+details_flight = AsyncSingleFlight('movie_details')
+install_async_metrics(app, 'movie-agent')
+install_async_payload_handling(app, 'movie-agent')
+install_async_readiness_gate(app, agent.startup, exempt_endpoints=['cache_stats', 'metrics'])
+
+# --- Async TMDB Fetch Helpers ---
+async def fetch_discover_page_async(params, page_num, deadline):
+    """Async version of main.fetch_discover_page."""
+    current_params = params.copy()
+    current_params["page"] = page_num
+    response = await tmdb_client.get(agent.TMDB_DISCOVER_URL, params=current_params, endpoint="discover", deadline=deadline)
+    response.raise_for_status()
+    return agent.discover_results(response.json())
+
+async def fetch_movie_details_async(movie_id, deadline):
+    """Async version of main.fetch_movie_details (same persistent cache and deadline cut-off)."""
+    cached_details = await agent.movie_details_cache.get_async(movie_id)
+    if cached_details:
+        logger.info(f"Movie details cache hit for ID {movie_id}")
+        return cached_details
+
+    details = dict(agent.EMPTY_MOVIE_DETAILS)
+    if deadline.remaining() < agent.MOVIE_DETAILS_MIN_SECONDS:
+        logger.warning(f"Skipping movie details for ID {movie_id}: {deadline.remaining():.2f}s left before the deadline.")
+        count_fallback('skipped_details')
+        return details
+
+    try:
+        response = await tmdb_client.get(
+            f"{agent.TMDB_API_BASE_URL}/movie/{movie_id}", params=agent.build_details_params(), endpoint="details", deadline=deadline,
+        )
+        response.raise_for_status()
+        details = agent.extract_movie_details(response.json())
+        await agent.movie_details_cache.set_async(movie_id, details)
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching detailed movie info for ID {movie_id}: {e}")
+    except Exception as e:
+        logger.error(f"Error processing detailed movie info for ID {movie_id}: {e}")
+    return details
+
+def _discard_result(task):
+    """Retrieves a background page's outcome so a late failure isn't reported as unhandled."""
+    if not task.cancelled():
+        task.exception()
+
+def _page_store(pages):
+    """Task done-callback version of main.DiscoverPages.store; the cache write runs off the loop."""
+    def store(task):
+        if task.cancelled() or task.exception() is not None:
+            return
+        movies = pages.add(task.result())
+        if movies:
+            asyncio.ensure_future(agent.discover_cache.set_async(pages.key, movies))
+    return store
+
+# --- Async Movie Recommendation Logic ---
+async def infer_genre_ids_async(mood: str, gemini_prompt: str, deadline):
+    """Async version of main.infer_genre_ids using Gemini's async generation API."""
+    try:
+        with span('gemini_inference'):
+            gemini_response = await await_with_deadline(
+                deadline.within(GEMINI_TIMEOUT_SECONDS), 'gemini_inference',
+                gemini_prompt.generate_async, breaker=agent.gemini_breaker, limiter=agent.gemini_limiter,
+            )
+        with span('parse'):
+            return agent.parse_genre_ids(gemini_response, mood)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error using Gemini for mood inference: {e}. Falling back to default genres (Drama).")
+        return []
+
+async def resolve_genre_ids_async(mood: str, deadline):
+    """Async version of main.resolve_genre_ids."""
+    cache_key = make_key(mood)
+    genre_ids = await agent.genre_cache.get_async(cache_key)
+    if genre_ids:
+        logger.info(f"Inference cache hit for mood '{mood}': {genre_ids}")
+        count_inference_source('cache')
+        return genre_ids
+
+    genre_ids = agent.genre_ids_from_mood_index(mood)
+    if genre_ids:
+        count_inference_source('mood_index')
+        return genre_ids
+
+    genre_ids = await infer_genre_ids_async(mood, agent.build_genre_prompt(mood), deadline)
+    count_inference_source('gemini')
+    if genre_ids:
+        await agent.genre_cache.set_async(cache_key, genre_ids)
+        return genre_ids
+    count_fallback('drama_genres')
+    return [str(agent.TMDB_GENRES.get("drama", 18))]
+
+async def find_movies_async(genre_ids, deadline):
+    """Async version of main.find_movies."""
+    logger.info(f"Using TMDB genre IDs: {genre_ids}")
+
+    pages = agent.DiscoverPages(genre_ids)
+    movies = agent.candidate_pool.lookup([int(g) for g in genre_ids])
+    if movies:
+        logger.info(f"Candidate pool returned {len(movies)} movies for genres: {genre_ids}")
+    else:
+        movies = list(await agent.discover_cache.get_async(pages.key) or [])
+        if movies:
+            logger.info(f"Discover cache returned {len(movies)} movies for genres: {genre_ids}")
+    if not movies:
+        # Same overlap as the sync path: pick from the first page that arrives with results,
+        # and cache the later pages for the next request
+        params = agent.build_discover_params(genre_ids)
+        page_tasks = [
+            asyncio.ensure_future(fetch_discover_page_async(params, page_num, deadline))
+            for page_num in range(1, agent.DISCOVER_PAGES + 1)
+        ]
+        for task in page_tasks:
+            task.add_done_callback(_discard_result)
+            task.add_done_callback(_page_store(pages))
+        try:
+            for next_page in asyncio.as_completed(page_tasks, timeout=deadline.remaining()):
+                try:
+                    movies.extend(await next_page)
+                except (httpx.HTTPError, Overloaded) as e:
+                    logger.error(f"Error fetching movies from TMDB: {e}")
+                if movies:
+                    break
+        except asyncio.TimeoutError:
+            logger.error(f"Request deadline reached while fetching discover pages for genres: {genre_ids}")
+
+    if not movies:
+        logger.warning(f"No movies found for inferred genres: {genre_ids} across multiple pages. Trying popular movies as a last resort.")
+        deadline.check('popular_fallback')
+        count_fallback('popular_movies')
+        try:
+            response = await tmdb_client.get(
+                agent.TMDB_DISCOVER_URL, params=agent.build_popular_params(), endpoint="discover_popular", deadline=deadline,
+            )
+            response.raise_for_status()
+            movies = agent.discover_results(response.json())
+            logger.info(f"Fallback popular search returned {len(movies)} movies.")
+        except httpx.HTTPError as e:
+            logger.error(f"Error during popular movies fallback: {e}")
+            movies = []
+
+        if not movies:
+            if deadline.expired():
+                raise DeadlineExceeded("Request deadline exceeded during the movie search.")
+            raise ValueError("Could not find any movies with discover or popular fallback.")
+
+    return movies
+
+async def get_movie_recommendation_async(mood: str, deadline=None):
+    """Async version of main.get_movie_recommendation."""
+    deadline = deadline or Deadline(REQUEST_DEADLINE_SECONDS)
+    logger.info(f"Entering get_movie_recommendation_async for mood: '{mood}'")
+
+    snapshot_movies = agent.movies_from_snapshot(mood)
+    if snapshot_movies:
+        return random.choice(snapshot_movies)
+
+    async def genres_then_movies():
+        return await find_movies_async(await resolve_genre_ids_async(mood, deadline), deadline)
+
+    # Concurrent requests for the same mood share the inference and the discovery
+    movies = await movie_flight.do(make_key(mood), genres_then_movies)
+
+    selected_movie = random.choice(movies)
+    movie_id = selected_movie.get("id")
+    if movie_id:
+        details = await details_flight.do(movie_id, lambda: fetch_movie_details_async(movie_id, deadline))
+    else:
+        details = dict(agent.EMPTY_MOVIE_DETAILS)
+    return agent.format_movie(selected_movie, details)
+
+# --- Quart Routes ---
+@app.route('/recommend_movie', methods=['POST'])
+async def recommend_movie():
+    """
+    Async HTTP endpoint for the Movie Agent.
+    Expects a JSON payload with 'mood'.
+    """
+    try:
+        data = await request.get_json()
+        mood = data.get('mood')
+
+        if not mood:
+            logger.warning("Missing 'mood' in request body in movie agent")
+            return jsonify({"error": "Missing 'mood' in request body"}), 400
+
+        logger.info(f"Received request for mood: {mood} in movie agent (async)")
+        deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER), REQUEST_DEADLINE_SECONDS)
+        movie_recommendation = await get_movie_recommendation_async(mood, deadline)
+        with span('serialize'):
+            return jsonify(movie_recommendation), 200
+
+    except DeadlineExceeded as e:
+        logger.warning(f"Deadline exceeded in recommend_movie endpoint: {e}")
+        return jsonify({"error": str(e)}), 504
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_movie request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        logger.error(f"Unhandled error in recommend_movie endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/recommend_movie_batch', methods=['POST'])
+async def recommend_movie_batch():
+    """
+    Batch HTTP endpoint, same contract as main.recommend_movie_batch. The batch already
+    bounds its own concurrency, so it runs on the synchronous path in a worker thread.
+    """
+    try:
+        data = await request.get_json() or {}
+        items = read_batch_items(data)
+        logger.info(f"Received batch request with {len(items)} items in movie agent (async)")
+        batch_results = await asyncio.to_thread(agent.get_movie_recommendations_batch, items)
+        with span('serialize'):
+            return jsonify(batch_results), 200
+
+    except BatchRequestError as e:
+        logger.warning(f"Rejected batch request in movie agent: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_movie_batch request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        logger.error(f"Unhandled error in recommend_movie_batch endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cache_stats', methods=['GET'])
+async def cache_stats():
+    """Reports inference cache, candidate pool and movie details cache counters."""
+    report = await asyncio.to_thread(agent.cache_report)  # Counts the SQLite details cache
+    return jsonify({**report, "asyncCoalescing": [movie_flight.stats(), details_flight.stats()], "asyncHedging": tmdb_client.stats()}), 200
+
+@app.after_serving
+async def close_clients():
+    await tmdb_client.aclose()
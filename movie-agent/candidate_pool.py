@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Only the fields the movie agent reads from a discover result are kept in memory.
+COMPACT_FIELDS = ("id", "title", "poster_path", "overview")
+# Pool pages also keep the genres, which the index is built from before they are dropped
+POOL_FIELDS = COMPACT_FIELDS + ("genre_ids",)
+
+
+def compact_movie(movie, fields=COMPACT_FIELDS):
+    """Projects a TMDB discover result onto the fields the agent uses."""
+    return {field: movie.get(field) for field in fields}
+
+
+class CandidatePool:
+    """
+    In-memory movie candidates indexed by TMDB genre ID.
+    A background thread re-runs /discover/movie for every genre on a schedule and swaps in
+    the new index atomically, so lookups never wait on TMDB. Lookups for a genre set prefer
+    the intersection (TMDB's with_genres semantics) and relax one genre at a time towards
+    the union until there are enough candidates.
+    """
+
+    def __init__(self, fetch_page, executor, pages_per_genre=5, refresh_seconds=6 * 3600, min_candidates=10):
+        self._fetch_page = fetch_page  # fetch_page(genre_id, page_num) -> list of discover results
+        self._executor = executor
+        self.pages_per_genre = pages_per_genre
+        self.refresh_seconds = refresh_seconds
+        self.min_candidates = min_candidates
+        self._records = {}
+        self._index = {}
+        self._refreshed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ready(self):
+        return bool(self._index)
+
+    def refresh(self, genre_ids):
+        """Re-fetches candidates for every genre and swaps in the new index."""
+        started = time.monotonic()
+        jobs = {
+            (genre_id, page_num): self._executor.submit(self._fetch_page, genre_id, page_num)
+            for genre_id in set(genre_ids)
+            for page_num in range(1, self.pages_per_genre + 1)
+        }
+        records = {}
+        index = {}
+        failures = 0
+        for (genre_id, page_num), future in jobs.items():
+            try:
+                results = future.result()
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Candidate pool fetch failed for genre {genre_id}, page {page_num}: {e}")
+                continue
+            for movie in results:
+                movie_id = movie.get("id")
+                if movie_id is None:
+                    continue
+                records.setdefault(movie_id, compact_movie(movie))
+                # Index by every genre the movie carries, not only the one we queried
+                for movie_genre in movie.get("genre_ids") or [genre_id]:
+                    index.setdefault(movie_genre, set()).add(movie_id)
+
+        if not records:
+            logger.error(f"Candidate pool refresh returned no movies ({failures} failed fetches). Keeping previous pool.")
+            return False
+
+        # Swap both references together so readers never see a half-built pool
+        self._records, self._index = records, index
+        self._refreshed_at = time.time()
+        logger.info(f"Candidate pool refreshed: {len(records)} movies across {len(index)} genres "
+                    f"in {time.monotonic() - started:.2f}s ({failures} failed fetches).")
+        return True
+
+    def lookup(self, genre_ids):
+        """Returns compact candidates for the genre set, or an empty list on a miss."""
+        records, index = self._records, self._index
+        counts = Counter(movie_id for genre_id in set(genre_ids) for movie_id in index.get(genre_id, ()))
+        matched = []
+        for required in range(len(set(genre_ids)), 0, -1):
+            matched = [movie_id for movie_id, count in counts.items() if count >= required]
+            if len(matched) >= self.min_candidates:
+                break
+        if len(matched) < self.min_candidates:
+            self.misses += 1
+            return []
+        self.hits += 1
+        return [records[movie_id] for movie_id in matched]
+
+    def start(self, genre_ids_provider):
+        """Starts the background refresh loop. genre_ids_provider() returns the genre IDs to load."""
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.refresh(genre_ids_provider())
+                except Exception as e:
+                    logger.error(f"Candidate pool refresh crashed: {e}")
+                self._stop.wait(self.refresh_seconds)
+
+        self._thread = threading.Thread(target=run, name="candidate-pool-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "movies": len(self._records),
+            "genres": len(self._index),
+            "refreshedAt": self._refreshed_at,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
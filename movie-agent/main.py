@@ -3,12 +3,30 @@ import requests
 import json
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from google.cloud import secretmanager
-
-from google.cloud import aiplatform
-from vertexai.preview.generative_models import GenerativeModel
 import random
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from agent_common.admission import Overloaded, admission_limiter, admission_report
+from agent_common.batch import BATCH_DEADLINE_SECONDS, BATCH_INFERENCE_CHUNK, BATCH_WORKERS, BatchRequestError, chunked, item_errors, read_batch_items
+from agent_common.cache import cache_from_env, make_key, normalize_mood
+from agent_common.metrics import count_fallback, count_inference_source, install_metrics, span
+from agent_common.mood_index import MoodIndex
+from agent_common.payloads import install_payload_handling
+from agent_common.prompts import LIST_MAX_OUTPUT_TOKENS, PromptTemplate, numbered_lists_schema, parse_numbered_lists, parse_string_list, string_list_schema
+from agent_common.resilience import (
+    DEADLINE_HEADER, GEMINI_TIMEOUT_SECONDS, REQUEST_DEADLINE_SECONDS,
+    Deadline, DeadlineExceeded, call_with_deadline, circuit_breaker, circuit_report,
+)
+from agent_common.runtime import get_secret, init_secret_manager, init_vertex_ai
+from agent_common.singleflight import SingleFlight
+from agent_common.snapshot import snapshot_store_from_env
+from agent_common.persistent_cache import PersistentCache
+from agent_common.startup import Startup, install_readiness_gate
+from agent_common.upstream import UpstreamClient, pool_size_from_env
+from candidate_pool import COMPACT_FIELDS, POOL_FIELDS, CandidatePool, compact_movie
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,116 +37,210 @@ app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
 
 # --- Configuration ---
-PROJECT_ID = os.environ.get('GCP_PROJECT_ID', 'moodfusion-hackathon')
-REGION = os.environ.get('GCP_REGION', 'us-central1')
 TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500/" # Base URL for TMDB movie posters
 
-# --- Secret Manager Client ---
-secret_manager_client = secretmanager.SecretManagerServiceClient()
+# --- Global variables for API keys (fetched once on startup) ---
+TMDB_API_KEY = None
 
-# --- Helper Function to Get Secrets ---
-def get_secret(secret_name):
-    """Fetches a secret from Secret Manager."""
+def load_tmdb_api_key():
+    global TMDB_API_KEY
     try:
-        resource_name = f"projects/{PROJECT_ID}/secrets/{secret_name}/versions/latest"
-        response = secret_manager_client.access_secret_version(request={"name": resource_name})
-        return response.payload.data.decode("UTF-8")
-    except Exception as e:
-        logger.error(f"Error accessing secret '{secret_name}': {e}")
+        TMDB_API_KEY = get_secret('tmdb_api_key')
+        logger.info("TMDB API Key loaded.")
+    except Exception:
+        logger.critical("Failed to load TMDB API key. Exiting.")
         raise
 
-# --- Global variables for API keys (fetched once on startup) ---
-try:
-    TMDB_API_KEY = get_secret('tmdb_api_key')
-    logger.info("TMDB API Key loaded.")
-except Exception as e:
-    logger.critical("Failed to load TMDB API key. Exiting.")
-    exit(1)
+# --- TMDB HTTP Client ---
+# One pooled keep-alive session for all TMDB calls (timeouts + retries on GET).
+# The base URL is overridable so the offline benchmark can point the agent at a local stub.
+# TMDB calls are free reads, so slow ones are hedged by default.
+TMDB_API_BASE_URL = os.environ.get('TMDB_API_BASE_URL', 'https://api.themoviedb.org/3')
+tmdb_client = UpstreamClient(
+    'tmdb',
+    {TMDB_API_BASE_URL: pool_size_from_env('tmdb')},
+    hedge=os.environ.get('TMDB_HEDGE_ENABLED', 'true').lower() == 'true',
+    limiter=admission_limiter('tmdb'),
+)
 
 # --- TMDB Genre Mapping ---
-# Fetch TMDB movie genres once on startup
-TMDB_GENRES = {}
-try:
-    genre_list_url = f"https://api.themoviedb.org/3/genre/movie/list?api_key={TMDB_API_KEY}&language=en-US"
-    response = requests.get(genre_list_url)
-    response.raise_for_status()
-    genres_data = response.json().get('genres', [])
-    for genre in genres_data:
-        TMDB_GENRES[genre['name'].lower()] = genre['id']
-    logger.info("TMDB Genres loaded: %s", TMDB_GENRES)
-except Exception as e:
-    logger.error(f"Error fetching TMDB genres: {e}. Movie recommendations might be less accurate.")
-    TMDB_GENRES = {
-        "action": 28, "adventure": 12, "animation": 16, "comedy": 35,
-        "crime": 80, "documentary": 99, "drama": 18, "family": 10751,
-        "fantasy": 14, "history": 36, "horror": 27, "music": 10402,
-        "mystery": 9648, "romance": 10749, "science fiction": 878,
-        "tv movie": 10770, "thriller": 53, "war": 10752, "western": 37,
-        "animation": 16, "documentary": 99, "family": 10751, "music": 10402
-    }
-
-# --- Vertex AI (Gemini) Client ---
-aiplatform.init(project=PROJECT_ID, location=REGION)
-model = GenerativeModel('gemini-2.0-flash')
-
-# --- Movie Recommendation Logic (Core of the Agent) ---
-def get_movie_recommendation(mood: str):
+# Fetched once on startup; this list is used if the fetch fails.
+DEFAULT_TMDB_GENRES = {
+    "action": 28, "adventure": 12, "animation": 16, "comedy": 35,
+    "crime": 80, "documentary": 99, "drama": 18, "family": 10751,
+    "fantasy": 14, "history": 36, "horror": 27, "music": 10402,
+    "mystery": 9648, "romance": 10749, "science fiction": 878,
+    "tv movie": 10770, "thriller": 53, "war": 10752, "western": 37
+}
+TMDB_GENRES = dict(DEFAULT_TMDB_GENRES)
+
+def load_tmdb_genres():
+    global TMDB_GENRES
+    try:
+        genre_list_url = f"{TMDB_API_BASE_URL}/genre/movie/list?api_key={TMDB_API_KEY}&language=en-US"
+        response = tmdb_client.get(genre_list_url, endpoint="genres")
+        response.raise_for_status()
+        genres_data = response.json().get('genres', [])
+        loaded_genres = {}
+        for genre in genres_data:
+            loaded_genres[genre['name'].lower()] = genre['id']
+        if loaded_genres:
+            TMDB_GENRES = loaded_genres
+        logger.info("TMDB Genres loaded: %s", TMDB_GENRES)
+    except Exception as e:
+        logger.error(f"Error fetching TMDB genres: {e}. Movie recommendations might be less accurate.")
+        TMDB_GENRES = dict(DEFAULT_TMDB_GENRES)
+
+# --- Gemini Prompts ---
+# The genre list is baked into the instructions, so they are compiled again once the TMDB genres are loaded.
+GENRE_RULES = """
+Do not suggest specific movies, actors or genre IDs. If a mood doesn't map directly to a genre, pick the closest fitting ones.
+Never suggest Animation, Family or Kids genres unless the mood explicitly and strongly asks for content for children (e.g. "childlike fun", "for kids"); otherwise assume adult/teenager preferences.
+"""
+GENRE_EXAMPLES = [
+    ("sad", ["drama", "music", "romance"]),
+    ("adventurous", ["action", "adventure", "fantasy", "science fiction"]),
+    ("cozy and thoughtful", ["drama", "romance", "comedy"]),
+    ("romantic", ["romance", "drama", "comedy", "thriller"]),
+    ("energetic", ["action", "adventure", "thriller", "science fiction", "comedy"]),
+    ("tired", ["drama", "comedy", "documentary"]),
+]
+GENRES_MAX = 5
+
+def genre_templates(genres):
     """
-    Recommends a movie based on the user's mood using TMDB and Gemini.
-    Handles internal errors and raises specific exceptions if necessary.
+    The single-mood and batch genre prompts for a genre name -> ID mapping, and the response
+    schema constraining an answer to a list of those genre names.
     """
-    logger.info(f"Entering get_movie_recommendation for mood: '{mood}'")
-
-    # --- Step 1: Use Gemini to infer TMDB genre names from the mood ---
-    available_genres = list(TMDB_GENRES.keys())
-    gemini_prompt = f"""
-The user is feeling: "{mood}".
-Suggest 3-5 distinct TMDB movie genre names that would perfectly match this mood.
-Do not suggest specific movies, actors, or genre IDs.
-Choose ONLY from the following common TMDB genres: {', '.join(sorted(available_genres))}.
-If a mood doesn't directly map to a genre, pick the closest fitting ones.
-
-**CRITICAL: ABSOLUTELY DO NOT SUGGEST** "Animation", "Family", or "Kids" genres unless the mood *explicitly* and *strongly* suggests content for children (e.g., mood is "childlike fun", "for kids"). For general moods, assume adult/teenager preferences.
-
+    genre_list = ", ".join(sorted(genres))
+    examples = "\n".join(f'- "{mood}": {json.dumps(names)}' for mood, names in GENRE_EXAMPLES)
+    schema = string_list_schema(GENRES_MAX, allowed=genres)
+    single = PromptTemplate("movie_genres", f"""
+Suggest 3-5 distinct TMDB movie genre names that match the user's mood.
+Choose ONLY from these genres: {genre_list}.
+{GENRE_RULES}
 Examples:
-- If mood is "sad", genres could be "Drama", "Music", "Romance".
-- If mood is "adventurous", genres could be "Action", "Adventure", "Fantasy", "Science Fiction".
-- If mood is "cozy and thoughtful", genres could be "Drama", "Romance", "Comedy".
-- If mood is "romantic", genres could be "Romance", "Drama", "Comedy", "Thriller".
-- If mood is "energetic", genres could be "Action", "Adventure", "Thriller", "Science Fiction", "Comedy".
-- If mood is "tired", genres could be "Drama", "Comedy", "Documentary".
-
-Return the genre names as a comma-separated list.
-"""
-    inferred_genre_names = ""
+{examples}
+Reply with a JSON list of the genre names.
+""", 'The user is feeling: "{mood}".', response_schema=schema, max_output_tokens=LIST_MAX_OUTPUT_TOKENS)
+    batch = PromptTemplate("movie_genres_batch", f"""
+For each numbered request, suggest 3-5 distinct TMDB movie genre names that match the user's mood.
+Choose ONLY from these genres: {genre_list}.
+{GENRE_RULES}
+Return a JSON object mapping each request number to its list of genre names, for example:
+{{"1": ["drama", "music", "romance"], "2": ["action", "adventure", "fantasy", "science fiction"]}}
+""", "Requests:\n{requests}", max_output_tokens=LIST_MAX_OUTPUT_TOKENS * BATCH_INFERENCE_CHUNK)
+    return single, batch, schema
+
+GENRE_PROMPT, GENRE_BATCH_PROMPT, GENRES_SCHEMA = genre_templates(TMDB_GENRES)
+
+def init_gemini_prompts():
+    global GENRE_PROMPT, GENRE_BATCH_PROMPT, GENRES_SCHEMA
+    single, batch, schema = genre_templates(TMDB_GENRES)
+    GENRE_PROMPT, GENRE_BATCH_PROMPT, GENRES_SCHEMA = single.prepare(), batch.prepare(), schema
+
+# The SDK call has no timeout of its own, so it runs here and the request waits only until its deadline.
+# Calls beyond the workers wait in the admission queue and are shed with 503 once it is full.
+GEMINI_WORKERS = int(os.environ.get('GEMINI_WORKERS', 32))
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_WORKERS, thread_name_prefix="gemini")
+gemini_breaker = circuit_breaker('gemini')
+gemini_limiter = admission_limiter('gemini', max_concurrent=GEMINI_WORKERS)
+
+# --- Inference Cache ---
+# Mood -> TMDB genre IDs inferred by Gemini. Most traffic repeats a small set of moods.
+genre_cache = cache_from_env('movie_genres')
+
+# --- Genre Parsing ---
+def build_genre_prompt(mood: str):
+    """The Gemini prompt asking for TMDB genre names that match the mood."""
+    return GENRE_PROMPT.render(mood=mood)
+
+def parse_genre_ids(gemini_response, mood: str):
+    """Maps the genre names in a Gemini response to TMDB genre IDs; names outside TMDB_GENRES are rejected."""
+    genre_names = parse_string_list(GENRE_PROMPT.name, gemini_response, GENRES_MAX, allowed=TMDB_GENRES)
+    logger.info(f"Gemini inferred genre names for '{mood}': {genre_names}")
+    return genre_names_to_ids(genre_names)
+
+def genre_names_to_ids(genre_names):
+    """Maps genre names inferred by Gemini to TMDB genre IDs, skipping unknown names."""
     genre_ids = []
-    try:
-        gemini_response = model.generate_content(gemini_prompt)
-        if gemini_response.candidates and gemini_response.candidates[0].content.parts:
-            inferred_genre_names = gemini_response.candidates[0].content.parts[0].text.strip()
-            logger.info(f"Gemini inferred genre names for '{mood}': {inferred_genre_names}")
+    for genre_name in [g.strip().lower() for g in genre_names]:
+        if genre_name in TMDB_GENRES:
+            genre_ids.append(str(TMDB_GENRES[genre_name]))
         else:
-            logger.warning(f"Gemini returned no content for mood '{mood}'. Response: {gemini_response}")
+            logger.warning(f"Inferred genre '{genre_name}' not found in TMDB_GENRES. Skipping.")
 
-        for genre_name in [g.strip().lower() for g in inferred_genre_names.split(',')]:
-            if genre_name in TMDB_GENRES:
-                genre_ids.append(str(TMDB_GENRES[genre_name]))
-            else:
-                logger.warning(f"Inferred genre '{genre_name}' not found in TMDB_GENRES. Skipping.")
-
-        if not genre_ids:
-            logger.warning("No valid TMDB genre IDs inferred by Gemini. Falling back to default genres (Drama).")
-            genre_ids = [str(TMDB_GENRES.get("drama", 18))]
+    if not genre_ids:
+        logger.warning("No valid TMDB genre IDs inferred by Gemini. Falling back to default genres (Drama).")
+    return genre_ids
 
+def infer_genre_ids(mood: str, gemini_prompt: str, deadline):
+    """
+    Asks Gemini for genre names and maps them to TMDB genre IDs, waiting at most
+    GEMINI_TIMEOUT_SECONDS of the deadline. Returns an empty list if Gemini fails, is too
+    slow or nothing matches, so callers can fall back without caching the fallback.
+    Raises Overloaded if Gemini is saturated.
+    """
+    try:
+        with span('gemini_inference'):
+            gemini_response = call_with_deadline(
+                gemini_executor, deadline.within(GEMINI_TIMEOUT_SECONDS), 'gemini_inference',
+                gemini_prompt.generate, breaker=gemini_breaker, limiter=gemini_limiter,
+            )
+        with span('parse'):
+            return parse_genre_ids(gemini_response, mood)
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error using Gemini for mood inference: {e}. Falling back to default genres (Drama).")
-        genre_ids = [str(TMDB_GENRES.get("drama", 18))]
-
-    logger.info(f"Using TMDB genre IDs: {genre_ids}")
-
-    # --- Step 2: Discover movies on TMDB using genre IDs ---
-    tmdb_url = "https://api.themoviedb.org/3/discover/movie"
-    params = {
+        return []
+
+# --- Local Mood Index ---
+# Nearest-neighbour fast path over a curated set of moods (mood_index_seed.json, mood -> genre names).
+# Built on CPU at startup; moods it can't match confidently still go to Gemini.
+mood_index = None
+
+def load_mood_index():
+    global mood_index
+    if os.environ.get('MOOD_INDEX_ENABLED', 'true').lower() != 'true':
+        return
+    mood_index = MoodIndex.from_seed_file(
+        'movie_moods',
+        os.environ.get('MOOD_INDEX_SEED_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mood_index_seed.json')),
+        min_score=float(os.environ.get('MOOD_INDEX_MIN_SCORE', 0.7)),
+    )
+
+def genre_ids_from_mood_index(mood: str):
+    """TMDB genre IDs for a confidently matched known mood, or None to ask Gemini."""
+    match = mood_index.lookup(mood) if mood_index else None
+    if not match:
+        return None
+    genre_names, score, matched_mood = match
+    genre_ids = genre_names_to_ids(genre_names)
+    if genre_ids:
+        logger.info(f"Mood index matched '{mood}' to '{matched_mood}' (score {score:.2f}): {genre_ids}")
+    return genre_ids
+
+# --- TMDB Fetch Helpers ---
+TMDB_DISCOVER_URL = f"{TMDB_API_BASE_URL}/discover/movie"
+DISCOVER_PAGES = 3 # Fetch from first 3 pages for more variety
+tmdb_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('TMDB_FETCH_WORKERS', 16)),
+    thread_name_prefix="tmdb"
+)
+# Below this much time left, a movie is served without its (uncached) details rather than risk the deadline
+MOVIE_DETAILS_MIN_SECONDS = float(os.environ.get('MOVIE_DETAILS_MIN_SECONDS', 0.3))
+
+EMPTY_MOVIE_DETAILS = {
+    "movieYear": "N/A",
+    "movieRuntime": "N/A",
+    "movieRating": "N/A", # MPAA Rating
+    "movieVoteAverage": "N/A"
+}
+
+def build_discover_params(genre_ids):
+    """/discover/movie parameters for the inferred genre IDs (without a page number)."""
+    return {
         "api_key": TMDB_API_KEY,
         "language": "en-US",
         "include_adult": False,
@@ -136,126 +248,471 @@ Return the genre names as a comma-separated list.
         "with_genres": ','.join(genre_ids)
     }
 
-    all_movies = []
+def build_popular_params():
+    """/discover/movie parameters for the popular-movies fallback."""
+    return {
+        "api_key": TMDB_API_KEY,
+        "language": "en-US",
+        "sort_by": "popularity.desc",
+        "include_adult": False,
+        "include_video": False,
+        "page": 1
+    }
+
+def build_details_params():
+    """/movie/{movie_id} parameters, including release_dates for the certification."""
+    return {
+        "api_key": TMDB_API_KEY,
+        "language": "en-US",
+        "append_to_response": "release_dates" # To get certification info
+    }
+
+def discover_results(data, fields=COMPACT_FIELDS):
+    """
+    The results of a /discover/movie response as compact records. TMDB has no field
+    selection, so the ~20 full result objects per page are dropped as soon as they are parsed.
+    """
+    return [compact_movie(movie, fields) for movie in data.get("results", [])]
+
+def fetch_discover_page(params, page_num, endpoint="discover", deadline=None, fields=COMPACT_FIELDS):
+    """Fetches one /discover/movie page and returns its results as compact records."""
+    current_params = params.copy()
+    current_params["page"] = page_num
+    response = tmdb_client.get(TMDB_DISCOVER_URL, params=current_params, endpoint=endpoint, deadline=deadline)
+    response.raise_for_status()
+    return discover_results(response.json(), fields)
+
+# Live discover results per genre combination, for genre sets the candidate pool doesn't cover.
+# A pool miss answers from the first page to arrive; the later pages land here for the next request.
+discover_cache = cache_from_env('movie_discover', prefix='DISCOVER_CACHE', max_entries=512, ttl_seconds=6 * 3600)
+
+class DiscoverPages:
+    """Merges the discover pages of one pool miss as they arrive and caches the union so far."""
+
+    def __init__(self, genre_ids):
+        self.key = make_key(*sorted(genre_ids))
+        self.movies = []
+        self.seen_ids = set()
+        self.lock = threading.Lock()
+
+    def add(self, page):
+        """Adds a page's movies; returns the merged list to cache, or None if nothing new came in."""
+        with self.lock:
+            fresh = [movie for movie in page if movie.get("id") not in self.seen_ids]
+            if not fresh:
+                return None
+            self.seen_ids.update(movie.get("id") for movie in fresh)
+            self.movies.extend(fresh)
+            return list(self.movies)
+
+    def store(self, future):
+        """Done-callback for a page future: caches the page, late or not. Failures are logged by the caller."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        movies = self.add(future.result())
+        if movies:
+            discover_cache.set(self.key, movies)
+
+# Formatted detail fields per movie ID, kept across restarts. Popular movies are picked again and again.
+movie_details_cache = PersistentCache(
+    'movie_details',
+    os.environ.get('MOVIE_DETAILS_CACHE_PATH', '/tmp/moodfusion/movie_details.sqlite3'),
+    ttl_seconds=float(os.environ.get('MOVIE_DETAILS_CACHE_TTL_SECONDS', 7 * 24 * 3600)),
+)
+
+def extract_movie_details(movie_details):
+    """Pulls year, runtime, vote average and US certification out of a /movie/{id} response."""
+    details = dict(EMPTY_MOVIE_DETAILS)
+
+    # Extracting details
+    release_date_full = movie_details.get("release_date")
+    if release_date_full:
+        details["movieYear"] = release_date_full.split('-')[0] # Get just the year
+
+    runtime_minutes = movie_details.get("runtime")
+    if runtime_minutes is not None: # Check for None explicitly
+        hours = runtime_minutes // 60
+        minutes = runtime_minutes % 60
+        details["movieRuntime"] = f"{hours}h {minutes}min"
+
+    vote_avg = movie_details.get("vote_average")
+    if vote_avg is not None: # Check for None explicitly
+        details["movieVoteAverage"] = f"{vote_avg:.1f}/10" # Format to one decimal place
+
+    # Extracting certification (MPAA rating) from release_dates
+    release_dates_data = movie_details.get("release_dates", {}).get("results", [])
+    for rd in release_dates_data:
+        if rd.get("iso_3166_1") == "US": # Look for US certification
+            for c in rd.get("release_dates", []):
+                if c.get("certification"):
+                    details["movieRating"] = c.get("certification")
+                    break # Found certification, break inner loop
+        if details["movieRating"] != "N/A": # If US certification found, break outer loop
+            break
+
+    logger.info(f"Fetched movie details: Year={details['movieYear']}, Runtime={details['movieRuntime']}, Vote={details['movieVoteAverage']}, Cert={details['movieRating']}")
+    return details
+
+def format_movie(selected_movie, details):
+    """Maps a discover result plus its extracted details onto the /recommend_movie response fields."""
+    movie_title = selected_movie.get("title")
+    poster_path = selected_movie.get("poster_path")
+    movie_id = selected_movie.get("id")
+
+    movie_poster_url = f"{TMDB_IMAGE_BASE_URL}{poster_path}" if poster_path else "https://via.placeholder.com/300x450"
+    movie_description = selected_movie.get("overview")
+    movie_source_url = f"https://www.themoviedb.org/movie/{movie_id}"
+
+    logger.info(f"Selected Movie: {movie_title}, Poster URL: {movie_poster_url}")
+    return {
+        "movieTitle": movie_title,
+        "moviePosterUrl": movie_poster_url,
+        "movieDescription": movie_description,
+        "movieSourceUrl": movie_source_url,
+        "movieYear": details["movieYear"],
+        "movieRuntime": details["movieRuntime"],
+        "movieRating": details["movieRating"],
+        "movieVoteAverage": details["movieVoteAverage"]
+    }
+
+class MovieDetailsSkipped(Exception):
+    """Too little of the deadline is left to fetch a movie's (uncached) details."""
+
+def load_movie_details(movie_id, deadline=None):
+    """
+    Fetches /movie/{movie_id} with release_dates and extracts year, runtime, vote average
+    and US certification, serving them from movie_details_cache until they expire.
+    Raises instead of returning placeholder details: MovieDetailsSkipped when less than
+    MOVIE_DETAILS_MIN_SECONDS of the deadline is left, requests' exceptions when TMDB fails.
+    """
+    cached_details = movie_details_cache.get(movie_id)
+    if cached_details:
+        logger.info(f"Movie details cache hit for ID {movie_id}")
+        return cached_details
+
+    if deadline is not None and deadline.remaining() < MOVIE_DETAILS_MIN_SECONDS:
+        raise MovieDetailsSkipped(f"{deadline.remaining():.2f}s left before the deadline")
+
+    details_response = tmdb_client.get(
+        f"{TMDB_API_BASE_URL}/movie/{movie_id}", params=build_details_params(), endpoint="details", deadline=deadline,
+    )
+    details_response.raise_for_status()
+    details = extract_movie_details(details_response.json())
+    movie_details_cache.set(movie_id, details)
+    return details
+
+def fetch_movie_details(movie_id, deadline=None):
+    """
+    load_movie_details for serving: returns "N/A" for anything that could not be fetched,
+    or when less than MOVIE_DETAILS_MIN_SECONDS of the deadline is left.
+    """
     try:
-        for page_num in range(1, 4): # Fetch from first 3 pages for more variety
-            current_params = params.copy()
-            current_params["page"] = page_num
-            response = requests.get(tmdb_url, params=current_params)
-            response.raise_for_status()
-            data = response.json()
-            all_movies.extend(data.get("results", []))
-            if data.get("total_pages") and page_num >= data.get("total_pages"):
-                break
+        return load_movie_details(movie_id, deadline)
+    except MovieDetailsSkipped as e:
+        logger.warning(f"Skipping movie details for ID {movie_id}: {e}.")
+        count_fallback('skipped_details')
     except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching movies from TMDB: {e}")
-        all_movies = []
+        logger.error(f"Error fetching detailed movie info for ID {movie_id}: {e}")
+    except Exception as e:
+        logger.error(f"Error processing detailed movie info for ID {movie_id}: {e}")
+
+    return dict(EMPTY_MOVIE_DETAILS)
+
+# --- Pre-warmed Candidate Pool ---
+# Discover results per genre, refreshed in the background so most requests skip TMDB discovery.
+def fetch_pool_page(genre_id, page_num):
+    """Fetches one popularity-sorted discover page for a single genre."""
+    return fetch_discover_page(build_discover_params([str(genre_id)]), page_num, endpoint="discover_pool", fields=POOL_FIELDS)
+
+candidate_pool = CandidatePool(
+    fetch_pool_page,
+    # Separate small pool so a refresh never queues ahead of live request fetches
+    ThreadPoolExecutor(max_workers=int(os.environ.get('CANDIDATE_POOL_WORKERS', 4)), thread_name_prefix="pool"),
+    pages_per_genre=int(os.environ.get('CANDIDATE_POOL_PAGES_PER_GENRE', 5)),
+    refresh_seconds=float(os.environ.get('CANDIDATE_POOL_REFRESH_SECONDS', 6 * 3600)),
+    min_candidates=int(os.environ.get('CANDIDATE_POOL_MIN_CANDIDATES', 10)),
+)
+
+def start_candidate_pool():
+    if os.environ.get('CANDIDATE_POOL_ENABLED', 'true').lower() == 'true':
+        candidate_pool.start(lambda: TMDB_GENRES.values())
+
+# --- Recommendation Snapshot ---
+# Movies (with their details) precomputed offline by precompute.py for a vocabulary of moods,
+# keyed like the inference cache. Covered moods are answered from the memory-mapped file
+# without any network call; the file is mapped again whenever the job replaces it.
+recommendation_snapshot = snapshot_store_from_env('movie_recommendations')
+
+def load_recommendation_snapshot():
+    if recommendation_snapshot:
+        recommendation_snapshot.open()
+
+def watch_recommendation_snapshot():
+    if recommendation_snapshot:
+        recommendation_snapshot.watch()
+
+def movies_from_snapshot(mood: str):
+    """The precomputed, formatted movies for the mood, or None if the snapshot doesn't cover it."""
+    entry = recommendation_snapshot.get(make_key(mood)) if recommendation_snapshot else None
+    if not entry or not entry.get("movies"):
+        return None
+    count_inference_source('snapshot')
+    return entry["movies"]
+
+# --- Startup ---
+# Independent steps run concurrently in the background while the server binds the port;
+# requests wait on the readiness gate installed below. Under the multi-process runtime the
+# mood index and the snapshot are loaded once before workers are forked, and every worker
+# runs the other steps.
+startup = Startup('movie-agent')
+startup.add_step('secret_manager', init_secret_manager)
+startup.add_step('tmdb_api_key', load_tmdb_api_key, depends_on=['secret_manager'])
+startup.add_step('tmdb_genres', load_tmdb_genres, depends_on=['tmdb_api_key'], critical=False)
+startup.add_step('candidate_pool', start_candidate_pool, depends_on=['tmdb_genres'], critical=False)
+startup.add_step('vertex_ai', init_vertex_ai)
+startup.add_step('gemini_prompts', init_gemini_prompts, depends_on=['vertex_ai', 'tmdb_genres'])
+startup.add_step('mood_index', load_mood_index, critical=False, preload=True)
+startup.add_step('recommendation_snapshot', load_recommendation_snapshot, critical=False, preload=True)
+startup.add_step('snapshot_reload', watch_recommendation_snapshot, depends_on=['recommendation_snapshot'], critical=False)
+startup.start()
+install_metrics(app, 'movie-agent')
+install_payload_handling(app, 'movie-agent')
+install_readiness_gate(app, startup, exempt_endpoints=['cache_stats', 'metrics'])
+
+# --- Movie Recommendation Logic (Core of the Agent) ---
+# Coalesces identical in-flight requests so a burst of the same mood costs one Gemini call and one discovery
+movie_flight = SingleFlight('movie_candidates')
+details_flight = SingleFlight('movie_details')
+
+def resolve_genre_ids(mood: str, gemini_prompt: str, deadline):
+    """TMDB genre IDs for the mood from the inference cache, or from Gemini on a miss."""
+    cache_key = make_key(mood)
+    genre_ids = genre_cache.get(cache_key)
+    if genre_ids:
+        logger.info(f"Inference cache hit for mood '{mood}': {genre_ids}")
+        count_inference_source('cache')
+        return genre_ids
+
+    genre_ids = genre_ids_from_mood_index(mood)
+    if genre_ids:
+        count_inference_source('mood_index')
+        return genre_ids
+
+    genre_ids = infer_genre_ids(mood, gemini_prompt, deadline)
+    count_inference_source('gemini')
+    if genre_ids:
+        genre_cache.set(cache_key, genre_ids)
+        return genre_ids
+    count_fallback('drama_genres')
+    return [str(TMDB_GENRES.get("drama", 18))]
+
+def find_movies(genre_ids, deadline, fallback=True):
+    """
+    Candidate movies for the genre IDs: the pre-warmed pool, then earlier discover pages,
+    then live TMDB discovery, then popular movies. Raises if nothing could be found,
+    DeadlineExceeded if the deadline ran out first. fallback=False raises instead of
+    returning popular movies (the precompute job stores only a mood's own candidates).
+    """
+    logger.info(f"Using TMDB genre IDs: {genre_ids}")
+    params = build_discover_params(genre_ids)
+
+    pages = DiscoverPages(genre_ids)
+    movies = candidate_pool.lookup([int(g) for g in genre_ids])
+    if movies:
+        logger.info(f"Candidate pool returned {len(movies)} movies for genres: {genre_ids}")
+    else:
+        movies = list(discover_cache.get(pages.key) or [])
+        if movies:
+            logger.info(f"Discover cache returned {len(movies)} movies for genres: {genre_ids}")
+    if not movies:
+        # Pool miss: fetch the first pages concurrently and move on as soon as one of them has
+        # results; the remaining pages keep loading in the background and are cached for the next request.
+        page_futures = [
+            tmdb_executor.submit(fetch_discover_page, params, page_num, deadline=deadline)
+            for page_num in range(1, DISCOVER_PAGES + 1)
+        ]
+        for future in page_futures:
+            future.add_done_callback(pages.store)
+        try:
+            for future in as_completed(page_futures, timeout=deadline.remaining()):
+                try:
+                    movies.extend(future.result())
+                except (requests.exceptions.RequestException, Overloaded) as e:
+                    logger.error(f"Error fetching movies from TMDB: {e}")
+                if movies:
+                    break
+        except FutureTimeout:
+            logger.error(f"Request deadline reached while fetching discover pages for genres: {genre_ids}")
 
-    movies = all_movies
-    logger.info(f"TMDB search returned {len(movies)} movies across multiple pages for genres: {genre_ids}")
+        logger.info(f"TMDB search returned {len(movies)} movies from the first page(s) to arrive for genres: {genre_ids}")
 
+    if not movies and not fallback:
+        raise ValueError(f"No movies found for genres: {genre_ids}.")
     if not movies:
         logger.warning(f"No movies found for inferred genres: {genre_ids} across multiple pages. Trying popular movies as a last resort.")
-        params_fallback_popular = {
-            "api_key": TMDB_API_KEY,
-            "language": "en-US",
-            "sort_by": "popularity.desc",
-            "include_adult": False,
-            "include_video": False,
-            "page": 1
-        }
+        deadline.check('popular_fallback')
+        count_fallback('popular_movies')
         try:
-            response_fallback_popular = requests.get("https://api.themoviedb.org/3/discover/movie", params=params_fallback_popular)
+            response_fallback_popular = tmdb_client.get(
+                TMDB_DISCOVER_URL, params=build_popular_params(), endpoint="discover_popular", deadline=deadline,
+            )
             response_fallback_popular.raise_for_status()
-            data_fallback_popular = response_fallback_popular.json()
-            movies = data_fallback_popular.get("results", [])
+            movies = discover_results(response_fallback_popular.json())
             logger.info(f"Fallback popular search returned {len(movies)} movies.")
         except requests.exceptions.RequestException as e:
             logger.error(f"Error during popular movies fallback: {e}")
             movies = []
 
         if not movies:
+            if deadline.expired():
+                raise DeadlineExceeded("Request deadline exceeded during the movie search.")
             raise ValueError("Could not find any movies with discover or popular fallback.")
 
-    # --- Step 3: Pick a movie and get details ---
+    return movies
+
+def pick_movie(movies, deadline):
+    """Picks a random candidate and formats it with its details."""
     selected_movie = random.choice(movies) if movies else None
 
     if not selected_movie:
         raise ValueError("No movie could be selected after TMDB search or fallback.")
 
-    movie_title = selected_movie.get("title")
-    poster_path = selected_movie.get("poster_path")
-    overview = selected_movie.get("overview")
-    movie_id = selected_movie.get("id") # Get the movie ID for detailed lookup - THIS WAS MISPLACED BEFORE!
-
-    # NEW: Fetch additional movie details using the /movie/{movie_id} endpoint
-    release_year = "N/A"
-    runtime = "N/A"
-    vote_average = "N/A"
-    certification = "N/A" # MPAA Rating
-
-    if movie_id: # Only attempt detail fetch if movie_id is available
-        movie_details_url = f"https://api.themoviedb.org/3/movie/{movie_id}"
-        details_params = {
-            "api_key": TMDB_API_KEY,
-            "language": "en-US",
-            "append_to_response": "release_dates" # To get certification info
-        }
-        try:
-            details_response = requests.get(movie_details_url, params=details_params)
-            details_response.raise_for_status()
-            movie_details = details_response.json()
-            
-            # Extracting details
-            release_date_full = movie_details.get("release_date")
-            if release_date_full:
-                release_year = release_date_full.split('-')[0] # Get just the year
-
-            runtime_minutes = movie_details.get("runtime")
-            if runtime_minutes is not None: # Check for None explicitly
-                hours = runtime_minutes // 60
-                minutes = runtime_minutes % 60
-                runtime = f"{hours}h {minutes}min"
-            
-            vote_avg = movie_details.get("vote_average")
-            if vote_avg is not None: # Check for None explicitly
-                vote_average = f"{vote_avg:.1f}/10" # Format to one decimal place
-
-            # Extracting certification (MPAA rating) from release_dates
-            release_dates_data = movie_details.get("release_dates", {}).get("results", [])
-            for rd in release_dates_data:
-                if rd.get("iso_3166_1") == "US": # Look for US certification
-                    for c in rd.get("release_dates", []):
-                        if c.get("certification"):
-                            certification = c.get("certification")
-                            break # Found certification, break inner loop
-                if certification != "N/A": # If US certification found, break outer loop
-                    break
-            
-            logger.info(f"Fetched movie details: Year={release_year}, Runtime={runtime}, Vote={vote_average}, Cert={certification}")
+    movie_id = selected_movie.get("id")
+    details = details_flight.do(movie_id, lambda: fetch_movie_details(movie_id, deadline)) if movie_id else dict(EMPTY_MOVIE_DETAILS)
+    return format_movie(selected_movie, details)
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error fetching detailed movie info for ID {movie_id}: {e}")
-        except Exception as e:
-            logger.error(f"Error processing detailed movie info for ID {movie_id}: {e}")
+def get_movie_recommendation(mood: str, deadline=None):
+    """
+    Recommends a movie based on the user's mood using TMDB and Gemini.
+    Every stage works within deadline (REQUEST_DEADLINE_SECONDS by default).
+    Handles internal errors and raises specific exceptions if necessary.
+    """
+    deadline = deadline or Deadline(REQUEST_DEADLINE_SECONDS)
+    logger.info(f"Entering get_movie_recommendation for mood: '{mood}'")
 
-    movie_poster_url = f"{TMDB_IMAGE_BASE_URL}{poster_path}" if poster_path else "https://via.placeholder.com/300x450"
-    movie_description = overview
-    movie_source_url = f"https://www.themoviedb.org/movie/{movie_id}" # Ensure this uses movie_id from the detailed fetch
+    snapshot_movies = movies_from_snapshot(mood)
+    if snapshot_movies:
+        return random.choice(snapshot_movies)
 
-    logger.info(f"Selected Movie: {movie_title}, Poster URL: {movie_poster_url}")
-    return {
-        "movieTitle": movie_title,
-        "moviePosterUrl": movie_poster_url,
-        "movieDescription": movie_description,
-        "movieSourceUrl": movie_source_url,
-        "movieYear": release_year,        
-        "movieRuntime": runtime,          
-        "movieRating": certification,     
-        "movieVoteAverage": vote_average  
-    }
+    # --- Steps 1 and 2: Infer TMDB genres with Gemini, then discover movies for them ---
+    # Concurrent requests for the same mood share both steps.
+    movies = movie_flight.do(make_key(mood), lambda: find_movies(resolve_genre_ids(mood, build_genre_prompt(mood), deadline), deadline))
 
-# --- Flask Route ---
+    # --- Step 3: Pick a movie and get details ---
+    return pick_movie(movies, deadline)
+
+# --- Batch Recommendations ---
+# Bulk callers send many moods at once. Distinct moods are resolved with one Gemini prompt
+# per BATCH_INFERENCE_CHUNK moods, and one candidate search runs per mood.
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+def build_batch_genre_prompt(numbered_moods):
+    """Builds one Gemini prompt covering several moods. numbered_moods maps a request number to its mood."""
+    mood_lines = [f'{number}. The user is feeling: "{mood}".' for number, mood in numbered_moods.items()]
+    return GENRE_BATCH_PROMPT.render(
+        requests="\n".join(mood_lines), response_schema=numbered_lists_schema(list(numbered_moods), GENRES_SCHEMA),
+    )
+
+def infer_genre_ids_batch(moods, deadline):
+    """
+    Asks Gemini for genres for several moods in one call.
+    Returns {mood: genre_ids}; moods without any valid genre (or not answered in time) are left out.
+    """
+    numbered_moods = {str(number): mood for number, mood in enumerate(moods, start=1)}
+    try:
+        with span('gemini_inference_batch'):
+            gemini_response = call_with_deadline(
+                gemini_executor, deadline, 'gemini_inference_batch',
+                build_batch_genre_prompt(numbered_moods).generate, breaker=gemini_breaker, limiter=gemini_limiter,
+            )
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error using Gemini for batch mood inference: {e}")
+        return {}
+    with span('parse'):
+        genre_names_by_number = parse_numbered_lists(GENRE_BATCH_PROMPT.name, gemini_response, numbered_moods, GENRES_MAX, allowed=TMDB_GENRES)
+    genre_ids_by_mood = {}
+    for number, mood in numbered_moods.items():
+        genre_ids = genre_names_to_ids(genre_names_by_number.get(number, []))
+        if genre_ids:
+            genre_ids_by_mood[mood] = genre_ids
+    return genre_ids_by_mood
+
+def resolve_genre_ids_batch(moods, deadline, fallback=True):
+    """
+    Genre IDs for each distinct mood: inference cache first, then batched Gemini calls.
+    Moods nothing was found for get Drama, or are left out if fallback is False.
+    """
+    genre_ids_by_mood = {}
+    uncached = []
+    for mood in moods:
+        genre_ids = genre_cache.get(make_key(mood))
+        if genre_ids:
+            count_inference_source('cache')
+        else:
+            genre_ids = genre_ids_from_mood_index(mood)
+            if genre_ids:
+                count_inference_source('mood_index')
+        if genre_ids:
+            genre_ids_by_mood[mood] = genre_ids
+        else:
+            uncached.append(mood)
+
+    chunks = chunked(uncached, BATCH_INFERENCE_CHUNK)
+    for inferred in batch_executor.map(lambda chunk: infer_genre_ids_batch(chunk, deadline), chunks):
+        for mood, genre_ids in inferred.items():
+            genre_cache.set(make_key(mood), genre_ids)
+            genre_ids_by_mood[mood] = genre_ids
+
+    logger.info(f"Batch genres: {len(moods) - len(uncached)} cached or matched locally, {len(uncached)} inferred in {len(chunks)} Gemini call(s).")
+    for mood in uncached:
+        count_inference_source('gemini')
+        if mood not in genre_ids_by_mood and fallback:
+            count_fallback('drama_genres')
+    if not fallback:
+        return genre_ids_by_mood, len(chunks)
+    default_genre_ids = [str(TMDB_GENRES.get("drama", 18))]
+    return {mood: genre_ids_by_mood.get(mood) or default_genre_ids for mood in moods}, len(chunks)
+
+def get_movie_recommendations_batch(items):
+    """
+    Recommends a movie for every {"mood"} item. Identical moods share one inference and
+    one candidate search but each gets its own random pick. Failures are reported per item.
+    The whole batch works within BATCH_DEADLINE_SECONDS.
+    """
+    deadline = Deadline(BATCH_DEADLINE_SECONDS)
+    results = [{"mood": item.get("mood")} for item in items]
+    errors = item_errors(items)
+    moods = list(dict.fromkeys(normalize_mood(result["mood"]) for i, result in enumerate(results) if i not in errors))
+    snapshot_movies = {mood: movies_from_snapshot(mood) for mood in moods}
+    snapshot_movies = {mood: movies for mood, movies in snapshot_movies.items() if movies}
+    genre_ids_by_mood, gemini_calls = resolve_genre_ids_batch([mood for mood in moods if mood not in snapshot_movies], deadline)
+
+    def search(mood):
+        return movie_flight.do(make_key(mood), lambda: find_movies(genre_ids_by_mood[mood], deadline))
+
+    searches = {mood: batch_executor.submit(search, mood) for mood in genre_ids_by_mood}
+
+    def pick(result):
+        mood = normalize_mood(result["mood"])
+        if mood in snapshot_movies:
+            return random.choice(snapshot_movies[mood])
+        return pick_movie(searches[mood].result(), deadline)
+
+    picks = {i: batch_executor.submit(pick, result) for i, result in enumerate(results) if i not in errors}
+    for i, result in enumerate(results):
+        if i in errors:
+            result["error"] = errors[i]
+            continue
+        try:
+            result["movie"] = picks[i].result()
+        except Exception as e:
+            result["error"] = str(e)
+
+    return {"results": results, "distinctRequests": len(moods), "geminiCalls": gemini_calls}
+
+# --- Flask Routes ---
 @app.route('/recommend_movie', methods=['POST'])
 def recommend_movie():
     """
@@ -271,14 +728,68 @@ def recommend_movie():
             return jsonify({"error": "Missing 'mood' in request body"}), 400
 
         logger.info(f"Received request for mood: {mood} in movie agent")
-        movie_recommendation = get_movie_recommendation(mood) # Call the core logic
-        logger.info(f"DEBUG MOVIE_AGENT_RESPONSE: {json.dumps(movie_recommendation, indent=2)}")
-        return jsonify(movie_recommendation), 200
-
+        deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER), REQUEST_DEADLINE_SECONDS)
+        movie_recommendation = get_movie_recommendation(mood, deadline) # Call the core logic
+        with span('serialize'):
+            return jsonify(movie_recommendation), 200
+
+    except DeadlineExceeded as e:
+        logger.warning(f"Deadline exceeded in recommend_movie endpoint: {e}")
+        return jsonify({"error": str(e)}), 504
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_movie request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
     except Exception as e:
         logger.error(f"Unhandled error in recommend_movie endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/recommend_movie_batch', methods=['POST'])
+def recommend_movie_batch():
+    """
+    Batch HTTP endpoint for the Movie Agent.
+    Expects {"items": [...]} where each item is a mood string or an object with 'mood'.
+    Returns one result per item, in order, each with either 'movie' or 'error'.
+    """
+    try:
+        data = request.get_json() or {}
+        items = read_batch_items(data)
+        logger.info(f"Received batch request with {len(items)} items in movie agent")
+        batch_results = get_movie_recommendations_batch(items)
+        with span('serialize'):
+            return jsonify(batch_results), 200
+
+    except BatchRequestError as e:
+        logger.warning(f"Rejected batch request in movie agent: {e}")
+        return jsonify({"error": str(e)}), 400
+    except Overloaded as e:
+        logger.warning(f"Shedding recommend_movie_batch request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        logger.error(f"Unhandled error in recommend_movie_batch endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def cache_report():
+    """Inference cache, candidate pool, movie details cache and mood index counters."""
+    return {
+        "inferenceCache": genre_cache.stats(),
+        "prompts": [GENRE_PROMPT.stats(), GENRE_BATCH_PROMPT.stats()],
+        "candidatePool": candidate_pool.stats(),
+        "discoverCache": discover_cache.stats(),
+        "movieDetailsCache": movie_details_cache.stats(),
+        "coalescing": [movie_flight.stats(), details_flight.stats()],
+        "moodIndex": mood_index.stats() if mood_index else None,
+        "snapshot": recommendation_snapshot.stats() if recommendation_snapshot else None,
+        "circuits": circuit_report(),
+        "admission": admission_report(),
+        "hedging": tmdb_client.stats()
+    }
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Reports inference cache, candidate pool and movie details cache counters."""
+    return jsonify(cache_report()), 200
+
 # --- Entry Point for Cloud Run ---
+# Local development only; the images serve the app through agent_common.runtime (gunicorn)
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -0,0 +1,99 @@
+"""
+Offline precompute job for the movie agent's recommendation snapshot.
+
+For every mood in the vocabulary, runs the agent's own genre inference (inference cache,
+mood index, then batched Gemini calls) and candidate search (the pre-warmed pool, then TMDB
+discovery), fetches the details of up to --candidates movies, and writes the formatted
+movies to a snapshot file. Movies whose details could not be fetched are left out rather
+than stored with placeholder details. Point the agent's RECOMMENDATION_SNAPSHOT_PATH at it
+and covered moods are served without network calls.
+
+Progress is checkpointed after every mood, so an interrupted run resumes where it left off
+when started again.
+
+Examples:
+    python precompute.py --out /data/movie_snapshot.bin
+    python precompute.py --moods moods.txt --out /data/movie_snapshot.bin --candidates 30
+
+Uses the same configuration (secrets, TMDB_*, GEMINI_*, ...) as the agent itself.
+Exits with status 2 if some moods are still missing; run it again to resume.
+"""
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import as_completed
+
+from agent_common.cache import make_key, normalize_mood
+from agent_common.resilience import Deadline
+from agent_common.snapshot import load_vocabulary, precompute_arguments, run_snapshot_job
+
+logger = logging.getLogger("precompute")
+
+DEFAULT_MOODS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mood_index_seed.json')
+# How long to wait for the candidate pool's first refresh before searching TMDB directly
+POOL_WAIT_SECONDS = 60
+
+
+def main():
+    parser = precompute_arguments(__doc__, DEFAULT_MOODS)
+    parser.add_argument("--candidates", type=int, default=20, help="Movies (with details) stored per mood.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not args.verbose:
+        for noisy in ("main", "agent_common.upstream"):
+            logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    import main as agent  # Starts the agent's startup steps (secrets, genres, candidate pool, Vertex AI, mood index)
+    agent.startup.wait()
+    waited_until = time.monotonic() + POOL_WAIT_SECONDS
+    while os.environ.get('CANDIDATE_POOL_ENABLED', 'true').lower() == 'true' and not agent.candidate_pool.ready and time.monotonic() < waited_until:
+        time.sleep(0.5)
+
+    moods = {make_key(mood): normalize_mood(mood) for mood in load_vocabulary(args.moods)}
+
+    def compute_chunk(keys):
+        deadline = Deadline(args.deadline_seconds)
+        genre_ids_by_mood, _ = agent.resolve_genre_ids_batch([moods[key] for key in keys], deadline, fallback=False)
+
+        def search(mood):
+            # No popular-movies fallback: a mood without its own candidates is retried next run
+            candidates = agent.find_movies(genre_ids_by_mood[mood], deadline, fallback=False)
+            picked = random.sample(candidates, min(args.candidates, len(candidates)))
+            movies = []
+            for movie in picked:
+                if not movie.get("id"):
+                    continue
+                # Never snapshot "N/A" details: a movie whose details weren't fetched is left out,
+                # and a mood left with none is retried next run (fetched details stay cached)
+                try:
+                    details = agent.details_flight.do(movie["id"], lambda: agent.load_movie_details(movie["id"], deadline))
+                except Exception as e:
+                    logger.warning(f"Leaving movie {movie['id']} out of '{mood}': no details ({e}).")
+                    continue
+                movies.append(agent.format_movie(movie, details))
+            return movies
+
+        searches = {agent.batch_executor.submit(search, mood): mood for mood in genre_ids_by_mood}
+        entries = {}
+        for future in as_completed(searches):
+            mood = searches[future]
+            try:
+                movies = future.result()
+            except Exception as e:
+                logger.warning(f"Movie search failed for '{mood}': {e}")
+                continue
+            if movies:
+                entries[make_key(mood)] = {"genreIds": genre_ids_by_mood[mood], "movies": movies}
+        return entries
+
+    return run_snapshot_job(
+        args, 'movie_recommendations', list(moods), compute_chunk,
+        metadata={"agent": "movie-agent", "candidatesPerMood": args.candidates},
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
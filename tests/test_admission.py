@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from agent_common.admission import AdmissionLimiter, Overloaded
+
+
+def make_limiter(max_concurrent=1, max_queue=1, queue_timeout=1.0, retry_after=2.5):
+    return AdmissionLimiter("test", max_concurrent, max_queue, queue_timeout, retry_after)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.001)
+
+
+def test_full_queue_is_shed_with_retry_after():
+    limiter = make_limiter()
+    limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    wait_for(lambda: limiter.stats()["queued"] == 1)
+
+    with pytest.raises(Overloaded) as shed:
+        limiter.acquire()
+    assert "queue full" in str(shed.value)
+    assert shed.value.retry_after == 2.5
+    assert shed.value.retry_after_header() == "3"
+    with pytest.raises(Overloaded):
+        limiter.check()
+
+    limiter.release()  # Handed straight to the queued call
+    waiter.join(2)
+    assert limiter.stats()["inFlight"] == 1
+    assert limiter.stats()["queued"] == 0
+    assert limiter.admitted == 2
+    assert limiter.rejected == 2
+
+
+def test_queue_timeout_is_shed():
+    limiter = make_limiter(queue_timeout=0.02)
+    limiter.acquire()
+    started = time.monotonic()
+    with pytest.raises(Overloaded) as shed:
+        limiter.acquire(timeout=5)  # The limiter's own queue timeout is shorter
+    assert time.monotonic() - started < 1
+    assert "queue timeout" in str(shed.value)
+    assert limiter.stats()["queued"] == 0
+
+
+def test_retry_after_header_is_at_least_one_second():
+    assert Overloaded("busy", 0.2).retry_after_header() == "1"
+
+
+def test_admit_releases_the_slot():
+    limiter = make_limiter(max_queue=0)
+    with limiter.admit():
+        with pytest.raises(Overloaded):
+            limiter.acquire()
+    with limiter.admit():
+        pass
+    assert limiter.stats()["inFlight"] == 0
+
+
+def test_async_waiter_gets_the_released_slot_and_cancellation_frees_it():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire_async()
+        queued = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded):
+            await limiter.acquire_async()
+        limiter.release()
+        await queued
+        in_flight_after_handoff = limiter.stats()["inFlight"]
+
+        cancelled = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return limiter, in_flight_after_handoff
+
+    limiter, in_flight_after_handoff = asyncio.run(scenario())
+    assert in_flight_after_handoff == 1
+    assert limiter.stats()["queued"] == 0
+    assert limiter.stats()["inFlight"] == 1
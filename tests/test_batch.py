@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+from agent_common.batch import BATCH_MAX_ITEMS, BatchRequestError, chunked, item_errors, read_batch_items
+from agent_common.prompts import parse_numbered_lists
+
+
+def gemini_response(text):
+    part = SimpleNamespace(text=text)
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=None)])
+
+
+def test_strings_and_objects_get_the_defaults():
+    items = read_batch_items({"items": ["happy", {"mood": "sad", "mealContext": "lunch"}]}, defaults={"mealContext": "dinner"})
+    assert items == [{"mealContext": "dinner", "mood": "happy"}, {"mealContext": "lunch", "mood": "sad"}]
+    assert item_errors(items) == {}
+
+
+@pytest.mark.parametrize("body", [None, [], {}, {"items": []}, {"items": "happy"}])
+def test_body_without_items_is_rejected(body):
+    with pytest.raises(BatchRequestError, match="non-empty 'items'"):
+        read_batch_items(body)
+
+
+def test_too_many_items_is_rejected():
+    with pytest.raises(BatchRequestError, match="Too many items"):
+        read_batch_items({"items": ["happy"] * (BATCH_MAX_ITEMS + 1)})
+
+
+def test_badly_typed_default_fails_the_batch():
+    with pytest.raises(BatchRequestError, match="'mealContext' must be a string"):
+        read_batch_items({"items": ["happy"]}, defaults={"mealContext": ["dinner"]})
+
+
+def test_bad_items_fail_on_their_own():
+    items = read_batch_items(
+        {"items": ["happy", 42, {"mood": ["sad"]}, {"mood": "calm", "mealContext": 3}, {"mealContext": "lunch"}, ""]},
+        defaults={"mealContext": "dinner"},
+    )
+    assert item_errors(items) == {
+        1: "Each item must be a mood string or an object",
+        2: "'mood' must be a string",
+        3: "'mealContext' must be a string",
+        4: "Missing 'mood'",
+        5: "Missing 'mood'",
+    }
+
+
+def test_fields_without_a_default_are_not_checked():
+    items = read_batch_items({"items": [{"mood": "happy", "mealContext": ["ignored"]}]})
+    assert item_errors(items) == {}
+
+
+def test_chunked():
+    assert chunked(list(range(5)), 2) == [[0, 1], [2, 3], [4]]
+    assert chunked([], 3) == []
+
+
+def test_numbered_answer_is_split_per_request():
+    response = gemini_response('{"1": ["Pasta", "soup"], " 2 ": ["salad"], "3": "not a list", "9": ["extra"]}')
+    assert parse_numbered_lists("test_batch", response, ["1", "2", "3"], max_items=5) == {"1": ["Pasta", "soup"], "2": ["salad"]}
+
+
+def test_numbered_answer_checks_allowed_values():
+    response = gemini_response('{"1": ["Comedy", "western"], "2": ["Drama"]}')
+    parsed = parse_numbered_lists("test_batch", response, ["1", "2"], max_items=3, allowed={"comedy", "drama"})
+    assert parsed == {"1": ["comedy"], "2": ["drama"]}
+
+
+def test_numbered_answer_that_is_not_an_object_is_empty():
+    assert parse_numbered_lists("test_batch", gemini_response('["pasta"]'), ["1"], max_items=3) == {}
+    assert parse_numbered_lists("test_batch", gemini_response("pasta"), ["1"], max_items=3) == {}
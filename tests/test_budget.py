@@ -0,0 +1,45 @@
+import time
+
+from agent_common.budget import TokenBucket
+
+
+def test_spent_budget_denies_without_blocking():
+    bucket = TokenBucket(capacity=2, refill_per_second=0)
+    assert bucket.try_acquire(1.5)
+    assert not bucket.try_acquire(1)
+    assert bucket.try_acquire(0.5)
+    assert bucket.stats()["granted"] == 2
+    assert bucket.stats()["denied"] == 1
+
+
+def test_refills_up_to_capacity():
+    bucket = TokenBucket(capacity=10, refill_per_second=1000)
+    assert bucket.try_acquire(10)
+    time.sleep(0.02)
+    assert 0 < bucket.available() <= 10
+    time.sleep(0.02)
+    assert bucket.available() == 10
+
+
+def test_set_available_resyncs_within_capacity():
+    bucket = TokenBucket(capacity=10, refill_per_second=0)
+    bucket.set_available(3)
+    assert bucket.available() == 3
+    bucket.set_available(50)
+    assert bucket.available() == 10
+    bucket.set_available(-1)
+    assert bucket.available() == 0
+
+
+def test_exhaust_until_freezes_refill_until_the_reset():
+    bucket = TokenBucket(capacity=10, refill_per_second=1000)
+    bucket.exhaust_until(time.time() + 60)
+    time.sleep(0.01)
+    assert bucket.available() == 0
+    assert not bucket.try_acquire(1)
+    assert bucket.stats()["exhaustedUntil"] is not None
+
+    bucket.exhaust_until(time.time() - 1)  # Reset time already passed
+    time.sleep(0.01)
+    assert bucket.available() > 0
+    assert bucket.stats()["exhaustedUntil"] is None
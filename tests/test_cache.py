@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from agent_common.cache import InferenceCache, make_key, normalize_mood
+
+
+def test_keys_normalize_case_and_whitespace():
+    assert normalize_mood("  Stressed   OUT ") == "stressed out"
+    assert normalize_mood(None) == ""
+    assert make_key("Happy ", "DINNER") == make_key("happy", "dinner") == "happy|dinner"
+
+
+def test_hit_and_miss_counters():
+    cache = InferenceCache("test", max_entries=4, ttl_seconds=60)
+    assert cache.get("happy") is None
+    cache.set("happy", ["pasta"])
+    assert cache.get("happy") == ["pasta"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    assert stats["hitRatio"] == 0.5
+    assert not stats["sharedStore"]
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = InferenceCache("test", max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # b is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["size"] == 2
+
+
+def test_entries_expire_after_the_ttl():
+    cache = InferenceCache("test", max_entries=4, ttl_seconds=0.02)
+    cache.set("happy", ["pasta"])
+    assert cache.get("happy") == ["pasta"]
+    time.sleep(0.03)
+    assert cache.get("happy") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_setting_again_refreshes_value_and_ttl():
+    cache = InferenceCache("test", max_entries=4, ttl_seconds=0.05)
+    cache.set("happy", ["pasta"])
+    time.sleep(0.03)
+    cache.set("happy", ["pizza"])
+    time.sleep(0.03)
+    assert cache.get("happy") == ["pizza"]
+
+
+def test_async_get_and_set_without_shared_store():
+    async def scenario():
+        cache = InferenceCache("test", max_entries=4, ttl_seconds=60)
+        missed = await cache.get_async("happy")
+        await cache.set_async("happy", ["pasta"])
+        return missed, await cache.get_async("happy")
+
+    assert asyncio.run(scenario()) == (None, ["pasta"])
+
+
+def test_unreachable_redis_falls_back_to_local_only():
+    cache = InferenceCache("test", redis_url="redis://127.0.0.1:1/0")
+    assert not cache.shared
+    cache.set("happy", ["pasta"])
+    assert cache.get("happy") == ["pasta"]
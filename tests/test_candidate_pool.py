@@ -0,0 +1,69 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "movie-agent"))
+from candidate_pool import CandidatePool, compact_movie  # noqa: E402
+
+COMEDY, DRAMA, HORROR = 35, 18, 27
+
+
+def movie(movie_id, *genres):
+    return {"id": movie_id, "title": f"Movie {movie_id}", "poster_path": None, "overview": "", "genre_ids": list(genres), "popularity": 1.0}
+
+
+# Pages per queried genre: ten comedy-dramas, five comedies, five dramas and one horror movie
+PAGES = {
+    COMEDY: [movie(i, COMEDY, DRAMA) for i in range(10)] + [movie(i, COMEDY) for i in range(10, 15)],
+    DRAMA: [movie(i, COMEDY, DRAMA) for i in range(10)] + [movie(i, DRAMA) for i in range(20, 25)],
+    HORROR: [movie(30, HORROR)],
+}
+
+
+@pytest.fixture
+def pool():
+    executor = ThreadPoolExecutor(max_workers=2)
+    pool = CandidatePool(lambda genre_id, page_num: PAGES[genre_id] if page_num == 1 else [], executor, pages_per_genre=2, min_candidates=10)
+    assert pool.refresh([COMEDY, DRAMA, HORROR])
+    yield pool
+    executor.shutdown()
+
+
+def ids(movies):
+    return sorted(m["id"] for m in movies)
+
+
+def test_genre_set_prefers_movies_matching_every_genre(pool):
+    assert ids(pool.lookup([COMEDY, DRAMA])) == list(range(10))
+
+
+def test_single_genre_includes_movies_indexed_from_other_queries(pool):
+    assert ids(pool.lookup([COMEDY])) == list(range(15))
+
+
+def test_relaxes_towards_the_union_until_there_are_enough(pool):
+    # No movie is both horror and comedy; the union of the two has 16
+    assert ids(pool.lookup([COMEDY, HORROR])) == list(range(15)) + [30]
+
+
+def test_too_few_candidates_is_a_miss(pool):
+    assert pool.lookup([HORROR]) == []
+    assert pool.lookup([99]) == []
+    assert (pool.hits, pool.misses) == (0, 2)
+
+
+def test_records_are_compact(pool):
+    record = pool.lookup([COMEDY, DRAMA])[0]
+    assert set(record) == {"id", "title", "poster_path", "overview"}
+    assert compact_movie(movie(1, COMEDY)) == {"id": 1, "title": "Movie 1", "poster_path": None, "overview": ""}
+
+
+def test_failed_refresh_keeps_the_previous_pool(pool):
+    def failing(genre_id, page_num):
+        raise RuntimeError("TMDB down")
+
+    pool._fetch_page = failing
+    assert not pool.refresh([COMEDY, DRAMA])
+    assert ids(pool.lookup([COMEDY, DRAMA])) == list(range(10))
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from agent_common.mood_index import MoodIndex, mood_words
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEEDS = {agent: os.path.join(ROOT, agent, "mood_index_seed.json") for agent in ("meal-agent", "movie-agent")}
+
+
+@pytest.fixture(params=sorted(SEEDS))
+def index(request):
+    return MoodIndex.from_seed_file(request.param, SEEDS[request.param])
+
+
+def test_mood_words_drop_filler_and_punctuation():
+    assert mood_words("I'm feeling SO stressed out today!!") == ["stressed"]
+    assert mood_words("not happy") == ["not", "happy"]
+
+
+@pytest.mark.parametrize("mood, known", [
+    ("stressed out", "stressed"),
+    ("happyy", "happy"),
+    ("hapy", "happy"),
+    ("stresed", "stressed"),
+    ("anxiousss", "anxious"),
+    ("relaxd", "relaxed"),
+    ("feeling kinda romantik", "romantic"),
+    ("nostalgic vibes", "nostalgic"),
+    ("Feeling so COZY tonight", "cozy"),
+])
+def test_near_misses_resolve_locally(index, mood, known):
+    match = index.lookup(mood)
+    assert match is not None
+    value, score, matched_mood = match
+    assert matched_mood == known
+    assert score >= index.min_score
+
+
+@pytest.mark.parametrize("mood", ["not happy", "never sad", "not stressed out", "dont feel tired"])
+def test_negated_moods_do_not_match_their_positive_seed(index, mood):
+    assert index.lookup(mood) is None
+
+
+@pytest.mark.parametrize("mood", ["sadistic", "happy and sad", "happy birthday to my mom", "hopeful but scared", "pizza", ""])
+def test_different_moods_miss(index, mood):
+    assert index.lookup(mood) is None
+
+
+def test_negated_seed_moods_still_match():
+    index = MoodIndex("test", {"happy": "up", "not hungry": "light"})
+    assert index.lookup("not hungryy")[0] == "light"
+    assert index.lookup("hungry") is None
+
+
+def test_hits_and_misses_are_counted():
+    index = MoodIndex("test", {"happy": "up"})
+    index.lookup("happy")
+    index.lookup("gloomy")
+    assert index.stats() == {"name": "test", "moods": 1, "minScore": 0.7, "hits": 1, "misses": 1, "hitRatio": 0.5}
+
+
+def test_empty_index_misses():
+    assert MoodIndex("test", {}).lookup("happy") is None
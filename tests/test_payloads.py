@@ -0,0 +1,106 @@
+import asyncio
+import gzip
+
+import pytest
+from flask import Flask, Response, jsonify
+from werkzeug.http import parse_accept_header
+
+from agent_common import payloads
+from agent_common.payloads import choose_encoding, install_async_payload_handling, install_payload_handling
+
+BIG = {"mealDescription": "Slow-cooked and comforting. " * 100}
+SMALL = {"ok": True}
+
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route("/big", methods=["GET", "POST"])
+    def big():
+        return jsonify(BIG)
+
+    @app.route("/small", methods=["POST"])
+    def small():
+        return jsonify(SMALL)
+
+    @app.route("/stream")
+    def stream():
+        return Response((chunk for chunk in ["event: token\n", "data: {}\n\n"] * 200), mimetype="text/event-stream")
+
+    @app.route("/cached")
+    def cached():
+        response = jsonify(BIG)
+        response.headers["Cache-Control"] = "max-age=60"
+        return response
+
+    install_payload_handling(app, "test-agent")
+    return app.test_client()
+
+
+@pytest.fixture
+def client():
+    return make_app()
+
+
+def test_choose_encoding_follows_client_preference():
+    assert choose_encoding(parse_accept_header("gzip, br")) == "br"
+    assert choose_encoding(parse_accept_header("br;q=0.5, gzip")) == "gzip"
+    assert choose_encoding(parse_accept_header("identity")) is None
+
+
+def test_large_json_is_compressed(client):
+    response = client.post("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.get_data()) == make_app().post("/big").get_data()
+
+
+def test_brotli_is_preferred_when_available(client):
+    response = client.post("/big", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == ("br" if payloads.brotli else "gzip")
+
+
+def test_small_and_unaccepted_bodies_go_out_as_is(client):
+    small = client.post("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+    assert "Accept-Encoding" in small.headers["Vary"]
+    assert small.get_json() == SMALL
+    assert "Content-Encoding" not in client.post("/big").headers
+
+
+def test_streamed_responses_are_untouched(client):
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert "Cache-Control" not in response.headers
+
+
+def test_responses_are_not_stored(client):
+    assert client.post("/big").headers["Cache-Control"] == "no-store"
+    response = client.get("/big")
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in response.headers
+    assert client.get("/big", headers={"If-None-Match": "*"}).status_code == 200
+
+
+def test_view_cache_control_is_kept(client):
+    assert client.get("/cached").headers["Cache-Control"] == "max-age=60"
+
+
+def test_async_app_compresses_too():
+    from quart import Quart, jsonify as quart_jsonify
+
+    app = Quart(__name__)
+
+    @app.route("/big", methods=["POST"])
+    async def big():
+        return quart_jsonify(BIG)
+
+    install_async_payload_handling(app, "test-agent")
+
+    async def run():
+        return await app.test_client().post("/big", headers={"Accept-Encoding": "gzip"})
+
+    response = asyncio.run(run())
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Cache-Control"] == "no-store"
+    assert gzip.decompress(asyncio.run(response.get_data())) == make_app().post("/big").get_data()
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+from agent_common.persistent_cache import PersistentCache
+
+
+def test_values_round_trip_and_survive_reopening(tmp_path):
+    path = str(tmp_path / "nested" / "details.sqlite3")
+    cache = PersistentCache("test", path)
+    assert cache.get(603) is None
+    cache.set(603, {"movieYear": "1999", "movieRuntime": "136 min"})
+    assert cache.get(603) == {"movieYear": "1999", "movieRuntime": "136 min"}
+    assert cache.get("603") == cache.get(603)  # Keys are stored as text
+
+    reopened = PersistentCache("test", path)
+    assert reopened.get(603) == {"movieYear": "1999", "movieRuntime": "136 min"}
+    assert reopened.stats()["size"] == 1
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = PersistentCache("test", str(tmp_path / "details.sqlite3"), ttl_seconds=-1)
+    cache.set(1, {"movieYear": "2000"})
+    assert cache.get(1) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_set_replaces_the_value(tmp_path):
+    cache = PersistentCache("test", str(tmp_path / "details.sqlite3"))
+    cache.set(1, {"movieYear": "2000"})
+    cache.set(1, {"movieYear": "2001"})
+    assert cache.get(1) == {"movieYear": "2001"}
+    assert cache.stats()["size"] == 1
+
+
+def test_threads_share_the_file(tmp_path):
+    cache = PersistentCache("test", str(tmp_path / "details.sqlite3"))
+    threads = [threading.Thread(target=cache.set, args=(i, {"n": i})) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [cache.get(i) for i in range(8)] == [{"n": i} for i in range(8)]
+    assert cache.stats()["errors"] == 0
+
+
+def test_async_accessors(tmp_path):
+    cache = PersistentCache("test", str(tmp_path / "details.sqlite3"))
+
+    async def scenario():
+        await cache.set_async(7, {"movieYear": "2007"})
+        return await cache.get_async(7)
+
+    assert asyncio.run(scenario()) == {"movieYear": "2007"}
+
+
+def test_unreadable_file_is_a_logged_miss(tmp_path):
+    cache = PersistentCache("test", str(tmp_path / "details.sqlite3"))
+    cache._conn().execute("DROP TABLE cache")
+    assert cache.get(1) is None
+    cache.set(1, {"movieYear": "2000"})
+    assert cache.stats()["errors"] == 2
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+from agent_common.metrics import registry
+from agent_common.prompts import (
+    PromptTemplate, clip, compact, numbered_lists_schema, parse_string_list, prompt_text,
+    response_json, string_list_schema,
+)
+
+
+def gemini_response(text, finish_reason=None):
+    part = SimpleNamespace(text=text)
+    reason = SimpleNamespace(name=finish_reason) if finish_reason else None
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=reason)])
+
+
+# --- Prompt Inputs ---
+def test_prompt_text_strips_html_and_caps_at_a_word_boundary():
+    assert prompt_text("<b>Rich</b> &amp; <a href='x'>creamy</a>\n soup") == "Rich & creamy soup"
+    assert clip("one two three four", 12) == "one two…"
+    assert clip("short", 12) == "short"
+
+
+def test_compact_removes_indentation_and_blank_runs():
+    assert compact("""
+        Line one.
+
+
+        Line two.   
+    """) == "Line one.\n\nLine two."
+
+
+def test_template_renders_only_the_request_part():
+    template = PromptTemplate("test", "   Be brief.\n", "Mood: {mood}")
+    prompt = template.render(mood="happy")
+    assert prompt.text == "Mood: happy"
+    assert template.instructions == "Be brief."
+    assert prompt.name == "test"
+
+
+# --- Structured Output ---
+def test_schemas():
+    assert string_list_schema(3) == {"type": "array", "items": {"type": "string"}, "min_items": 1, "max_items": 3}
+    assert string_list_schema(2, allowed={"drama", "comedy"})["items"]["enum"] == ["comedy", "drama"]
+    schema = numbered_lists_schema(["1", "2"], string_list_schema(3))
+    assert schema["required"] == ["1", "2"]
+    assert set(schema["properties"]) == {"1", "2"}
+
+
+def test_string_list_is_cleaned_deduplicated_and_capped():
+    response = gemini_response('["Pasta", " pasta ", "Soup", "", 3, "Curry", "Stew"]')
+    assert parse_string_list("test_list", response, max_items=3) == ["Pasta", "pasta", "Soup"]
+
+
+def test_allowed_values_are_lowercased_and_enforced():
+    response = gemini_response('["Comedy", "Western", "comedy", "Drama"]')
+    assert parse_string_list("test_genres", response, max_items=3, allowed={"comedy", "drama"}) == ["comedy", "drama"]
+
+
+def test_fenced_json_is_accepted():
+    assert response_json("test_fence", gemini_response('```json\n["pasta"]\n```')) == ["pasta"]
+    assert response_json("test_fence", gemini_response('```\n{"1": ["pasta"]}\n```')) == {"1": ["pasta"]}
+
+
+def test_unusable_responses_are_empty_and_counted():
+    assert parse_string_list("test_bad", gemini_response("pasta, soup"), max_items=3) == []
+    assert parse_string_list("test_bad", gemini_response('["pas'), max_items=3) == []
+    assert parse_string_list("test_bad", gemini_response('["pas', finish_reason="MAX_TOKENS"), max_items=3) == []
+    assert parse_string_list("test_bad", gemini_response('{"keywords": ["pasta"]}'), max_items=3) == []
+    assert parse_string_list("test_bad", SimpleNamespace(candidates=[]), max_items=3) == []
+
+    exposition = registry.render()
+    for outcome in ("invalid", "truncated", "no_values", "empty"):
+        assert f'prompt="test_bad",outcome="{outcome}"' in exposition
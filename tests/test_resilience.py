@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from agent_common.resilience import CircuitBreaker, Deadline, DeadlineExceeded
+
+
+# --- Deadline ---
+def test_deadline_remaining_and_expiry():
+    deadline = Deadline(5)
+    assert 4.9 < deadline.remaining() <= 5
+    assert not deadline.expired()
+    assert Deadline(0).expired()
+    assert Deadline(-1).remaining() == 0
+
+
+def test_child_deadline_never_outlives_its_parent():
+    parent = Deadline(1)
+    assert parent.within(10).expires_at == parent.expires_at
+    assert parent.within(0.1).remaining() <= 0.1
+
+
+def test_timeout_is_capped_at_the_remaining_time():
+    deadline = Deadline(2)
+    assert deadline.timeout(1) == 1
+    assert deadline.timeout(30) <= 2
+    connect, read = deadline.timeout((3.05, 30))
+    assert connect <= 2 and read <= 2
+    assert Deadline(0).timeout(5) == 0.001
+
+
+def test_check_raises_once_expired():
+    Deadline(1).check("stage")
+    with pytest.raises(DeadlineExceeded, match="before stage"):
+        Deadline(0).check("stage")
+
+
+def test_from_header_only_shortens_the_budget():
+    assert Deadline.from_header("500", 8).remaining() <= 0.5
+    assert Deadline.from_header("60000", 8).remaining() <= 8
+    assert Deadline.from_header("not a number", 8).remaining() > 7.9
+    assert Deadline.from_header(None, 8).remaining() > 7.9
+    assert Deadline.from_header("-100", 8).expired()
+
+
+# --- Circuit Breaker ---
+def open_breaker(reset_seconds=0.05):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=reset_seconds)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures_and_refuses_calls():
+    breaker = open_breaker(reset_seconds=30)
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_trial_through_and_closes_on_success():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # Only one trial at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_abandoned_trial_does_not_block_the_next_one_forever():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()  # Trial never reports back
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
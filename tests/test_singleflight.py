@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from agent_common.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.001)
+
+
+def test_followers_share_the_leader_result():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(2)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", work))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: flight.leaders + flight.followers == 4)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {"name": "test", "inFlight": 0, "leaders": 1, "followers": 3}
+
+
+def test_leader_error_reaches_every_follower():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    error = ValueError("upstream failed")
+
+    def work():
+        release.wait(2)
+        raise error
+
+    raised = []
+
+    def call():
+        try:
+            flight.do("key", work)
+        except ValueError as e:
+            raised.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: flight.followers == 2)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert raised == [error] * 3
+
+
+def test_nothing_is_cached_after_the_call():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise ValueError("first")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: "second") == "second"
+    assert flight.leaders == 2
+
+
+def test_async_followers_share_result_and_error():
+    async def scenario():
+        flight = AsyncSingleFlight("test")
+        release = asyncio.Event()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return "result"
+
+        async def failing():
+            await release.wait()
+            raise ValueError("upstream failed")
+
+        shared = [asyncio.ensure_future(flight.do("ok", work)) for _ in range(3)]
+        failed = [asyncio.ensure_future(flight.do("bad", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*shared)
+        errors = await asyncio.gather(*failed, return_exceptions=True)
+        return flight, calls, results, errors
+
+    flight, calls, results, errors = asyncio.run(scenario())
+    assert results == ["result"] * 3
+    assert len(calls) == 1
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert errors[0] is errors[1] is errors[2]
+    assert flight.stats() == {"name": "test", "inFlight": 0, "leaders": 2, "followers": 4}
+
+
+def test_async_follower_cancellation_does_not_cancel_the_leader():
+    async def scenario():
+        flight = AsyncSingleFlight("test")
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "result"
+
+        leader = asyncio.ensure_future(flight.do("key", work))
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        follower.cancel()
+        release.set()
+        return await leader, follower
+
+    result, follower = asyncio.run(scenario())
+    assert result == "result"
+    assert follower.cancelled()
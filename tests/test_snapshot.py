@@ -0,0 +1,75 @@
+import struct
+
+import pytest
+
+from agent_common.snapshot import FORMAT_VERSION, Snapshot, SnapshotStore, write_snapshot
+
+ENTRIES = {
+    "happy": {"movies": [{"movieTitle": "Up"}]},
+    "sad|dinner": {"meals": [{"mealTitle": "Soup"}], "keywords": ["soup"]},
+    "cozy": ["a", "b"],
+}
+
+
+def test_write_map_lookup_round_trip(tmp_path):
+    path = str(tmp_path / "snap" / "movies.bin")
+    size = write_snapshot(path, "movies", ENTRIES, version="v1", metadata={"agent": "test"})
+
+    snapshot = Snapshot(path)
+    assert snapshot.size_bytes == size
+    assert snapshot.version == "v1"
+    assert snapshot.entries == len(ENTRIES)
+    assert snapshot.header["metadata"] == {"agent": "test"}
+    for key, value in ENTRIES.items():
+        assert snapshot.get(key) == value
+    assert snapshot.get("unknown") is None
+    assert dict(snapshot.items()) == ENTRIES
+    assert not (tmp_path / "snap" / "movies.bin.tmp").exists()
+
+
+def test_empty_snapshot(tmp_path):
+    path = str(tmp_path / "empty.bin")
+    write_snapshot(path, "empty", {})
+    assert Snapshot(path).get("happy") is None
+
+
+def test_format_version_mismatch_is_rejected(tmp_path):
+    path = tmp_path / "old.bin"
+    write_snapshot(str(path), "movies", ENTRIES)
+    data = bytearray(path.read_bytes())
+    struct.pack_into("<I", data, 8, FORMAT_VERSION + 1)
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match=f"format {FORMAT_VERSION + 1}"):
+        Snapshot(str(path))
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "not_a_snapshot.bin"
+    path.write_bytes(b"{\"happy\": 1}" * 4)
+    with pytest.raises(ValueError, match="not a recommendation snapshot"):
+        Snapshot(str(path))
+
+
+def test_store_counts_hits_and_skips_stale_snapshots(tmp_path):
+    path = str(tmp_path / "movies.bin")
+    write_snapshot(path, "movies", ENTRIES, version="v1")
+
+    store = SnapshotStore("movies", path)
+    assert store.get("happy") is None  # Not opened yet
+    assert store.open()
+    assert not store.open()  # Unchanged file isn't mapped again
+    assert store.get("happy") == ENTRIES["happy"]
+    assert store.get("unknown") is None
+    assert (store.hits, store.misses) == (1, 1)
+
+    stale = SnapshotStore("movies", path, max_age_seconds=-1)
+    stale.open()
+    assert stale.get("happy") is None
+    assert stale.stale == 1
+
+
+def test_store_without_file_serves_nothing(tmp_path):
+    store = SnapshotStore("movies", str(tmp_path / "missing.bin"))
+    assert not store.open()
+    assert store.get("happy") is None
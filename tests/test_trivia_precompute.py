@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trivia-agent"))
+from trivia_precompute import TriviaPrecomputer, trivia_key  # noqa: E402
+
+MEAL = {"mealTitle": "Tomato <b>Soup</b>", "mealDescription": "Warm and <i>cozy</i>."}
+MOVIE = {"movieTitle": "Up", "movieDescription": "A house flies away."}
+
+
+class FakeTriviaCache:
+    """Stands in for the agent's trivia cache and Gemini: facts per trivia_key."""
+
+    def __init__(self):
+        self.facts = {}
+        self.calls = []
+
+    def cached_facts(self, meal_data=None, movie_data=None):
+        return self.facts.get(trivia_key(meal_data, movie_data), [])
+
+    def generate_fact(self, meal_data=None, movie_data=None):
+        self.calls.append((meal_data, movie_data))
+        key = trivia_key(meal_data, movie_data)
+        self.facts.setdefault(key, []).append(f"fact {len(self.facts[key])}")
+
+
+def make_precomputer(cache, **kwargs):
+    return TriviaPrecomputer(cache.cached_facts, cache.generate_fact, facts_per_key=2, min_count=2, **kwargs)
+
+
+def test_trivia_key_ignores_markup():
+    assert trivia_key(MEAL, None) == trivia_key({**MEAL, "mealTitle": "Tomato Soup"}, None)
+    assert trivia_key(MEAL, MOVIE) != trivia_key(MEAL, None) != trivia_key(None, MOVIE)
+
+
+def test_popular_pairs_are_warmed_under_the_pair_key():
+    cache = FakeTriviaCache()
+    precomputer = make_precomputer(cache)
+    for _ in range(2):
+        precomputer.record(MEAL, MOVIE)
+    precomputer.record(MEAL, None)  # Seen once: not popular yet
+
+    assert precomputer.run_once() == 2
+    assert len(cache.cached_facts(MEAL, MOVIE)) == 2
+    assert cache.cached_facts(MEAL, None) == []
+    assert cache.cached_facts(None, MOVIE) == []
+
+
+def test_full_keys_are_not_topped_up_again():
+    cache = FakeTriviaCache()
+    precomputer = make_precomputer(cache)
+    for _ in range(3):
+        precomputer.record(None, MOVIE)
+    precomputer.run_once()
+    assert precomputer.run_once() == 0
+    assert len(cache.calls) == 2
+
+
+def test_calls_per_run_are_capped():
+    cache = FakeTriviaCache()
+    precomputer = make_precomputer(cache, max_calls_per_run=3)
+    for meal_data, movie_data in [(MEAL, MOVIE), (MEAL, None), (None, MOVIE)] * 2:
+        precomputer.record(meal_data, movie_data)
+    assert precomputer.run_once() == 3
+    assert precomputer.stats()["popularKeys"] == 3
+
+
+def test_tracked_keys_are_bounded():
+    precomputer = make_precomputer(FakeTriviaCache(), max_tracked=10)
+    for i in range(25):
+        precomputer.record({"mealTitle": f"Meal {i}", "mealDescription": ""}, None)
+    assert precomputer.stats()["trackedKeys"] <= 10
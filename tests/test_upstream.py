@@ -0,0 +1,161 @@
+import asyncio
+import socket
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import requests
+
+from agent_common.async_upstream import AsyncUpstreamClient
+from agent_common.resilience import Deadline
+from agent_common.upstream import UpstreamClient, retry_after_seconds
+
+
+class StubUpstream:
+    """A local HTTP server answering each GET with the next (status, headers, delay) in its script."""
+
+    def __init__(self):
+        self.script = []
+        self.hits = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.hits += 1
+                status, headers, delay = stub.script.pop(0) if stub.script else (200, {}, 0)
+                time.sleep(delay)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    stub = StubUpstream()
+    yield stub
+    stub.close()
+
+
+def make_client(upstream, name, **kwargs):
+    settings = {"max_retries": 2, "backoff_factor": 0.01, "read_timeout": 5}
+    settings.update(kwargs)
+    return UpstreamClient(name, {upstream.url: 2}, **settings)
+
+
+def test_transient_statuses_are_retried(upstream):
+    upstream.script = [(503, {}, 0), (429, {}, 0)]
+    response = make_client(upstream, "test_retry").get(upstream.url)
+    assert response.status_code == 200
+    assert upstream.hits == 3
+
+
+def test_quota_errors_are_not_retried(upstream):
+    upstream.script = [(402, {}, 0)]
+    response = make_client(upstream, "test_quota").get(upstream.url)
+    assert response.status_code == 402
+    assert upstream.hits == 1
+
+
+def test_retries_stop_after_max_retries(upstream):
+    upstream.script = [(503, {}, 0)] * 5
+    response = make_client(upstream, "test_exhausted").get(upstream.url)
+    assert response.status_code == 503
+    assert upstream.hits == 3
+
+
+def test_retry_after_past_the_deadline_returns_the_response(upstream):
+    upstream.script = [(429, {"Retry-After": "30"}, 0)]
+    started = time.monotonic()
+    response = make_client(upstream, "test_retry_after").get(upstream.url, deadline=Deadline(1))
+    assert response.status_code == 429
+    assert upstream.hits == 1
+    assert time.monotonic() - started < 0.5
+
+
+def test_read_timeout_is_capped_at_the_deadline(upstream):
+    upstream.script = [(200, {}, 1)]
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        make_client(upstream, "test_deadline").get(upstream.url, deadline=Deadline(0.2))
+    assert time.monotonic() - started < 0.8
+
+
+def test_expired_deadline_fails_without_calling(upstream):
+    with pytest.raises(requests.exceptions.Timeout):
+        make_client(upstream, "test_expired").get(upstream.url, deadline=Deadline(0))
+    assert upstream.hits == 0
+
+
+def test_open_circuit_refuses_calls(upstream, monkeypatch):
+    monkeypatch.setenv("TEST_CIRCUIT_CIRCUIT_FAILURES", "2")
+    upstream.script = [(500, {}, 0)] * 2
+    client = make_client(upstream, "test_circuit", max_retries=0)
+    for _ in range(2):
+        assert client.get(upstream.url).status_code == 500
+    with pytest.raises(requests.exceptions.ConnectionError, match="open"):
+        client.get(upstream.url)
+    assert upstream.hits == 2
+
+
+def test_retry_after_seconds_parses_delta_and_date():
+    response = requests.Response()
+    assert retry_after_seconds(response) == 0
+    response.headers["Retry-After"] = "2.5"
+    assert retry_after_seconds(response) == 2.5
+    response.headers["Retry-After"] = formatdate(time.time() + 10, usegmt=True)
+    assert 8 < retry_after_seconds(response) <= 10
+    response.headers["Retry-After"] = "soon"
+    assert retry_after_seconds(response) == 0
+
+
+def async_get(client, url, **kwargs):
+    async def run():
+        try:
+            return await client.get(url, **kwargs)
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+
+def test_async_read_timeout_is_not_retried(upstream):
+    upstream.script = [(200, {}, 0.5)] * 3
+    client = AsyncUpstreamClient("test_async_read_timeout", max_retries=2, backoff_factor=0.01, read_timeout=0.1)
+    with pytest.raises(httpx.ReadTimeout):
+        async_get(client, upstream.url)
+    assert upstream.hits == 1
+
+
+def test_async_connect_errors_are_retried(monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        url = f"http://127.0.0.1:{probe.getsockname()[1]}/"
+    client = AsyncUpstreamClient("test_async_connect", max_retries=2, backoff_factor=0.01)
+    attempts = []
+    real_get = httpx.AsyncClient.get
+
+    async def counted_get(self, *args, **kwargs):
+        attempts.append(args)
+        return await real_get(self, *args, **kwargs)
+
+    monkeypatch.setattr(httpx.AsyncClient, "get", counted_get)
+    with pytest.raises(httpx.ConnectError):
+        async_get(client, url)
+    assert len(attempts) == 3
@@ -0,0 +1,143 @@
+"""
+Async (ASGI) serving mode for the Trivia Agent.
+
+Serves the same /get_trivia contract as main.py, but the Gemini call is awaited
+instead of holding a worker thread, so one instance can keep many slow generations
+in flight. The prompt and the trivia cache are shared with main.py.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+from quart import Quart, request, jsonify, Response
+from quart_cors import cors
+
+import main as agent
+from agent_common.admission import Overloaded
+from agent_common.cache import call_with_caches
+from agent_common.metrics import count_inference_source, install_async_metrics, span
+from agent_common.payloads import install_async_payload_handling
+from agent_common.startup import install_async_readiness_gate
+
+# --- Quart App Setup ---
+app = Quart(__name__)
+app = cors(app, allow_origin="*") # Enable CORS for all routes
+
+# The trivia cache is read and written through main's helpers; off the event loop when it uses Redis
+TRIVIA_CACHES = (agent.trivia_cache,)
+install_async_metrics(app, 'trivia-agent')
+install_async_payload_handling(app, 'trivia-agent')
+install_async_readiness_gate(app, agent.startup, exempt_endpoints=['cache_stats', 'metrics'])
+
+# --- Async Trivia Generation Logic ---
+async def generate_trivia_async(meal_data=None, movie_data=None):
+    """Async version of main.generate_trivia using Gemini's async generation API (same trivia cache)."""
+    full_prompt = agent.build_trivia_prompt(meal_data, movie_data)
+    if full_prompt is None:
+        return agent.NO_TRIVIA_INPUT_MESSAGE
+
+    agent.trivia_precomputer.record(meal_data, movie_data)
+    trivia_fact = await call_with_caches(TRIVIA_CACHES, agent.cached_trivia, meal_data, movie_data)
+    if trivia_fact:
+        print(f"Trivia cache hit: {trivia_fact}")
+        count_inference_source('cache')
+        return trivia_fact
+
+    count_inference_source('gemini')
+    try:
+        async with agent.gemini_limiter.admit_async():
+            with span('gemini_inference'):
+                gemini_response = await full_prompt.generate_async()
+        with span('parse'):
+            trivia_fact = gemini_response.candidates[0].content.parts[0].text.strip()
+        if not trivia_fact:
+            raise ValueError("Gemini returned an empty response.")
+        await call_with_caches(TRIVIA_CACHES, agent.remember_fact, meal_data, movie_data, trivia_fact)
+        print(f"Gemini generated trivia: {trivia_fact}")
+        return trivia_fact
+    except Exception as e:
+        return await call_with_caches(TRIVIA_CACHES, agent.trivia_after_gemini_error, meal_data, movie_data, e)
+
+async def cached_trivia_events_async(trivia_fact):
+    for event in agent.cached_trivia_events(trivia_fact):
+        yield event
+
+async def stream_trivia_async(meal_data=None, movie_data=None):
+    """Async version of main.stream_trivia."""
+    stream = agent.TriviaStream(meal_data, movie_data)
+    try:
+        full_prompt = agent.build_trivia_prompt(meal_data, movie_data)
+        async with agent.gemini_limiter.admit_async():
+            with span('gemini_inference_stream'):
+                async for chunk in full_prompt.stream_async():
+                    event = stream.token_event(chunk)
+                    if event:
+                        yield event
+    except Exception as e:
+        for event in await call_with_caches(TRIVIA_CACHES, stream.failed_events, e):
+            yield event
+        return
+    yield await call_with_caches(TRIVIA_CACHES, stream.done_event)
+
+# --- Quart Routes ---
+@app.route('/get_trivia', methods=['POST'])
+async def get_trivia_endpoint():
+    """
+    Async HTTP endpoint for the Trivia Agent.
+    Expects a JSON payload that can optionally contain 'meal' and/or 'movie' objects.
+    """
+    try:
+        data = await request.get_json()
+        meal = data.get('meal')
+        movie = data.get('movie')
+
+        if not meal and not movie:
+            return jsonify({"error": "Missing 'meal' or 'movie' data in request body"}), 400
+
+        trivia = await generate_trivia_async(meal_data=meal, movie_data=movie)
+        with span('serialize'):
+            return jsonify({"triviaFact": trivia}), 200
+
+    except Overloaded as e:
+        print(f"Shedding get_trivia request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        print(f"Unhandled error in get_trivia endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_trivia_stream', methods=['POST'])
+async def get_trivia_stream_endpoint():
+    """
+    Async streaming variant of /get_trivia. Takes the same JSON payload and answers with
+    text/event-stream: "token" events as the fact is generated, then "done" or "error".
+    """
+    try:
+        data = await request.get_json()
+        meal = data.get('meal')
+        movie = data.get('movie')
+
+        if not meal and not movie:
+            return jsonify({"error": "Missing 'meal' or 'movie' data in request body"}), 400
+
+        agent.trivia_precomputer.record(meal, movie)
+        trivia_fact = await call_with_caches(TRIVIA_CACHES, agent.cached_trivia, meal, movie)
+        if not trivia_fact:
+            try:
+                agent.gemini_limiter.check()
+            except Overloaded as e:
+                trivia_fact = await call_with_caches(TRIVIA_CACHES, agent.trivia_after_gemini_error, meal, movie, e)
+        count_inference_source('cache' if trivia_fact else 'gemini')
+        events = cached_trivia_events_async(trivia_fact) if trivia_fact else stream_trivia_async(meal, movie)
+        response = Response(events, mimetype="text/event-stream", headers=agent.SSE_HEADERS)
+        response.timeout = None # Quart's default response timeout would cut off long streams
+        return response
+
+    except Overloaded as e:
+        print(f"Shedding get_trivia_stream request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        print(f"Unhandled error in get_trivia_stream endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cache_stats', methods=['GET'])
+async def cache_stats():
+    """Reports trivia cache and precompute counters."""
+    return jsonify(agent.cache_report()), 200
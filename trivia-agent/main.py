@@ -1,63 +1,259 @@
 import os
+import json
+import random
 import requests # Though not directly used for external APIs yet, good to include if needed later
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 
-from google.cloud import aiplatform
-from vertexai.preview.generative_models import GenerativeModel
+from agent_common.admission import Overloaded, admission_limiter, admission_report
+from agent_common.cache import cache_from_env
+from agent_common.metrics import count_fallback, count_inference_source, install_metrics, span
+from agent_common.payloads import install_payload_handling
+from agent_common.prompts import PromptTemplate
+from agent_common.runtime import init_vertex_ai
+from agent_common.startup import Startup, install_readiness_gate
+from trivia_precompute import TriviaPrecomputer, trivia_item, trivia_key
 
 # --- Flask App Setup ---
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
 
-# --- Configuration ---
-# GCP Project ID
-PROJECT_ID = os.environ.get('GCP_PROJECT_ID', 'moodfusion-hackathon')
-REGION = os.environ.get('GCP_REGION', 'us-central1')
+# --- Gemini Prompt ---
+# Bound to its Gemini model by the startup steps below, so the heavy google.cloud imports don't delay binding the port.
+TRIVIA_PROMPT = PromptTemplate("trivia", """
+Generate one interesting, short and surprising trivia fact based on the meal and/or movie below.
+Keep it concise and engaging: a single sentence, or two very short sentences. Do not start with "Did you know" or similar phrases.
+""", "{subjects}\n\nTrivia Fact:", max_output_tokens=int(os.environ.get('TRIVIA_MAX_OUTPUT_TOKENS', 128)))
 
-# --- Vertex AI (Gemini) Client ---
-aiplatform.init(project=PROJECT_ID, location=REGION)
-model = GenerativeModel('gemini-2.0-flash')
+def init_gemini_prompts():
+    TRIVIA_PROMPT.prepare()
+
+# Bounds concurrent Gemini generations; beyond the limit and its wait queue, requests are shed with 503
+gemini_limiter = admission_limiter('gemini')
 
 # --- Trivia Generation Logic ---
-def generate_trivia(meal_data=None, movie_data=None):
+NO_TRIVIA_INPUT_MESSAGE = "No specific meal or movie provided for trivia."
+TRIVIA_ERROR_MESSAGE = "Could not generate trivia fact at this time."
+
+def build_trivia_prompt(meal_data=None, movie_data=None):
     """
-    Generates a trivia fact based on meal and/or movie data using Gemini.
+    Builds the Gemini trivia prompt from meal and/or movie data, with descriptions reduced
+    to capped plain text (Spoonacular summaries are HTML). Returns None if neither is provided.
     """
-    prompt_parts = []
-    
+    subjects = []
+
     if meal_data:
-        meal_title = meal_data.get('mealTitle', 'a meal')
-        meal_description = meal_data.get('mealDescription', '')
-        prompt_parts.append(f"Regarding the meal '{meal_title}' which is described as: {meal_description}")
-        
+        meal = trivia_item('meal', meal_data)
+        subjects.append(f"Meal: '{meal['mealTitle'] or 'a meal'}', described as: {meal['mealDescription']}")
+
     if movie_data:
-        movie_title = movie_data.get('movieTitle', 'a movie')
-        movie_description = movie_data.get('movieDescription', '')
-        prompt_parts.append(f"Regarding the movie '{movie_title}' which is described as: {movie_description}")
-
-    if not prompt_parts:
-        return "No specific meal or movie provided for trivia."
-
-    # Constructing the prompt for Gemini
-    full_prompt = (
-        "Generate one interesting, short, and surprising trivia fact based on the following information. "
-        "The fact should be concise and engaging. Do not start with 'Did you know' or similar phrases. "
-        "Keep it to a single sentence, or two very short sentences.\n\n" +
-        "\n".join(prompt_parts) +
-        "\n\nTrivia Fact:"
-    )
+        movie = trivia_item('movie', movie_data)
+        subjects.append(f"Movie: '{movie['movieTitle'] or 'a movie'}', described as: {movie['movieDescription']}")
 
-    try:
-        gemini_response = model.generate_content(full_prompt)
+    if not subjects:
+        return None
+    return TRIVIA_PROMPT.render(subjects="\n".join(subjects))
+
+# --- Trivia Cache ---
+# Keyed by a hash of the normalized meal/movie inputs. Each entry holds up to
+# TRIVIA_FACTS_PER_KEY facts: Gemini is asked again until the entry is full, so
+# repeat requests still see some variety, and from then on it is served from cache.
+TRIVIA_FACTS_PER_KEY = int(os.environ.get('TRIVIA_CACHE_FACTS_PER_KEY', 3))
+trivia_cache = cache_from_env('trivia', prefix='TRIVIA_CACHE', max_entries=4096, ttl_seconds=7 * 24 * 3600)
+
+def cached_facts(meal_data=None, movie_data=None):
+    return trivia_cache.get(trivia_key(meal_data, movie_data)) or []
+
+def remember_fact(meal_data, movie_data, trivia_fact):
+    """Adds a fact to its entry, keeping the newest TRIVIA_FACTS_PER_KEY distinct facts."""
+    key = trivia_key(meal_data, movie_data)
+    facts = [fact for fact in trivia_cache.get(key) or [] if fact != trivia_fact]
+    trivia_cache.set(key, (facts + [trivia_fact])[-TRIVIA_FACTS_PER_KEY:])
+
+def cached_trivia(meal_data=None, movie_data=None):
+    """Returns a cached fact for these inputs once their entry is full, or None if Gemini should be asked."""
+    facts = cached_facts(meal_data, movie_data)
+    if len(facts) >= TRIVIA_FACTS_PER_KEY:
+        return random.choice(facts)
+    return None
+
+def fallback_trivia(meal_data, movie_data, e):
+    """
+    A fact to serve when Gemini is shed or fails: one already cached for these inputs (the
+    background precompute keeps popular ones warm) or, for a meal+movie pair, one cached
+    about either title alone. None if there is none.
+    """
+    facts = cached_facts(meal_data, movie_data)
+    if not facts and meal_data and movie_data:
+        facts = cached_facts(meal_data, None) + cached_facts(None, movie_data)
+    if not facts:
+        return None
+    trivia_fact = random.choice(facts)
+    print(f"Gemini unavailable ({e}); serving cached trivia: {trivia_fact}")
+    count_fallback('cached_trivia')
+    return trivia_fact
+
+def trivia_after_gemini_error(meal_data, movie_data, e):
+    """
+    The answer when Gemini is shed or fails: a fallback fact if there is one, otherwise
+    Overloaded is re-raised (the request is answered with 503) and other errors get
+    TRIVIA_ERROR_MESSAGE.
+    """
+    trivia_fact = fallback_trivia(meal_data, movie_data, e)
+    if trivia_fact:
+        return trivia_fact
+    if isinstance(e, Overloaded):
+        raise e
+    print(f"Error generating trivia with Gemini: {e}")
+    count_fallback('trivia_error')
+    return TRIVIA_ERROR_MESSAGE
+
+def ask_gemini_for_trivia(meal_data=None, movie_data=None, trivia_prompt=None):
+    """Generates one new fact with Gemini and caches it. Raises on failure, Overloaded if Gemini is saturated."""
+    trivia_prompt = trivia_prompt or build_trivia_prompt(meal_data, movie_data)
+    with gemini_limiter.admit():
+        with span('gemini_inference'):
+            gemini_response = trivia_prompt.generate()
+    with span('parse'):
         trivia_fact = gemini_response.candidates[0].content.parts[0].text.strip()
+    if not trivia_fact:
+        raise ValueError("Gemini returned an empty response.")
+    remember_fact(meal_data, movie_data, trivia_fact)
+    return trivia_fact
+
+def generate_trivia(meal_data=None, movie_data=None):
+    """
+    Generates a trivia fact based on meal and/or movie data using Gemini,
+    answering from the trivia cache when it can.
+    """
+    trivia_prompt = build_trivia_prompt(meal_data, movie_data)
+    if trivia_prompt is None:
+        return NO_TRIVIA_INPUT_MESSAGE
+
+    trivia_precomputer.record(meal_data, movie_data)
+    trivia_fact = cached_trivia(meal_data, movie_data)
+    if trivia_fact:
+        print(f"Trivia cache hit: {trivia_fact}")
+        count_inference_source('cache')
+        return trivia_fact
+
+    count_inference_source('gemini')
+    try:
+        trivia_fact = ask_gemini_for_trivia(meal_data, movie_data, trivia_prompt)
         print(f"Gemini generated trivia: {trivia_fact}")
         return trivia_fact
     except Exception as e:
-        print(f"Error generating trivia with Gemini: {e}")
-        return "Could not generate trivia fact at this time."
+        return trivia_after_gemini_error(meal_data, movie_data, e)
+
+# --- Background Precompute ---
+trivia_precomputer = TriviaPrecomputer(
+    cached_facts,
+    ask_gemini_for_trivia,
+    facts_per_key=TRIVIA_FACTS_PER_KEY,
+    top_n=int(os.environ.get('TRIVIA_PRECOMPUTE_TOP_N', 50)),
+    min_count=int(os.environ.get('TRIVIA_PRECOMPUTE_MIN_COUNT', 2)),
+    interval_seconds=float(os.environ.get('TRIVIA_PRECOMPUTE_INTERVAL_SECONDS', 600)),
+    max_calls_per_run=int(os.environ.get('TRIVIA_PRECOMPUTE_MAX_CALLS', 20)),
+)
+
+def start_trivia_precompute():
+    if os.environ.get('TRIVIA_PRECOMPUTE_ENABLED', 'true').lower() == 'true':
+        trivia_precomputer.start()
+
+# --- Startup ---
+startup = Startup('trivia-agent')
+startup.add_step('vertex_ai', init_vertex_ai)
+startup.add_step('gemini_prompts', init_gemini_prompts, depends_on=['vertex_ai'])
+startup.add_step('trivia_precompute', start_trivia_precompute, depends_on=['gemini_prompts'], critical=False)
+startup.start()
+install_metrics(app, 'trivia-agent')
+install_payload_handling(app, 'trivia-agent')
+install_readiness_gate(app, startup, exempt_endpoints=['cache_stats', 'metrics'])
+
+# --- Streaming Trivia Generation ---
+# Server-Sent Events: "token" events carry text as Gemini produces it, then exactly one
+# "done" event with the full fact or one "error" event ends the stream.
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no", # Keep proxies from buffering the stream
+}
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def chunk_text(chunk):
+    """Text of one streamed Gemini chunk (empty if the chunk carries no parts)."""
+    if not chunk.candidates or not chunk.candidates[0].content.parts:
+        return ""
+    return chunk.candidates[0].content.parts[0].text
+
+class TriviaStream:
+    """Accumulates streamed chunks and turns them into SSE events. The finished fact is cached."""
+
+    def __init__(self, meal_data=None, movie_data=None):
+        self.meal_data = meal_data
+        self.movie_data = movie_data
+        self.parts = []
+
+    def token_event(self, chunk):
+        text = chunk_text(chunk)
+        if not self.parts:
+            text = text.lstrip() # Matches the .strip() of the non-streaming response
+        if not text:
+            return None
+        self.parts.append(text)
+        return sse_event("token", {"text": text})
+
+    def done_event(self):
+        trivia_fact = "".join(self.parts).strip()
+        if not trivia_fact:
+            return self.error_event(ValueError("Gemini returned an empty response."))
+        print(f"Gemini streamed trivia: {trivia_fact}")
+        remember_fact(self.meal_data, self.movie_data, trivia_fact)
+        return sse_event("done", {"triviaFact": trivia_fact})
+
+    def error_event(self, e):
+        print(f"Error streaming trivia with Gemini: {e}")
+        count_fallback('trivia_error')
+        return sse_event("error", {"error": TRIVIA_ERROR_MESSAGE})
+
+    def failed_events(self, e):
+        """Ends a failed stream: with a fallback fact if no text was sent yet, else with an error event."""
+        trivia_fact = None if self.parts else fallback_trivia(self.meal_data, self.movie_data, e)
+        if trivia_fact:
+            return list(cached_trivia_events(trivia_fact))
+        return [self.error_event(e)]
+
+def cached_trivia_events(trivia_fact):
+    """A cached fact is sent as one token event followed by done."""
+    yield sse_event("token", {"text": trivia_fact})
+    yield sse_event("done", {"triviaFact": trivia_fact})
+
+def stream_trivia(meal_data=None, movie_data=None):
+    """Yields SSE events for the trivia fact as Gemini streams it."""
+    stream = TriviaStream(meal_data, movie_data)
+    try:
+        # Runs after the response headers are sent, so this stage only shows up in /metrics
+        with gemini_limiter.admit(), span('gemini_inference_stream'):
+            for chunk in build_trivia_prompt(meal_data, movie_data).stream():
+                event = stream.token_event(chunk)
+                if event:
+                    yield event
+    except Exception as e:
+        yield from stream.failed_events(e)
+        return
+    yield stream.done_event()
+
+def cache_report():
+    return {
+        "triviaCache": trivia_cache.stats(),
+        "triviaPrecompute": trivia_precomputer.stats(),
+        "prompts": [TRIVIA_PROMPT.stats()],
+        "admission": admission_report(),
+    }
 
-# --- Flask Route ---
+# --- Flask Routes ---
 @app.route('/get_trivia', methods=['POST'])
 def get_trivia_endpoint():
     """
@@ -73,12 +269,54 @@ def get_trivia_endpoint():
             return jsonify({"error": "Missing 'meal' or 'movie' data in request body"}), 400
 
         trivia = generate_trivia(meal_data=meal, movie_data=movie)
-        return jsonify({"triviaFact": trivia}), 200
+        with span('serialize'):
+            return jsonify({"triviaFact": trivia}), 200
 
+    except Overloaded as e:
+        print(f"Shedding get_trivia request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
     except Exception as e:
         print(f"Unhandled error in get_trivia endpoint: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/get_trivia_stream', methods=['POST'])
+def get_trivia_stream_endpoint():
+    """
+    Streaming variant of /get_trivia. Takes the same JSON payload and answers with
+    text/event-stream: "token" events as the fact is generated, then "done" or "error".
+    """
+    try:
+        data = request.get_json()
+        meal = data.get('meal')
+        movie = data.get('movie')
+
+        if not meal and not movie:
+            return jsonify({"error": "Missing 'meal' or 'movie' data in request body"}), 400
+
+        trivia_precomputer.record(meal, movie)
+        trivia_fact = cached_trivia(meal, movie)
+        if not trivia_fact:
+            try:
+                gemini_limiter.check()
+            except Overloaded as e:
+                trivia_fact = trivia_after_gemini_error(meal, movie, e)
+        count_inference_source('cache' if trivia_fact else 'gemini')
+        events = cached_trivia_events(trivia_fact) if trivia_fact else stream_trivia(meal, movie)
+        return Response(stream_with_context(events), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+    except Overloaded as e:
+        print(f"Shedding get_trivia_stream request: {e}")
+        return jsonify({"error": str(e)}), 503, {"Retry-After": e.retry_after_header()}
+    except Exception as e:
+        print(f"Unhandled error in get_trivia_stream endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Reports trivia cache and precompute counters."""
+    return jsonify(cache_report()), 200
+
 # --- Entry Point for Cloud Run ---
+# Local development only; the images serve the app through agent_common.runtime (gunicorn)
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
\ No newline at end of file
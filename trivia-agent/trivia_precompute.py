@@ -0,0 +1,122 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from agent_common.cache import make_key
+from agent_common.prompts import prompt_text
+
+TITLE_MAX_CHARS = 120
+
+
+def trivia_item(kind, data):
+    """
+    Reduces a meal or movie payload to the fields the trivia prompt reads, as the capped plain
+    text it sends, so payloads that differ only in markup or past the cap share cache entries.
+    """
+    if kind == "meal":
+        return {"mealTitle": prompt_text(data.get("mealTitle"), TITLE_MAX_CHARS), "mealDescription": prompt_text(data.get("mealDescription"))}
+    return {"movieTitle": prompt_text(data.get("movieTitle"), TITLE_MAX_CHARS), "movieDescription": prompt_text(data.get("movieDescription"))}
+
+
+def trivia_key(meal_data=None, movie_data=None):
+    """Content hash of the inputs the trivia prompt reads: the trivia cache key."""
+    meal = trivia_item("meal", meal_data).values() if meal_data else ()
+    movie = trivia_item("movie", movie_data).values() if movie_data else ()
+    return hashlib.sha256(make_key("meal", *meal, "movie", *movie).encode()).hexdigest()
+
+
+class TriviaPrecomputer:
+    """
+    Counts how often each meal, movie or meal + movie pair is asked about, by its trivia cache
+    key, and keeps trivia for the most popular ones generated ahead of time. A background
+    thread periodically tops up every popular key to facts_per_key cached facts, spending at
+    most max_calls_per_run Gemini calls per pass.
+    """
+
+    def __init__(self, cached_facts, generate_fact, facts_per_key=3, top_n=50, min_count=2,
+                 interval_seconds=600, max_calls_per_run=20, max_tracked=5000):
+        self._cached_facts = cached_facts    # cached_facts(meal_data, movie_data) -> list of facts
+        self._generate_fact = generate_fact  # generate_fact(meal_data, movie_data) -> new fact, cached; raises on failure
+        self.facts_per_key = facts_per_key
+        self.top_n = top_n
+        self.min_count = min_count
+        self.interval_seconds = interval_seconds
+        self.max_calls_per_run = max_calls_per_run
+        self.max_tracked = max_tracked
+        self._counts = Counter()
+        self._items = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_run_at = None
+        self.generated = 0
+        self.failures = 0
+
+    def record(self, meal_data=None, movie_data=None):
+        """Counts one request for the inputs it asks about, as one trivia cache key."""
+        if not meal_data and not movie_data:
+            return
+        key = trivia_key(meal_data, movie_data)
+        inputs = (trivia_item("meal", meal_data) if meal_data else None, trivia_item("movie", movie_data) if movie_data else None)
+        with self._lock:
+            self._counts[key] += 1
+            self._items[key] = inputs
+            if len(self._counts) > self.max_tracked:
+                # Keep the more popular half so the counter can't grow without bound
+                kept = dict(self._counts.most_common(self.max_tracked // 2))
+                self._counts = Counter(kept)
+                self._items = {key: self._items[key] for key in kept}
+
+    def popular(self):
+        """(meal, movie) inputs of the top_n keys requested at least min_count times, most popular first."""
+        with self._lock:
+            return [self._items[key] for key, count in self._counts.most_common(self.top_n) if count >= self.min_count]
+
+    def run_once(self):
+        """Tops up cached trivia for popular keys. Returns the number of facts generated."""
+        started = time.monotonic()
+        calls = 0
+        generated = 0
+        for meal_data, movie_data in self.popular():
+            missing = self.facts_per_key - len(self._cached_facts(meal_data, movie_data))
+            for _ in range(max(0, missing)):
+                if calls >= self.max_calls_per_run:
+                    break
+                calls += 1
+                try:
+                    self._generate_fact(meal_data, movie_data)
+                    generated += 1
+                except Exception as e:
+                    self.failures += 1
+                    print(f"Trivia precompute failed for {meal_data} / {movie_data}: {e}")
+        self.generated += generated
+        self._last_run_at = time.time()
+        print(f"Trivia precompute generated {generated} facts in {time.monotonic() - started:.2f}s ({calls} Gemini calls).")
+        return generated
+
+    def start(self):
+        """Starts the background precompute loop."""
+        def run():
+            while not self._stop.wait(self.interval_seconds):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"Trivia precompute crashed: {e}")
+
+        self._thread = threading.Thread(target=run, name="trivia-precompute", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._counts)
+        return {
+            "trackedKeys": tracked,
+            "popularKeys": len(self.popular()),
+            "generated": self.generated,
+            "failures": self.failures,
+            "lastRunAt": self._last_run_at,
+        }